@@ -0,0 +1,156 @@
+# backend/app/chat_cache.py
+"""
+Кэш участников чатов и данных для push-уведомлений (FCM токен, имя).
+
+Горячий путь сообщения обращается к БД только за вставкой самого сообщения:
+состав чата и токены получателей берутся отсюда. Записи живут не дольше
+CHAT_CACHE_TTL_SECONDS и вытесняются по LRU; изменения, сделанные через API,
+сбрасывают нужные записи сразу. На других узлах запись устаревает максимум на TTL.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, NamedTuple, Optional, FrozenSet
+
+from sqlalchemy import select
+
+from . import models
+from .database import AsyncSessionLocal
+
+CHAT_CACHE_TTL_SECONDS = float(os.getenv("CHAT_CACHE_TTL_SECONDS", "60"))
+CHAT_CACHE_MAX_CHATS = int(os.getenv("CHAT_CACHE_MAX_CHATS", "10000"))
+CHAT_CACHE_MAX_USERS = int(os.getenv("CHAT_CACHE_MAX_USERS", "50000"))
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Словарь с ограничением размера (LRU) и временем жизни записей.
+    Синхронные роуты работают в пуле потоков, поэтому доступ под блокировкой.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class PushProfile(NamedTuple):
+    username: str
+    fcm_token: Optional[str]
+
+
+class ChatDirectory:
+    """Участники чатов и push-данные пользователей. Ключи — строковые UUID."""
+
+    def __init__(
+            self,
+            session_factory=AsyncSessionLocal,
+            ttl_seconds: float = CHAT_CACHE_TTL_SECONDS,
+            max_chats: int = CHAT_CACHE_MAX_CHATS,
+            max_users: int = CHAT_CACHE_MAX_USERS,
+    ):
+        self.session_factory = session_factory
+        self.members = TTLCache(max_chats, ttl_seconds)
+        self.profiles = TTLCache(max_users, ttl_seconds)
+        self.db_loads = 0
+
+    async def chat_members(self, chat_id: str) -> Optional[FrozenSet[str]]:
+        """Участники чата; None — если такого чата нет."""
+        return (await self.chats_members([chat_id])).get(chat_id)
+
+    async def chats_members(self, chat_ids: Iterable[str]) -> Dict[str, FrozenSet[str]]:
+        """Участники нескольких чатов; недостающие грузятся одним запросом. Несуществующих чатов в ответе нет."""
+        found = {}
+        missing = []
+        for chat_id in chat_ids:
+            members = self.members.get(chat_id, _MISSING)
+            if members is _MISSING:
+                missing.append(chat_id)
+            else:
+                found[chat_id] = members
+
+        if missing:
+            # Отсутствие чата не кэшируем: id чатов генерирует сервер, а create_chat
+            # иначе пришлось бы ждать истечения отрицательной записи
+            async with self.session_factory() as db:
+                rows = await db.execute(
+                    select(models.Chat.id, models.chat_participants.c.user_id)
+                    .outerjoin(models.chat_participants, models.chat_participants.c.chat_id == models.Chat.id)
+                    .where(models.Chat.id.in_(missing))
+                )
+            self.db_loads += 1
+            loaded: Dict[str, set] = {}
+            for chat_id, user_id in rows:
+                members = loaded.setdefault(str(chat_id), set())
+                if user_id is not None:
+                    members.add(str(user_id))
+            for chat_id, members in loaded.items():
+                found[chat_id] = frozenset(members)
+                self.members.set(chat_id, found[chat_id])
+        return found
+
+    async def push_profiles(self, user_ids: Iterable[str]) -> Dict[str, PushProfile]:
+        """Имя и FCM токен пользователей; недостающие грузятся одним запросом."""
+        found = {}
+        missing = []
+        for user_id in user_ids:
+            profile = self.profiles.get(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = profile
+
+        if missing:
+            async with self.session_factory() as db:
+                rows = await db.execute(
+                    select(models.User.id, models.User.username, models.User.fcm_token)
+                    .where(models.User.id.in_(missing))
+                )
+            self.db_loads += 1
+            for user_id, username, fcm_token in rows:
+                found[str(user_id)] = PushProfile(username, fcm_token)
+                self.profiles.set(str(user_id), found[str(user_id)])
+        return found
+
+    def invalidate_chat(self, chat_id):
+        self.members.invalidate(str(chat_id))
+
+    def invalidate_user(self, user_id):
+        self.profiles.invalidate(str(user_id))
+
+
+chat_directory = ChatDirectory()
@@ -1,5 +1,6 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # Теперь URL базы данных читается из переменной окружения.
@@ -17,6 +18,23 @@ else:
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _to_async_url(url: str) -> str:
+    """Подставляет асинхронный драйвер: asyncpg для Postgres, aiosqlite для SQLite."""
+    scheme, sep, rest = url.partition("://")
+    dialect = scheme.split("+", 1)[0]
+    driver = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}.get(dialect)
+    return f"{dialect}+{driver}{sep}{rest}" if driver else url
+
+
+# Асинхронный движок для горячих путей (WebSocket), где блокирующий запрос
+# остановил бы event loop и все сокеты процесса.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _to_async_url(DATABASE_URL))
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+
+# expire_on_commit=False: объекты остаются читаемыми после commit без повторного запроса
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -25,3 +43,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as session:
+        yield session
@@ -0,0 +1,81 @@
+# backend/app/etags.py
+"""
+Условные GET-запросы (ETag / If-None-Match).
+
+Тег ответа считается из дешёвых счётчиков, а не из тела: для истории чата —
+chats.last_seq (растёт с каждым сообщением) и chats.version (растёт с каждой
+правкой уже отправленного сообщения), для списка чатов — агрегат тех же
+счётчиков и водяных знаков прочтения по строкам участия пользователя.
+Совпал тег — эндпоинт отвечает 304, не выполняя основной запрос.
+
+Теги слабые (W/): равенство означает, что не изменились данные, которые
+отдаёт эндпоинт, а не байты ответа. Профили собеседников (имя, аватар)
+в тег списка чатов не входят.
+"""
+import hashlib
+from typing import Optional
+from uuid import UUID as PyUUID
+
+from fastapi import Request, Response, status
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import models
+
+ETAG_HEADER = "ETag"
+IF_NONE_MATCH_HEADER = "If-None-Match"
+# Клиент может хранить ответ, но обязан перепроверять его при каждом запросе
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    raw = "|".join("" if part is None else str(part) for part in parts)
+    return f'W/"{hashlib.sha1(raw.encode()).hexdigest()[:20]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Есть ли etag среди тегов If-None-Match (сравнение слабое, как требует RFC 9110)."""
+    header = request.headers.get(IF_NONE_MATCH_HEADER)
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def cache_headers(etag: str) -> dict:
+    return {ETAG_HEADER: etag, "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag))
+
+
+def chat_version(db: Session, chat_id: PyUUID) -> Optional[tuple]:
+    """(last_seq, version) чата одним чтением по первичному ключу; None — чата нет."""
+    row = db.execute(
+        select(models.Chat.last_seq, models.Chat.version).where(models.Chat.id == chat_id)
+    ).first()
+    return tuple(row) if row is not None else None
+
+
+def inbox_version(db: Session, user_id: PyUUID) -> tuple:
+    """
+    Версия списка чатов пользователя: число чатов и суммы last_seq, version
+    и last_read_seq по ним. Любое новое сообщение, правка, прочтение или
+    новый чат меняют хотя бы одно слагаемое, а все они только растут.
+    """
+    participants = models.chat_participants.c
+    row = db.execute(
+        select(
+            func.count(),
+            func.coalesce(func.sum(models.Chat.last_seq), 0),
+            func.coalesce(func.sum(models.Chat.version), 0),
+            func.coalesce(func.sum(participants.last_read_seq), 0),
+        )
+        .select_from(models.chat_participants)
+        .join(models.Chat, models.Chat.id == participants.chat_id)
+        .where(participants.user_id == user_id)
+    ).one()
+    return tuple(row)
@@ -0,0 +1,59 @@
+# backend/app/export.py
+"""
+Потоковая выгрузка истории чата в NDJSON (по сообщению на строку).
+
+Сообщения читаются серверным курсором пачками по EXPORT_BATCH_SIZE строк
+(yield_per) и сразу уходят клиенту, поэтому память процесса не зависит от
+размера чата. Читаются только столбцы, без ORM-объектов. Сессия открывается
+внутри генератора: сессия запроса закрывается раньше, чем кончится поток.
+"""
+import os
+import zlib
+from typing import Iterable, Iterator
+from uuid import UUID as PyUUID
+
+from sqlalchemy import select
+
+from . import models
+from .database import SessionLocal
+from .logger import logger
+from .responses import dump_json
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+_EXPORT_COLUMNS = (
+    models.Message.id,
+    models.Message.chat_id,
+    models.Message.sender_id,
+    models.Message.seq,
+    models.Message.type,
+    models.Message.content,
+    models.Message.timestamp,
+    models.Message.reply_to_message_id,
+)
+
+
+def export_chat_lines(chat_id: PyUUID, session_factory=SessionLocal, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """Сообщения чата в порядке истории; каждый элемент — пачка строк NDJSON."""
+    exported = 0
+    with session_factory() as db:
+        result = db.execute(
+            select(*_EXPORT_COLUMNS)
+            .where(models.Message.chat_id == chat_id)
+            .order_by(models.Message.timestamp, models.Message.id)
+            .execution_options(yield_per=batch_size)
+        )
+        for rows in result.partitions():
+            exported += len(rows)
+            yield b"".join(dump_json(row._asdict()) + b"\n" for row in rows)
+    logger.info(f"Exported {exported} messages from chat {chat_id}")
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Сжимает поток в gzip по мере поступления."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
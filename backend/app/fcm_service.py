@@ -1,6 +1,10 @@
 # backend/app/fcm_service.py
+import asyncio
+import json
 import os
-from typing import List, Dict, Any, Optional
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Optional, Tuple
 import firebase_admin
 from firebase_admin import credentials, messaging
 from firebase_admin.exceptions import FirebaseError
@@ -13,6 +17,15 @@ SERVICE_ACCOUNT_KEY_PATH = os.path.join(os.path.dirname(__file__), 'service-acco
 # ID проекта оставляем для логирования, но не для инициализации
 PROJECT_ID = "langbridge-17ead"
 
+# FCM принимает не больше 500 токенов в одном multicast-запросе
+FCM_MULTICAST_LIMIT = 500
+# Сколько ждём, собирая уведомления для склейки, в миллисекундах
+PUSH_COALESCE_WINDOW_MS = float(os.getenv("PUSH_COALESCE_WINDOW_MS", "250"))
+# Потоки, в которых выполняются блокирующие вызовы FCM
+PUSH_WORKER_THREADS = int(os.getenv("PUSH_WORKER_THREADS", "4"))
+# Предел очереди: при переполнении новые уведомления отбрасываются
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", "10000"))
+
 if os.path.exists(SERVICE_ACCOUNT_KEY_PATH):
     try:
         cred = credentials.Certificate(SERVICE_ACCOUNT_KEY_PATH)
@@ -24,65 +37,264 @@ if os.path.exists(SERVICE_ACCOUNT_KEY_PATH):
 else:
     logger.warning(f"Firebase service account key not found at {SERVICE_ACCOUNT_KEY_PATH}. Push notifications will be disabled.")
 
+
+class PushSender(ABC):
+    """
+    Отправитель уведомлений. send_multicast вызывается из пула потоков,
+    поэтому может блокировать. Возвращает (успешно, с ошибкой).
+    """
+
+    @abstractmethod
+    def send_multicast(self, tokens: List[str], notification_data: Dict[str, Any], message_data: Dict[str, str]) -> Tuple[int, int]:
+        ...
+
+
+class FirebasePushSender(PushSender):
+    """Отправка через Firebase Admin SDK (HTTP v1 API)."""
+
+    def send_multicast(self, tokens, notification_data, message_data):
+        if not firebase_admin._apps:
+            logger.error("Firebase Admin SDK is not initialized. Skipping push notification.")
+            return 0, len(tokens)
+
+        notification = messaging.Notification(
+            title=notification_data.get("title"),
+            body=notification_data.get("body"),
+            image=notification_data.get("image")
+        )
+
+        apns_config = messaging.APNSConfig(
+            payload=messaging.APNSPayload(
+                aps=messaging.Aps(
+                    sound="default",
+                    content_available=True,
+                )
+            )
+        )
+
+        message = messaging.MulticastMessage(
+            tokens=tokens,
+            notification=notification,
+            data=message_data,
+            apns=apns_config
+        )
+
+        try:
+            # Используем `send_each_for_multicast`.
+            # Этот метод работает через новый HTTP v1 API и устойчив к проблемам с DNS.
+            response = messaging.send_each_for_multicast(message)
+            logger.info(f"Push notification sent via HTTP v1 API. Success: {response.success_count}, Failure: {response.failure_count}")
+
+            if response.failure_count > 0:
+                errors = []
+                for i, resp in enumerate(response.responses):
+                    if not resp.success:
+                        # Логируем ошибку для каждого неудачного токена
+                        errors.append(f"Token: {tokens[i]}, Error: {resp.exception}")
+                logger.error(f"Failed to send to some tokens: {'; '.join(errors)}")
+            return response.success_count, response.failure_count
+
+        except FirebaseError as e:
+            # Ловим специфичные ошибки Firebase
+            logger.error(f"A Firebase error occurred when sending push notification: {e}", exc_info=True)
+        except Exception as e:
+            # Ловим все остальные ошибки
+            logger.error(f"An unexpected error occurred when sending push notification: {e}", exc_info=True)
+        return 0, len(tokens)
+
+
+class PushJob:
+    """Уведомление для набора токенов. Задания с одинаковым coalesce_key склеиваются по токену."""
+
+    def __init__(self, tokens: List[str], notification_data: Dict[str, Any], message_data: Dict[str, str],
+                 coalesce_key: Optional[str] = None):
+        self.tokens = tokens
+        self.notification_data = notification_data
+        self.message_data = message_data
+        self.coalesce_key = coalesce_key
+
+
+def coalesce_jobs(jobs: List[PushJob]) -> List[Tuple[List[str], Dict[str, Any], Dict[str, str]]]:
+    """
+    Склеивает уведомления и группирует токены в multicast-пакеты.
+
+    Для каждой пары (токен, coalesce_key) остаётся только последнее уведомление,
+    а в его data добавляется coalesced_count. Затем токены с одинаковым
+    содержимым уведомления объединяются в пакеты не больше FCM_MULTICAST_LIMIT.
+    """
+    # { (token, key): [последнее задание, сколько было] }; задания без ключа не склеиваются
+    latest: Dict[tuple, list] = {}
+    for index, job in enumerate(jobs):
+        for token in job.tokens:
+            key = (token, job.coalesce_key if job.coalesce_key is not None else f"#{index}")
+            entry = latest.get(key)
+            if entry is None:
+                latest[key] = [job, 1]
+            else:
+                entry[0] = job
+                entry[1] += 1
+
+    # { содержимое уведомления: (notification, data, [токены]) }
+    groups: Dict[str, Tuple[Dict[str, Any], Dict[str, str], List[str]]] = {}
+    for (token, _), (job, count) in latest.items():
+        message_data = job.message_data
+        if count > 1:
+            message_data = {**message_data, "coalesced_count": str(count)}
+        group_key = json.dumps([job.notification_data, message_data], sort_keys=True)
+        groups.setdefault(group_key, (job.notification_data, message_data, []))[2].append(token)
+
+    batches = []
+    for notification_data, message_data, tokens in groups.values():
+        for start in range(0, len(tokens), FCM_MULTICAST_LIMIT):
+            batches.append((tokens[start:start + FCM_MULTICAST_LIMIT], notification_data, message_data))
+    return batches
+
+
+# Метка остановки в очереди уведомлений
+_STOP = object()
+
+
+class PushDispatcher:
+    """
+    Фоновая отправка push-уведомлений: очередь в процессе, склейка за короткое
+    окно и блокирующие вызовы отправителя в отдельном пуле потоков, чтобы
+    event loop не ждал HTTP-запрос к FCM.
+    """
+
+    def __init__(
+            self,
+            sender: Optional[PushSender] = None,
+            window_ms: float = PUSH_COALESCE_WINDOW_MS,
+            worker_threads: int = PUSH_WORKER_THREADS,
+            max_queue_size: int = PUSH_QUEUE_SIZE,
+    ):
+        self.sender = sender or FirebasePushSender()
+        self.window = window_ms / 1000
+        self.max_queue_size = max_queue_size
+        self._executor = ThreadPoolExecutor(max_workers=worker_threads, thread_name_prefix="push")
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._in_flight: set = set()
+        # Таймеры submit_later, ещё не сработавшие
+        self._timers: set = set()
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Отправляет уже принятые уведомления и останавливает диспетчер.
+        Отложенные через submit_later и ещё не поставленные отменяются.
+        """
+        if self._timers:
+            logger.info(f"Dropping {len(self._timers)} delayed push notifications on shutdown")
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        if self._task is None or self._task.done():
+            return
+        if self._loop is not asyncio.get_running_loop():
+            # Цикл, в котором шла отправка, уже не работает — дождаться её нельзя
+            self._task.cancel()
+            return
+        # Метка в конце очереди: всё, что принято до неё, будет отправлено
+        await self._queue.put(_STOP)
+        await self._task
+
+    def submit(self, job: PushJob) -> bool:
+        """Ставит уведомление в очередь, не дожидаясь отправки."""
+        self.start()
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"Push queue is full ({self.max_queue_size}), dropping notification")
+            return False
+
+    def submit_later(self, job: PushJob, delay: float, condition: Optional[Callable[[], bool]] = None):
+        """
+        Ставит уведомление в очередь через delay секунд. Если condition задан,
+        он проверяется в момент постановки, и при False уведомление отбрасывается.
+        """
+        self.start()
+
+        def fire():
+            self._timers.discard(timer)
+            if condition is None or condition():
+                self.submit(job)
+
+        timer = self._loop.call_later(delay, fire)
+        self._timers.add(timer)
+
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            if job is _STOP:
+                break
+            jobs = [job]
+            # Звонки и прочие несклеиваемые уведомления не ждут окна
+            if job.coalesce_key is not None and self.window:
+                await asyncio.sleep(self.window)
+            stopping = False
+            while not self._queue.empty():
+                job = self._queue.get_nowait()
+                if job is _STOP:
+                    stopping = True
+                    break
+                jobs.append(job)
+
+            for tokens, notification_data, message_data in coalesce_jobs(jobs):
+                task = asyncio.create_task(self._send(tokens, notification_data, message_data))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+            if stopping:
+                break
+
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    async def _send(self, tokens, notification_data, message_data):
+        try:
+            await self._loop.run_in_executor(
+                self._executor, self.sender.send_multicast, tokens, notification_data, message_data
+            )
+        except Exception as e:
+            logger.error(f"Push sender failed: {e}", exc_info=True)
+
+
+push_dispatcher = PushDispatcher()
+
+
 # Функция-обертка для отправки уведомлений
 async def send_push_notification(
         fcm_tokens: List[str],
         notification_data: Dict[str, Any],
-        message_data: Dict[str, Any]
+        message_data: Dict[str, Any],
+        delay: float = 0,
+        condition: Optional[Callable[[], bool]] = None,
 ):
     """
-    Отправляет push-уведомление на указанные FCM токены через Firebase Admin SDK.
+    Ставит push-уведомление на указанные FCM токены в очередь фоновой отправки.
+    Уведомления о новых сообщениях одного чата склеиваются по получателю.
+    С delay уведомление откладывается и уходит, только если condition() истинно.
     """
-    if not firebase_admin._apps:
-        logger.error("Firebase Admin SDK is not initialized. Skipping push notification.")
-        return
-
     valid_tokens = [token for token in fcm_tokens if token]
     if not valid_tokens:
         logger.warning("No valid FCM tokens provided to send_push_notification.")
         return
 
-    notification = messaging.Notification(
-        title=notification_data.get("title"),
-        body=notification_data.get("body"),
-        image=notification_data.get("image")
-    )
-
-    apns_config = messaging.APNSConfig(
-        payload=messaging.APNSPayload(
-            aps=messaging.Aps(
-                sound="default",
-                content_available=True,
-            )
-        )
-    )
+    coalesce_key = None
+    if message_data.get("type") == "new_message":
+        coalesce_key = f"new_message:{message_data.get('chat_id')}"
 
-    message = messaging.MulticastMessage(
-        tokens=valid_tokens,
-        notification=notification,
-        data=message_data,
-        apns=apns_config
-    )
-
-    try:
-        # Используем `send_each_for_multicast`.
-        # Этот метод работает через новый HTTP v1 API и устойчив к проблемам с DNS.
-        response = messaging.send_each_for_multicast(message)
-        logger.info(f"Push notification sent via HTTP v1 API. Success: {response.success_count}, Failure: {response.failure_count}")
-
-        if response.failure_count > 0:
-            errors = []
-            for i, resp in enumerate(response.responses):
-                if not resp.success:
-                    # Логируем ошибку для каждого неудачного токена
-                    token_index = valid_tokens.index(message.tokens[i]) if message.tokens[i] in valid_tokens else -1
-                    failed_token = valid_tokens[token_index] if token_index != -1 else "unknown"
-                    errors.append(f"Token: {failed_token}, Error: {resp.exception}")
-            logger.error(f"Failed to send to some tokens: {'; '.join(errors)}")
-
-    except FirebaseError as e:
-        # Ловим специфичные ошибки Firebase
-        logger.error(f"A Firebase error occurred when sending push notification: {e}", exc_info=True)
-    except Exception as e:
-        # Ловим все остальные ошибки
-        logger.error(f"An unexpected error occurred when sending push notification: {e}", exc_info=True)
+    job = PushJob(valid_tokens, notification_data, message_data, coalesce_key)
+    if delay > 0:
+        push_dispatcher.submit_later(job, delay, condition)
+    else:
+        push_dispatcher.submit(job)
@@ -0,0 +1,151 @@
+# backend/app/ingest.py
+"""
+Массовая загрузка сообщений (перенос истории, восстановление из копии).
+
+Тело запроса — NDJSON, читается потоком. Строки собираются в пакеты по
+INGEST_BATCH_SIZE и проверяются пакетом: схема каждой строки, затем одним
+запросом — что загружающий состоит в чатах, и одним — что цитируемые
+сообщения из того же чата. По умолчанию загружать можно только свои
+сообщения (sender_id совпадает с загружающим); с any_sender — сообщения
+любого участника чата, это право администратора (перенос переписки
+целиком). Годные строки пакета пишутся
+через insert_messages (многострочный INSERT, одно обновление сводки на
+чат) и фиксируются отдельной транзакцией; негодные попадают в отчёт.
+Если пакет не удалось записать, его строки тоже уходят в отчёт, а
+загрузка продолжается со следующего пакета.
+
+seq выдаётся в порядке загрузки: старая история получает номера после уже
+существующих сообщений (хронология — по timestamp). Загруженные сообщения
+помечаются imported — они не увеличивают число непрочитанных и не
+досылаются при переподключении с since_seq.
+"""
+import json
+import os
+from typing import AsyncIterator, Dict, List, Tuple
+from uuid import UUID as PyUUID
+
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import models, schemas
+from .database import AsyncSessionLocal
+from .logger import logger
+from .message_writer import insert_messages, new_message_values
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+# Сколько ошибок максимум перечисляется в отчёте
+INGEST_MAX_ERRORS = int(os.getenv("INGEST_MAX_ERRORS", "100"))
+
+
+async def ndjson_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+    """(номер строки, строка) из потока байтов; пустые строки пропускаются."""
+    buffer = b""
+    number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            number += 1
+            if line.strip():
+                yield number, line
+    if buffer.strip():
+        yield number + 1, buffer
+
+
+class MessageIngest:
+    """Один запрос загрузки: пакеты, отчёт и итог по чатам (для события в WS)."""
+
+    def __init__(
+            self,
+            uploader_id: PyUUID,
+            session_factory=AsyncSessionLocal,
+            batch_size: int = INGEST_BATCH_SIZE,
+            any_sender: bool = False,
+    ):
+        self.uploader_id = uploader_id
+        # Разрешены ли сообщения других участников чата (проверяет вызывающий)
+        self.any_sender = any_sender
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.accepted = 0
+        self.rejected = 0
+        self.errors: List[schemas.IngestError] = []
+        # chat_id -> (сколько загружено, последний seq)
+        self.chats: Dict[PyUUID, Tuple[int, int]] = {}
+
+    def _reject(self, line: int, detail: str):
+        self.rejected += 1
+        if len(self.errors) < INGEST_MAX_ERRORS:
+            self.errors.append(schemas.IngestError(line=line, detail=detail))
+
+    async def run(self, lines: AsyncIterator[Tuple[int, bytes]]) -> schemas.IngestReport:
+        batch: List[Tuple[int, schemas.MessageIngestItem]] = []
+        async for number, line in lines:
+            try:
+                batch.append((number, schemas.MessageIngestItem.model_validate(json.loads(line))))
+            except ValidationError as e:
+                error = e.errors()[0]
+                self._reject(number, f"{'.'.join(map(str, error['loc'])) or 'line'}: {error['msg']}")
+                continue
+            except ValueError:
+                self._reject(number, "Invalid JSON")
+                continue
+            if len(batch) >= self.batch_size:
+                await self._write_batch(batch)
+                batch = []
+        if batch:
+            await self._write_batch(batch)
+        logger.info(f"Ingest by {self.uploader_id}: {self.accepted} accepted, {self.rejected} rejected")
+        errors = sorted(self.errors, key=lambda error: error.line)
+        return schemas.IngestReport(accepted=self.accepted, rejected=self.rejected, errors=errors)
+
+    async def _write_batch(self, batch: List[Tuple[int, schemas.MessageIngestItem]]):
+        participants = models.chat_participants.c
+        chat_ids = {item.chat_id for _, item in batch}
+        reply_ids = {item.reply_to_message_id for _, item in batch if item.reply_to_message_id}
+
+        async with self.session_factory() as db:
+            members = set(await db.execute(
+                select(participants.chat_id, participants.user_id).where(participants.chat_id.in_(chat_ids))
+            ))
+            reply_chats = {}
+            if reply_ids:
+                reply_chats = dict((await db.execute(
+                    select(models.Message.id, models.Message.chat_id).where(models.Message.id.in_(reply_ids))
+                )).all())
+
+            rows = []
+            numbers = []
+            for number, item in batch:
+                if (item.chat_id, self.uploader_id) not in members:
+                    self._reject(number, "Chat not found")
+                elif not self.any_sender and item.sender_id != self.uploader_id:
+                    self._reject(number, "Sender must be the uploading user")
+                elif (item.chat_id, item.sender_id) not in members:
+                    self._reject(number, "Sender is not a participant of the chat")
+                elif item.reply_to_message_id and reply_chats.get(item.reply_to_message_id) != item.chat_id:
+                    self._reject(number, "Replied message not found in the chat")
+                else:
+                    rows.append(new_message_values(**item.model_dump()))
+                    numbers.append(number)
+            if not rows:
+                return
+
+            # Номера seq внутри пакета идут в порядке времени сообщений
+            rows.sort(key=lambda row: row["timestamp"])
+            try:
+                inserted = await insert_messages(db, rows, imported=True)
+                await db.commit()
+            except SQLAlchemyError as e:
+                # Предыдущие пакеты уже зафиксированы — отчёт о них не теряем
+                await db.rollback()
+                logger.error(f"Ingest by {self.uploader_id}: batch of {len(rows)} messages failed: {e}")
+                for number in numbers:
+                    self._reject(number, "Batch could not be written")
+                return
+
+        self.accepted += len(inserted)
+        for message in inserted:
+            count, last_seq = self.chats.get(message.chat_id, (0, 0))
+            self.chats[message.chat_id] = (count + 1, max(last_seq, message.seq))
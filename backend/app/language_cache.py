@@ -0,0 +1,133 @@
+# backend/app/language_cache.py
+"""
+Справочник языков в памяти процесса.
+
+Таблица languages заполняется при первом запуске и почти не меняется,
+поэтому она целиком загружается при старте и отдаётся из памяти: список,
+поиск по id и по коду. Снимок неизменяем и заменяется целиком; версия
+растёт, когда содержимое меняется. Промах (новый язык, добавленный в базу
+в обход API) перечитывает таблицу, но не чаще раза в
+LANGUAGE_CACHE_MISS_REFRESH_SECONDS — до тех пор неизвестный код или id
+считается отсутствующим. Раз в LANGUAGE_CACHE_TTL_SECONDS снимок
+перечитывается и так — на случай изменений с другого узла.
+
+Асинхронные обработчики пользуются методами *_async: попадания отдаются
+из памяти сразу, а чтение таблицы уходит в поток и не блокирует event loop.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import select
+
+from . import models, schemas
+from .database import SessionLocal
+from .etags import make_etag
+from .logger import logger
+
+LANGUAGE_CACHE_TTL_SECONDS = float(os.getenv("LANGUAGE_CACHE_TTL_SECONDS", "300"))
+# Не чаще скольки секунд промах перечитывает таблицу
+LANGUAGE_CACHE_MISS_REFRESH_SECONDS = float(os.getenv("LANGUAGE_CACHE_MISS_REFRESH_SECONDS", "30"))
+
+
+class LanguageSnapshot(NamedTuple):
+    version: int
+    etag: str
+    languages: List[schemas.LanguageInDB]
+    by_id: Dict[int, schemas.LanguageInDB]
+    by_code: Dict[str, schemas.LanguageInDB]
+    loaded_at: float
+
+
+class LanguageCache:
+    def __init__(
+            self,
+            session_factory=SessionLocal,
+            ttl_seconds: float = LANGUAGE_CACHE_TTL_SECONDS,
+            miss_refresh_seconds: float = LANGUAGE_CACHE_MISS_REFRESH_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.ttl = ttl_seconds
+        self.miss_refresh_seconds = miss_refresh_seconds
+        self._snapshot: Optional[LanguageSnapshot] = None
+        self._lock = threading.Lock()
+        self.db_loads = 0
+
+    def refresh(self, stale: Optional[LanguageSnapshot] = None) -> LanguageSnapshot:
+        """
+        Перечитывает таблицу; версия меняется, только если изменилось содержимое.
+        Если передан stale, а снимок уже заменил другой поток, повторно не читает.
+        """
+        with self._lock:
+            if stale is not None and self._snapshot is not stale:
+                return self._snapshot
+            with self.session_factory() as db:
+                rows = db.execute(select(models.Language).order_by(models.Language.name)).scalars().all()
+                languages = [schemas.LanguageInDB.model_validate(row) for row in rows]
+            self.db_loads += 1
+            etag = make_etag("languages", *((l.id, l.code, l.name) for l in languages))
+            previous = self._snapshot
+            version = previous.version if previous and previous.etag == etag else (previous.version + 1 if previous else 1)
+            self._snapshot = LanguageSnapshot(
+                version=version,
+                etag=etag,
+                languages=languages,
+                by_id={l.id: l for l in languages},
+                by_code={l.code: l for l in languages},
+                loaded_at=time.monotonic(),
+            )
+            if not previous or previous.version != version:
+                logger.info(f"Loaded {len(languages)} languages (version {version})")
+            return self._snapshot
+
+    def _expired(self, snapshot: Optional[LanguageSnapshot]) -> bool:
+        return snapshot is None or snapshot.loaded_at + self.ttl < time.monotonic()
+
+    def _miss_refresh_due(self, snapshot: LanguageSnapshot) -> bool:
+        return snapshot.loaded_at + self.miss_refresh_seconds < time.monotonic()
+
+    def snapshot(self) -> LanguageSnapshot:
+        snapshot = self._snapshot
+        if self._expired(snapshot):
+            snapshot = self.refresh(snapshot)
+        return snapshot
+
+    def _lookup(self, index: str, key) -> Optional[schemas.LanguageInDB]:
+        snapshot = self.snapshot()
+        language = getattr(snapshot, index).get(key)
+        if language is None and self._miss_refresh_due(snapshot):
+            language = getattr(self.refresh(snapshot), index).get(key)
+        return language
+
+    def get(self, language_id: int) -> Optional[schemas.LanguageInDB]:
+        return self._lookup("by_id", language_id)
+
+    def by_code(self, code: str) -> Optional[schemas.LanguageInDB]:
+        return self._lookup("by_code", code)
+
+    async def refresh_async(self, stale: Optional[LanguageSnapshot] = None) -> LanguageSnapshot:
+        return await asyncio.to_thread(self.refresh, stale)
+
+    async def snapshot_async(self) -> LanguageSnapshot:
+        snapshot = self._snapshot
+        if self._expired(snapshot):
+            snapshot = await self.refresh_async(snapshot)
+        return snapshot
+
+    async def _lookup_async(self, index: str, key) -> Optional[schemas.LanguageInDB]:
+        snapshot = await self.snapshot_async()
+        language = getattr(snapshot, index).get(key)
+        if language is None and self._miss_refresh_due(snapshot):
+            language = getattr(await self.refresh_async(snapshot), index).get(key)
+        return language
+
+    async def get_async(self, language_id: int) -> Optional[schemas.LanguageInDB]:
+        return await self._lookup_async("by_id", language_id)
+
+    async def by_code_async(self, code: str) -> Optional[schemas.LanguageInDB]:
+        return await self._lookup_async("by_code", code)
+
+
+language_cache = LanguageCache()
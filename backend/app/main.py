@@ -4,7 +4,11 @@ from fastapi import FastAPI
 
 from . import models
 from .database import SessionLocal, Base, engine
-from .routers import chats, messages, ws, users, media, translate
+from .migrate import upgrade_database
+from .routers import chats, messages, ws, users, media, translate, search
+from .language_cache import language_cache
+from .message_writer import message_writer
+from .fcm_service import push_dispatcher
 from .logger import logger
 
 # УБИРАЕМ ЭТУ СТРОКУ. ОНА ЯВЛЯЕТСЯ ПРИЧИНОЙ ОШИБКИ.
@@ -14,8 +18,12 @@ app = FastAPI(title="Chat Backend")
 
 @app.on_event("startup")
 def on_startup():
-    Base.metadata.create_all(bind=engine)
-    logger.info("Database tables created.")
+    # Тесты создают схему напрямую, рабочая база обновляется миграциями Alembic
+    if os.getenv("TESTING") == "1":
+        Base.metadata.create_all(bind=engine)
+        logger.info("Database tables created.")
+    else:
+        upgrade_database()
 
     # --- ИЗМЕНЕННЫЙ БЛОК ---
     # Наполняем БД языками, только если это НЕ тестовый режим
@@ -39,11 +47,27 @@ def on_startup():
         finally:
             db.close()
 
+    # Справочник языков держим в памяти процесса
+    language_cache.refresh()
+
+@app.on_event("startup")
+async def start_realtime():
+    await ws.manager.start()
+    message_writer.start()
+    push_dispatcher.start()
+
+@app.on_event("shutdown")
+async def stop_realtime():
+    await message_writer.stop()
+    await push_dispatcher.stop()
+    await ws.manager.stop()
+
 app.include_router(users.router)
 app.include_router(chats.router)
 app.include_router(messages.router)
 app.include_router(media.router)
 app.include_router(ws.router)
 app.include_router(translate.router)
+app.include_router(search.router)
 
 logger.info("Application startup configuration complete.")
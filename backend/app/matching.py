@@ -0,0 +1,174 @@
+# backend/app/matching.py
+"""
+Подбор собеседников по языкам.
+
+Вместо соединений user_languages x languages поиск читает таблицу
+language_matches: у каждого пользователя по строке на каждую пару
+(родной, изучаемый) из его языков, включая "любой" (0) с обеих сторон.
+Выдача — диапазон индекса (родной, изучаемый) в порядке last_active_at,
+страницы листаются курсором, поэтому цена страницы не зависит от числа
+пользователей.
+
+Для авторизованного поиска сначала идут взаимные совпадения: собеседник
+говорит на языке, который учит ищущий, и учит его родной язык. Эти
+совпадения читаются прямо диапазонами индекса по парам (изучаемый ищущим,
+родной ищущего), а фильтр проверяется по первичному ключу; остальные —
+диапазоном фильтра без взаимных.
+"""
+from datetime import datetime
+from typing import Iterable, List, Optional, Set, Tuple
+from uuid import UUID as PyUUID
+
+from sqlalchemy import delete, desc, exists, insert, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from . import models
+from .pagination import decode_cursor, encode_cursor
+
+# "Любой язык" в строках индекса
+ANY_LANGUAGE = 0
+
+# Ступени выдачи: сначала взаимные совпадения, потом остальные
+TIER_RECIPROCAL = 0
+TIER_OTHERS = 1
+
+
+def match_rows(user_id: PyUUID, languages: Iterable[Tuple[int, str]], last_active_at: datetime) -> List[dict]:
+    """Строки индекса для пользователя с языками [(language_id, type)]."""
+    natives = {ANY_LANGUAGE}
+    learning = {ANY_LANGUAGE}
+    for language_id, type_ in languages:
+        if type_ == "native":
+            natives.add(language_id)
+        elif type_ == "learning":
+            learning.add(language_id)
+    return [
+        {"native_language_id": native, "learning_language_id": learn, "user_id": user_id, "last_active_at": last_active_at}
+        for native in natives
+        for learn in learning
+    ]
+
+
+def sync_user_matches(db: Session, user_id: PyUUID, languages: Iterable[Tuple[int, str]]):
+    """Перестраивает строки пользователя в той же транзакции, что и смена языков. Commit — за вызывающим."""
+    matches = models.language_matches
+    db.execute(delete(matches).where(matches.c.user_id == user_id))
+    db.execute(insert(matches), match_rows(user_id, languages, datetime.now()))
+
+
+def touch_statement(user_id: PyUUID):
+    """UPDATE активности пользователя во всех его строках индекса."""
+    matches = models.language_matches
+    return update(matches).where(matches.c.user_id == user_id).values(last_active_at=datetime.now())
+
+
+class Searcher:
+    """Языки ищущего пользователя для ранжирования по взаимности."""
+
+    def __init__(self, user_id: PyUUID, languages: Iterable[Tuple[int, str]]):
+        self.user_id = user_id
+        self.natives: Set[int] = set()
+        self.learning: Set[int] = set()
+        # Те же типы, что индексирует match_rows: остальные во взаимности не участвуют
+        for language_id, type_ in languages:
+            if type_ == "native":
+                self.natives.add(language_id)
+            elif type_ == "learning":
+                self.learning.add(language_id)
+
+    @property
+    def can_reciprocate(self) -> bool:
+        return bool(self.natives and self.learning)
+
+
+def _reciprocal_range(native_language_id: Optional[int], learning_language_id: Optional[int], searcher: Searcher):
+    """
+    Взаимные совпадения из фильтра: диапазоны индекса по парам (изучаемый
+    ищущим, родной ищущего). Язык фильтра из этих множеств сужает диапазоны
+    до себя, иначе пользователь проверяется на фильтр по первичному ключу.
+    """
+    matches = models.language_matches.c
+    narrow_native = native_language_id in searcher.learning
+    narrow_learning = learning_language_id in searcher.natives
+    natives = {native_language_id} if narrow_native else searcher.learning
+    learning = {learning_language_id} if narrow_learning else searcher.natives
+    stmt = (
+        select(matches.user_id, matches.last_active_at)
+        .where(
+            matches.native_language_id.in_(natives),
+            matches.learning_language_id.in_(learning),
+            matches.user_id != searcher.user_id,
+        )
+        .order_by(desc(matches.last_active_at), desc(matches.user_id))
+    )
+    # У пользователя строка на каждую свою пару — из нескольких диапазонов он пришёл бы несколько раз
+    if len(natives) * len(learning) > 1:
+        stmt = stmt.distinct()
+    if (native_language_id and not narrow_native) or (learning_language_id and not narrow_learning):
+        wanted = models.language_matches.alias("wanted")
+        stmt = stmt.where(exists().where(
+            wanted.c.native_language_id == (native_language_id or ANY_LANGUAGE),
+            wanted.c.learning_language_id == (learning_language_id or ANY_LANGUAGE),
+            wanted.c.user_id == matches.user_id,
+        ))
+    return stmt
+
+
+def find_partners(
+        db: Session,
+        native_language_id: Optional[int],
+        learning_language_id: Optional[int],
+        limit: int,
+        cursor: Optional[str] = None,
+        searcher: Optional[Searcher] = None,
+) -> Tuple[List[Tuple[PyUUID, bool]], Optional[str]]:
+    """
+    Страница [(user_id, взаимное ли совпадение)] и курсор следующей.
+    Повреждённый курсор — ValueError.
+    """
+    matches = models.language_matches.c
+    base = (
+        select(matches.user_id, matches.last_active_at)
+        .where(
+            matches.native_language_id == (native_language_id or ANY_LANGUAGE),
+            matches.learning_language_id == (learning_language_id or ANY_LANGUAGE),
+        )
+        .order_by(desc(matches.last_active_at), desc(matches.user_id))
+    )
+    tiers = {}
+    if searcher is not None:
+        base = base.where(matches.user_id != searcher.user_id)
+        if searcher.can_reciprocate:
+            tiers[TIER_RECIPROCAL] = _reciprocal_range(native_language_id, learning_language_id, searcher)
+            other = models.language_matches.alias("reciprocal")
+            base = base.where(~exists().where(
+                other.c.native_language_id.in_(searcher.learning),
+                other.c.learning_language_id.in_(searcher.natives),
+                other.c.user_id == matches.user_id,
+            ))
+    tiers[TIER_OTHERS] = base
+
+    position = decode_cursor(cursor, int, datetime, PyUUID) if cursor else None
+    order = sorted(tiers)
+    if position is not None:
+        order = [tier for tier in order if tier >= position[0]]
+
+    page: List[Tuple[int, datetime, PyUUID]] = []
+    for tier in order:
+        stmt = tiers[tier]
+        if position is not None and position[0] == tier:
+            stmt = stmt.where(
+                tuple_(matches.last_active_at, matches.user_id)
+                < tuple_(position[1], position[2], types=[matches.last_active_at.type, matches.user_id.type])
+            )
+        # Одна лишняя строка (возможно, уже из следующей ступени) показывает, есть ли продолжение
+        for user_id, last_active_at in db.execute(stmt.limit(limit + 1 - len(page))):
+            page.append((tier, last_active_at, user_id))
+        if len(page) > limit:
+            break
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(*page[-1])
+    return [(user_id, tier == TIER_RECIPROCAL) for tier, _, user_id in page], next_cursor
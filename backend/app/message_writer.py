@@ -0,0 +1,312 @@
+# backend/app/message_writer.py
+"""
+Групповая запись сообщений чата.
+
+Вместо отдельного commit на каждое сообщение входящие сообщения со всех
+сокетов копятся в течение короткого окна (или до N штук) и вставляются одним
+многострочным INSERT ... RETURNING в одной транзакции. Отправитель получает
+ответ только после commit своего пакета.
+
+Каждое сообщение получает порядковый номер seq внутри своего чата: счётчик
+chats.last_seq сдвигается одним UPDATE ... RETURNING на весь пакет, так что
+номера строго растут в порядке commit и не зависят от часов клиента. Тем же
+UPDATE обновляется сводка чата для списка чатов (последнее сообщение), а
+водяной знак прочтения отправителя сдвигается в той же транзакции.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import case, insert, literal, or_, select, update
+
+from . import models, schemas
+from .database import AsyncSessionLocal
+from .logger import logger
+from .read_state import imported_watermark_statement, sender_watermark_statements
+from .search import message_search_text
+
+# Окно накопления пакета, в миллисекундах
+MESSAGE_BATCH_WINDOW_MS = float(os.getenv("MESSAGE_BATCH_WINDOW_MS", "5"))
+# Максимальный размер пакета
+MESSAGE_BATCH_MAX_SIZE = int(os.getenv("MESSAGE_BATCH_MAX_SIZE", "200"))
+# Сколько символов текста хранится в сводке чата
+PREVIEW_LENGTH = 500
+
+_RETURNING_COLUMNS = (
+    models.Message.id,
+    models.Message.chat_id,
+    models.Message.sender_id,
+    models.Message.content,
+    models.Message.type,
+    models.Message.timestamp,
+    models.Message.seq,
+    models.Message.reply_to_message_id,
+)
+
+
+def new_message_values(
+        chat_id: uuid.UUID,
+        sender_id: uuid.UUID,
+        content: str,
+        type: str = "text",
+        timestamp: Optional[datetime] = None,
+        reply_to_message_id: Optional[uuid.UUID] = None,
+) -> dict:
+    """Строка для вставки в messages."""
+    return {
+        "id": uuid.uuid4(),
+        "chat_id": chat_id,
+        "sender_id": sender_id,
+        "content": content,
+        "type": type,
+        "timestamp": timestamp or datetime.now(),
+        "reply_to_message_id": reply_to_message_id,
+        "search_text": message_search_text(content, type),
+    }
+
+
+def message_preview(content: Optional[str], type: str) -> str:
+    # Медиа-сообщения хранят JSON, который клиент разбирает целиком — его не обрезаем
+    content = content or ""
+    return content[:PREVIEW_LENGTH] if type == "text" else content
+
+
+def chat_summary_statement(chat_id: uuid.UUID, rows: List[dict]):
+    """
+    UPDATE чата для пакета его сообщений: резервирует len(rows) номеров seq и
+    записывает сводку по самому позднему сообщению пакета, если оно не старше
+    уже записанного (импорт истории не откатывает сводку назад).
+    RETURNING отдаёт последний номер.
+    """
+    # При равных временах побеждает последнее в пакете
+    latest = max(reversed(rows), key=lambda row: row["timestamp"])
+    chats = models.Chat
+    newer = or_(chats.last_message_at.is_(None), chats.last_message_at <= latest["timestamp"])
+
+    def if_newer(column, value):
+        return case((newer, literal(value, column.type)), else_=column)
+
+    return (
+        update(chats)
+        .where(chats.id == chat_id)
+        .values(
+            last_seq=chats.last_seq + len(rows),
+            last_message_id=if_newer(chats.last_message_id, latest["id"]),
+            last_message_preview=if_newer(chats.last_message_preview, message_preview(latest["content"], latest["type"])),
+            last_message_type=if_newer(chats.last_message_type, latest["type"]),
+            last_message_sender_id=if_newer(chats.last_message_sender_id, latest["sender_id"]),
+            last_message_at=if_newer(chats.last_message_at, latest["timestamp"]),
+            last_activity_at=if_newer(chats.last_activity_at, latest["timestamp"]),
+        )
+        .returning(chats.last_seq)
+    )
+
+
+def message_edited_statement(message: models.Message):
+    """
+    UPDATE чата после правки сообщения: увеличивает version (меняет ETag
+    истории) и обновляет превью, если сообщение в чате последнее.
+    """
+    return (
+        update(models.Chat)
+        .where(models.Chat.id == message.chat_id)
+        .values(
+            version=models.Chat.version + 1,
+            last_message_preview=case(
+                (models.Chat.last_message_id == message.id, message_preview(message.content, message.type)),
+                else_=models.Chat.last_message_preview,
+            ),
+        )
+    )
+
+
+def assign_seq(rows: List[dict], last_seq: int):
+    """Раздаёт строкам одного чата номера, заканчивающиеся на last_seq, в порядке списка."""
+    for offset, row in enumerate(rows):
+        row["seq"] = last_seq - len(rows) + 1 + offset
+
+
+async def insert_messages(session, rows: List[dict], imported: bool = False) -> List[schemas.MessageResponse]:
+    """
+    Вставляет пакет сообщений одним INSERT ... RETURNING и подгружает
+    цитируемые сообщения одним запросом. Commit остаётся за вызывающим.
+    imported — загружаемая история: строки помечаются imported, а водяные
+    знаки всех участников сдвигаются вместе с last_seq (непрочитанных не прибавится).
+    """
+    if not rows:
+        return []
+    if imported:
+        for row in rows:
+            row["imported"] = True
+
+    by_chat = {}
+    for row in rows:
+        by_chat.setdefault(row["chat_id"], []).append(row)
+    # Счётчики блокируются в одном порядке, чтобы параллельные пакеты не ждали друг друга по кругу
+    for chat_id in sorted(by_chat, key=str):
+        last_seq = await session.scalar(chat_summary_statement(chat_id, by_chat[chat_id]))
+        if last_seq is None:
+            raise ValueError(f"Chat {chat_id} does not exist")
+        assign_seq(by_chat[chat_id], last_seq)
+        if imported:
+            await session.execute(imported_watermark_statement(chat_id, len(by_chat[chat_id])))
+            continue
+        for statement in sender_watermark_statements(chat_id, by_chat[chat_id]):
+            await session.execute(statement)
+
+    result = await session.execute(
+        insert(models.Message).returning(*_RETURNING_COLUMNS, sort_by_parameter_order=True),
+        rows,
+    )
+    return await _to_responses(session, result.all())
+
+
+async def fetch_messages_since(session, chat_id: uuid.UUID, since_seq: int, limit: int) -> List[schemas.MessageResponse]:
+    """
+    Живые сообщения чата с seq > since_seq по возрастанию seq, не больше limit.
+    Импортированная история не досылается: seq у неё — порядок загрузки, а не
+    время, и клиент получает её через REST по событию messages_ingested.
+    """
+    result = await session.execute(
+        select(*_RETURNING_COLUMNS)
+        .where(models.Message.chat_id == chat_id, models.Message.seq > since_seq, models.Message.imported.is_(False))
+        .order_by(models.Message.seq)
+        .limit(limit)
+    )
+    return await _to_responses(session, result.all())
+
+
+async def _to_responses(session, inserted) -> List[schemas.MessageResponse]:
+    reply_ids = {row.reply_to_message_id for row in inserted if row.reply_to_message_id}
+    replied = {}
+    if reply_ids:
+        replied_rows = await session.execute(
+            select(
+                models.Message.id,
+                models.Message.sender_id,
+                models.Message.content,
+                models.Message.type,
+            ).where(models.Message.id.in_(reply_ids))
+        )
+        replied = {row.id: schemas.RepliedMessageInfo.model_validate(row._mapping) for row in replied_rows}
+
+    return [
+        schemas.MessageResponse(
+            id=row.id,
+            chat_id=row.chat_id,
+            sender_id=row.sender_id,
+            content=row.content,
+            type=row.type,
+            timestamp=row.timestamp,
+            seq=row.seq,
+            reply_to_message=replied.get(row.reply_to_message_id),
+        )
+        for row in inserted
+    ]
+
+
+# Метка остановки в очереди записи
+_STOP = object()
+
+
+class MessageBatchWriter:
+    """Очередь записи сообщений с групповым commit."""
+
+    def __init__(
+            self,
+            session_factory=AsyncSessionLocal,
+            window_ms: float = MESSAGE_BATCH_WINDOW_MS,
+            max_batch_size: int = MESSAGE_BATCH_MAX_SIZE,
+    ):
+        self.session_factory = session_factory
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.batches_committed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописывает уже принятые сообщения и останавливает запись."""
+        if self._task is None or self._task.done():
+            return
+        if self._loop is not asyncio.get_running_loop():
+            # Цикл, в котором шла запись, уже не работает — дождаться её нельзя
+            self._task.cancel()
+            return
+        # Метка в конце очереди: всё, что принято до неё, будет записано
+        self._queue.put_nowait(_STOP)
+        await self._task
+
+    async def submit(self, values: dict) -> schemas.MessageResponse:
+        """Ставит сообщение в очередь и ждёт commit его пакета."""
+        self.start()
+        future = self._loop.create_future()
+        self._queue.put_nowait((values, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            if self.window and self._queue.qsize() < self.max_batch_size - 1:
+                await asyncio.sleep(self.window)
+            stopping = False
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        try:
+            results = await self._write([values for values, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"Failed to persist message: {e}")
+                self._resolve(batch[0][1], exception=e)
+                return
+            # Одна плохая строка не должна ронять весь пакет — пишем по одному
+            logger.warning(f"Batch insert of {len(batch)} messages failed ({e}), retrying individually")
+            for item in batch:
+                await self._flush([item])
+            return
+
+        for (_, future), response in zip(batch, results):
+            self._resolve(future, result=response)
+
+    async def _write(self, rows: List[dict]) -> List[schemas.MessageResponse]:
+        async with self.session_factory() as session:
+            async with session.begin():
+                results = await insert_messages(session, rows)
+        self.batches_committed += 1
+        logger.debug(f"Committed batch of {len(rows)} messages")
+        return results
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result=None, exception: Optional[Exception] = None):
+        if future.done():
+            return # Отправитель отключился, не дождавшись ответа
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+
+message_writer = MessageBatchWriter()
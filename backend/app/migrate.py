@@ -0,0 +1,66 @@
+# backend/app/migrate.py
+"""
+Применение миграций Alembic при старте приложения.
+
+Базы, созданные ещё через Base.metadata.create_all (таблицы есть, а
+alembic_version нет), сначала помечаются базовой ревизией, после чего
+к ним применяются только последующие миграции.
+
+Несколько воркеров uvicorn стартуют одновременно, поэтому на PostgreSQL
+проверка схемы, stamp и upgrade выполняются под advisory-блокировкой:
+остальные воркеры ждут и видят уже обновлённую схему.
+"""
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect, text
+
+from . import models
+from .database import engine
+from .logger import logger
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+BASELINE_REVISION = "0001"
+# Ключ pg_advisory_xact_lock, общий для всех процессов, применяющих миграции
+MIGRATION_LOCK_KEY = 7_310_425_001
+
+
+def include_object(object, name, type_, reflected, compare_to) -> bool:
+    """
+    Фильтр autogenerate: полнотекстовый индекс создаётся DDL под конкретную
+    СУБД (models.SEARCH_INDEX_DDL) и в метаданных не описан.
+    """
+    if type_ == "table" and name.startswith(models.SEARCH_INDEX_TABLE):
+        return False
+    if type_ == "index" and name == "ix_messages_search_text":
+        return False
+    return True
+
+
+def alembic_config(connection=None) -> Config:
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    config.attributes["connection"] = connection
+    return config
+
+
+def acquire_migration_lock(connection):
+    """
+    Ждёт эксклюзивную блокировку миграций до конца текущей транзакции.
+    SQLite сериализует запись сам, там блокировка не нужна.
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+
+def upgrade_database(revision: str = "head"):
+    with engine.begin() as connection:
+        acquire_migration_lock(connection)
+        config = alembic_config(connection)
+        tables = set(inspect(connection).get_table_names())
+        if "users" in tables and "alembic_version" not in tables:
+            logger.info(f"Existing schema without migration history, stamping revision {BASELINE_REVISION}")
+            command.stamp(config, BASELINE_REVISION)
+        command.upgrade(config, revision)
+    logger.info(f"Database schema is at revision {revision}")
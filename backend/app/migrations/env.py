@@ -0,0 +1,59 @@
+# backend/app/migrations/env.py
+from logging.config import fileConfig
+
+from alembic import context
+
+from app import models  # noqa: F401 — регистрирует таблицы в Base.metadata
+from app.database import Base, engine
+from app.migrate import acquire_migration_lock, include_object
+
+config = context.config
+
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """Генерация SQL без подключения к базе (alembic upgrade --sql)."""
+    context.configure(
+        url=str(engine.url),
+        target_metadata=target_metadata,
+        include_object=include_object,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=engine.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # Подключение можно передать снаружи (см. app/migrate.py), иначе берём общий engine
+    connection = config.attributes.get("connection")
+    if connection is None:
+        with engine.connect() as connection:
+            _run(connection)
+    else:
+        _run(connection)
+
+
+def _run(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        include_object=include_object,
+        # SQLite не умеет большинство ALTER TABLE — Alembic пересобирает таблицу
+        render_as_batch=connection.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        # alembic upgrade из Makefile не должен пересечься со стартом воркеров
+        acquire_migration_lock(connection)
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,83 @@
+"""baseline schema
+
+Схема, которую раньше создавал Base.metadata.create_all. Базы, созданные
+так до появления миграций, помечаются этой ревизией без выполнения (см. app/migrate.py).
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-06-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.models import GUID
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "languages",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(100), nullable=False, unique=True),
+        sa.Column("code", sa.String(10), nullable=False, unique=True),
+    )
+    op.create_table(
+        "users",
+        sa.Column("id", GUID(), primary_key=True),
+        sa.Column("username", sa.String(100), nullable=False),
+        sa.Column("hashed_password", sa.String(), nullable=False),
+        sa.Column("fcm_token", sa.String(), nullable=True),
+        sa.Column("full_name", sa.String(150)),
+        sa.Column("gender", sa.String(50)),
+        sa.Column("age", sa.Integer()),
+        sa.Column("country", sa.String(100)),
+        sa.Column("height", sa.Integer()),
+        sa.Column("bio", sa.Text()),
+        sa.Column("avatar_url", sa.String()),
+        sa.Column("interests", sa.Text()),
+    )
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+    op.create_table(
+        "user_languages",
+        sa.Column("user_id", GUID(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("language_id", sa.Integer(), sa.ForeignKey("languages.id"), primary_key=True),
+        sa.Column("level", sa.String(50)),
+        sa.Column("type", sa.String(20), primary_key=True),
+    )
+    op.create_table(
+        "chats",
+        sa.Column("id", GUID(), primary_key=True),
+        sa.Column("title", sa.String(), nullable=True),
+        sa.Column("timestamp", sa.TIMESTAMP(), server_default=sa.func.now()),
+    )
+    op.create_table(
+        "chat_participants",
+        sa.Column("user_id", GUID(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("chat_id", GUID(), sa.ForeignKey("chats.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("last_read_timestamp", sa.TIMESTAMP(), server_default=sa.func.now()),
+    )
+    op.create_table(
+        "messages",
+        sa.Column("id", GUID(), primary_key=True),
+        sa.Column("chat_id", GUID(), sa.ForeignKey("chats.id", ondelete="CASCADE")),
+        sa.Column("sender_id", GUID(), sa.ForeignKey("users.id")),
+        sa.Column("content", sa.Text()),
+        sa.Column("type", sa.String()),
+        sa.Column("timestamp", sa.TIMESTAMP(), server_default=sa.func.now()),
+        sa.Column("is_read", sa.Boolean(), nullable=False),
+        sa.Column("reply_to_message_id", GUID(), sa.ForeignKey("messages.id"), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table("messages")
+    op.drop_table("chat_participants")
+    op.drop_table("chats")
+    op.drop_table("user_languages")
+    op.drop_index("ix_users_username", table_name="users")
+    op.drop_table("users")
+    op.drop_table("languages")
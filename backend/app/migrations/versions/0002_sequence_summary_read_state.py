@@ -0,0 +1,88 @@
+"""per-chat sequence, chat summary and read watermarks
+
+Колонки для порядковых номеров сообщений (messages.seq, chats.last_seq),
+сводки для списка чатов и водяных знаков прочтения. Существующие данные
+дозаполняются: номера раздаются по (timestamp, id), сводка берётся из
+последнего сообщения, водяной знак ставится перед первым непрочитанным
+(по старому флагу messages.is_read).
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-06-01 00:00:01
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.models import GUID
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("chats") as batch:
+        batch.add_column(sa.Column("last_seq", sa.Integer(), nullable=False, server_default="0"))
+        batch.add_column(sa.Column("last_message_id", GUID(), nullable=True))
+        batch.add_column(sa.Column("last_message_preview", sa.Text(), nullable=True))
+        batch.add_column(sa.Column("last_message_type", sa.String(), nullable=True))
+        batch.add_column(sa.Column("last_message_sender_id", GUID(), nullable=True))
+        batch.add_column(sa.Column("last_message_at", sa.TIMESTAMP(), nullable=True))
+        batch.add_column(sa.Column("last_activity_at", sa.TIMESTAMP(), server_default=sa.func.now()))
+    with op.batch_alter_table("messages") as batch:
+        batch.add_column(sa.Column("seq", sa.Integer(), nullable=True))
+    with op.batch_alter_table("chat_participants") as batch:
+        batch.add_column(sa.Column("last_read_seq", sa.Integer(), nullable=False, server_default="0"))
+
+    # UPDATE ... FROM поддерживают и Postgres, и SQLite >= 3.33
+    op.execute("""
+        UPDATE messages SET seq = numbered.seq
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY timestamp, id) AS seq
+            FROM messages
+        ) AS numbered
+        WHERE messages.id = numbered.id
+    """)
+
+    last_message = """
+        (SELECT m.{column} FROM messages m
+         WHERE m.chat_id = chats.id
+         ORDER BY m.seq DESC LIMIT 1)
+    """
+    op.execute(f"""
+        UPDATE chats SET
+            last_seq = COALESCE((SELECT MAX(m.seq) FROM messages m WHERE m.chat_id = chats.id), 0),
+            last_message_id = {last_message.format(column="id")},
+            last_message_preview = {last_message.format(column="content")},
+            last_message_type = {last_message.format(column="type")},
+            last_message_sender_id = {last_message.format(column="sender_id")},
+            last_message_at = {last_message.format(column="timestamp")}
+    """)
+    op.execute("UPDATE chats SET last_activity_at = COALESCE(last_message_at, timestamp)")
+
+    op.execute("""
+        UPDATE chat_participants SET last_read_seq = COALESCE(
+            (SELECT MIN(m.seq) - 1 FROM messages m
+             WHERE m.chat_id = chat_participants.chat_id
+               AND m.sender_id != chat_participants.user_id
+               AND m.is_read = false),
+            (SELECT c.last_seq FROM chats c WHERE c.id = chat_participants.chat_id)
+        )
+    """)
+
+    op.create_index("ix_messages_chat_id_seq", "messages", ["chat_id", "seq"], unique=True)
+    op.create_index("ix_chats_last_activity_at", "chats", ["last_activity_at"])
+
+
+def downgrade():
+    op.drop_index("ix_chats_last_activity_at", table_name="chats")
+    op.drop_index("ix_messages_chat_id_seq", table_name="messages")
+    with op.batch_alter_table("chat_participants") as batch:
+        batch.drop_column("last_read_seq")
+    with op.batch_alter_table("messages") as batch:
+        batch.drop_column("seq")
+    with op.batch_alter_table("chats") as batch:
+        for column in ("last_activity_at", "last_message_at", "last_message_sender_id",
+                       "last_message_type", "last_message_preview", "last_message_id", "last_seq"):
+            batch.drop_column(column)
@@ -0,0 +1,30 @@
+"""index pack for hot queries
+
+- messages(chat_id, timestamp, id): история чата и курсорная пагинация;
+  префикс (chat_id, timestamp) покрывает и сортировку по времени.
+- chat_participants(chat_id): участники чата (первичный ключ начинается
+  с user_id и покрывает только поиск чатов пользователя).
+- user_languages(language_id, type): поиск собеседников по языку.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-06-01 00:00:02
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_messages_chat_id_timestamp_id", "messages", ["chat_id", "timestamp", "id"])
+    op.create_index("ix_chat_participants_chat_id", "chat_participants", ["chat_id"])
+    op.create_index("ix_user_languages_language_id_type", "user_languages", ["language_id", "type"])
+
+
+def downgrade():
+    op.drop_index("ix_user_languages_language_id_type", table_name="user_languages")
+    op.drop_index("ix_chat_participants_chat_id", table_name="chat_participants")
+    op.drop_index("ix_messages_chat_id_timestamp_id", table_name="messages")
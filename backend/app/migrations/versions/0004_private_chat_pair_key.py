@@ -0,0 +1,62 @@
+"""private chat pair key
+
+Ключ пары участников у личных чатов (без названия, ровно два участника)
+с уникальным индексом. Если из-за гонки у пары уже несколько чатов, ключ
+получает самый старый, остальные остаются без ключа.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-06-01 00:00:03
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.models import GUID, private_pair_key
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("chats") as batch:
+        batch.add_column(sa.Column("pair_key", sa.String(80), nullable=True))
+
+    chats = sa.table(
+        "chats",
+        sa.column("id", GUID()),
+        sa.column("title", sa.String()),
+        sa.column("timestamp", sa.TIMESTAMP()),
+        sa.column("pair_key", sa.String()),
+    )
+    participants = sa.table("chat_participants", sa.column("chat_id", GUID()), sa.column("user_id", GUID()))
+
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(chats.c.id, participants.c.user_id)
+        .join(participants, participants.c.chat_id == chats.c.id)
+        .where(chats.c.title.is_(None))
+        .order_by(chats.c.timestamp, chats.c.id)
+    )
+    members = {}
+    for chat_id, user_id in rows:
+        members.setdefault(chat_id, []).append(user_id)
+
+    taken = set()
+    for chat_id, users in members.items():
+        if len(users) != 2:
+            continue
+        key = private_pair_key(*users)
+        if key in taken:
+            continue
+        taken.add(key)
+        connection.execute(chats.update().where(chats.c.id == chat_id).values(pair_key=key))
+
+    op.create_index("ix_chats_pair_key", "chats", ["pair_key"], unique=True)
+
+
+def downgrade():
+    op.drop_index("ix_chats_pair_key", table_name="chats")
+    with op.batch_alter_table("chats") as batch:
+        batch.drop_column("pair_key")
@@ -0,0 +1,26 @@
+"""chat version counter
+
+chats.version растёт при каждой правке уже отправленного сообщения
+(расшифровка медиа). Вместе с last_seq задаёт ETag истории чата.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-06-01 00:00:04
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("chats") as batch:
+        batch.add_column(sa.Column("version", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade():
+    with op.batch_alter_table("chats") as batch:
+        batch.drop_column("version")
@@ -0,0 +1,102 @@
+"""message full-text search
+
+messages.search_text (текст сообщения или расшифровка медиа) заполняется
+для существующих сообщений, затем строится полнотекстовый индекс:
+GIN по tsvector в Postgres, внешняя таблица FTS5 с триггерами в SQLite
+(DDL общий с create_all — models.SEARCH_INDEX_DDL).
+
+Пересборка messages в SQLite (batch_alter_table с copy) удаляет триггеры
+и меняет rowid — после такой миграции индекс нужно создать заново.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-06-01 00:00:05
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.models import GUID, SEARCH_INDEX_DDL, SEARCH_INDEX_TABLE
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def _transcription_text(content):
+    """Копия app.search.message_search_text для медиа на момент этой ревизии."""
+    try:
+        transcription = json.loads(content or "").get("transcription") or {}
+    except (ValueError, AttributeError):
+        return None
+    return transcription.get("full_text") or None
+
+
+def upgrade():
+    with op.batch_alter_table("messages") as batch:
+        batch.add_column(sa.Column("search_text", sa.Text(), nullable=True))
+
+    messages = sa.table(
+        "messages",
+        sa.column("id", GUID()),
+        sa.column("content", sa.Text()),
+        sa.column("type", sa.String()),
+        sa.column("search_text", sa.Text()),
+    )
+    connection = op.get_bind()
+    # Текстовые сообщения индексируются как есть — одним UPDATE без выборки
+    connection.execute(
+        messages.update()
+        .where(sa.or_(messages.c.type == "text", messages.c.type.is_(None)))
+        .values(search_text=messages.c.content)
+    )
+
+    # У медиа расшифровка лежит в JSON — разбираем порциями по ключу id
+    statement = (
+        messages.update()
+        .where(messages.c.id == sa.bindparam("message_id"))
+        .values(search_text=sa.bindparam("search_text"))
+    )
+    last_id = None
+    while True:
+        query = (
+            sa.select(messages.c.id, messages.c.content)
+            .where(messages.c.type != "text", messages.c.content.is_not(None))
+            .order_by(messages.c.id)
+            .limit(BATCH_SIZE)
+        )
+        if last_id is not None:
+            query = query.where(messages.c.id > last_id)
+        rows = connection.execute(query).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = [
+            {"message_id": message_id, "search_text": search_text}
+            for message_id, content in rows
+            if (search_text := _transcription_text(content)) is not None
+        ]
+        if updates:
+            connection.execute(statement, updates)
+
+    dialect = connection.dialect.name
+    for ddl in SEARCH_INDEX_DDL.get(dialect, []):
+        op.execute(ddl)
+    if dialect == "sqlite":
+        op.execute(f"INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        op.drop_index("ix_messages_search_text", table_name="messages")
+    elif dialect == "sqlite":
+        for suffix in ("ai", "ad", "au"):
+            op.execute(f"DROP TRIGGER IF EXISTS {SEARCH_INDEX_TABLE}_{suffix}")
+        op.execute(f"DROP TABLE IF EXISTS {SEARCH_INDEX_TABLE}")
+    with op.batch_alter_table("messages") as batch:
+        batch.drop_column("search_text")
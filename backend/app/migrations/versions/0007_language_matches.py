@@ -0,0 +1,90 @@
+"""language matching index
+
+Таблица language_matches для подбора собеседников: строка на каждую пару
+(родной, изучаемый) языков пользователя, включая "любой" (0). Заполняется
+из user_languages; активность существующих пользователей — время миграции.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2024-06-01 00:00:06
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.models import GUID
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+# "Любой язык" — как app.matching.ANY_LANGUAGE
+ANY_LANGUAGE = 0
+
+
+def match_rows(user_id, languages, last_active_at):
+    """Копия app.matching.match_rows на момент этой ревизии."""
+    natives = {ANY_LANGUAGE}
+    learning = {ANY_LANGUAGE}
+    for language_id, type_ in languages:
+        if type_ == "native":
+            natives.add(language_id)
+        elif type_ == "learning":
+            learning.add(language_id)
+    return [
+        {"native_language_id": native, "learning_language_id": learn, "user_id": user_id, "last_active_at": last_active_at}
+        for native in natives
+        for learn in learning
+    ]
+
+
+def upgrade():
+    matches = op.create_table(
+        "language_matches",
+        sa.Column("native_language_id", sa.Integer(), nullable=False),
+        sa.Column("learning_language_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", GUID(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("last_active_at", sa.TIMESTAMP(), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint("native_language_id", "learning_language_id", "user_id"),
+    )
+    op.create_index("ix_language_matches_pair_activity", "language_matches",
+                    ["native_language_id", "learning_language_id", "last_active_at", "user_id"])
+    op.create_index("ix_language_matches_user_id", "language_matches", ["user_id"])
+
+    users = sa.table("users", sa.column("id", GUID()))
+    user_languages = sa.table(
+        "user_languages",
+        sa.column("user_id", GUID()),
+        sa.column("language_id", sa.Integer()),
+        sa.column("type", sa.String()),
+    )
+    connection = op.get_bind()
+    now = datetime.now()
+    # Пользователи порциями по ключу id — вместе с их языками в памяти только одна порция
+    last_id = None
+    while True:
+        query = sa.select(users.c.id).order_by(users.c.id).limit(BATCH_SIZE)
+        if last_id is not None:
+            query = query.where(users.c.id > last_id)
+        user_ids = connection.execute(query).scalars().all()
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+
+        languages = {user_id: [] for user_id in user_ids}
+        for user_id, language_id, type_ in connection.execute(
+                sa.select(user_languages.c.user_id, user_languages.c.language_id, user_languages.c.type)
+                .where(user_languages.c.user_id.in_(user_ids))):
+            languages[user_id].append((language_id, type_))
+
+        rows = [row for user_id, pairs in languages.items() for row in match_rows(user_id, pairs, now)]
+        op.bulk_insert(matches, rows)
+
+
+def downgrade():
+    op.drop_index("ix_language_matches_user_id", table_name="language_matches")
+    op.drop_index("ix_language_matches_pair_activity", table_name="language_matches")
+    op.drop_table("language_matches")
@@ -0,0 +1,27 @@
+"""imported messages flag
+
+messages.imported отмечает историю, загруженную через /api/messages/bulk.
+Такие сообщения получают seq в порядке загрузки, поэтому догрузка по
+since_seq их пропускает. Существующие сообщения считаются отправленными вживую.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2024-06-01 00:00:07
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Без batch_alter_table: пересборка messages в SQLite удалила бы триггеры FTS (см. 0006).
+    # ADD/DROP COLUMN SQLite выполняет на месте (DROP COLUMN — с версии 3.35)
+    op.add_column("messages", sa.Column("imported", sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade():
+    op.drop_column("messages", "imported")
@@ -1,6 +1,6 @@
 import uuid
 from sqlalchemy import select, Column, String, Text, ForeignKey, TIMESTAMP, func, Integer, Table, \
-    types, Boolean
+    types, Boolean, Index, DDL, event, false
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.hybrid import hybrid_property
 from .database import Base
@@ -41,7 +41,11 @@ chat_participants = Table('chat_participants', Base.metadata,
                           Column('user_id', GUID, ForeignKey('users.id', ondelete="CASCADE"), primary_key=True),
                           Column('chat_id', GUID, ForeignKey('chats.id', ondelete="CASCADE"), primary_key=True),
                           # Добавляем поле для отслеживания последнего прочтения
-                          Column('last_read_timestamp', TIMESTAMP, server_default=func.now())
+                          Column('last_read_timestamp', TIMESTAMP, server_default=func.now()),
+                          # Водяной знак: seq последнего прочитанного сообщения чата
+                          Column('last_read_seq', Integer, nullable=False, server_default="0"),
+                          # Первичный ключ (user_id, chat_id) покрывает поиск по пользователю, этот — по чату
+                          Index('ix_chat_participants_chat_id', 'chat_id')
                           )
 
 # --- ORM MODELS ---
@@ -84,11 +88,49 @@ class UserLanguageAssociation(Base):
     user = relationship("User", back_populates="language_associations")
     language = relationship("Language")
 
+    __table_args__ = (
+        # Поиск собеседников по языку и его роли (родной / изучаемый)
+        Index("ix_user_languages_language_id_type", "language_id", "type"),
+    )
+
+# --- Language Matching Index ---
+# Строка на каждую пару (родной, изучаемый) языков пользователя; 0 — "любой",
+# так что поиск по одному языку, по паре или без фильтра — один диапазон индекса.
+# Заполняется matching.sync_user_matches, не каскадом ORM.
+language_matches = Table('language_matches', Base.metadata,
+                         Column('native_language_id', Integer, primary_key=True),
+                         Column('learning_language_id', Integer, primary_key=True),
+                         Column('user_id', GUID, ForeignKey('users.id', ondelete="CASCADE"), primary_key=True),
+                         # Копия активности пользователя — ключ сортировки выдачи
+                         Column('last_active_at', TIMESTAMP, nullable=False, server_default=func.now()),
+                         Index('ix_language_matches_pair_activity',
+                               'native_language_id', 'learning_language_id', 'last_active_at', 'user_id'),
+                         Index('ix_language_matches_user_id', 'user_id')
+                         )
+
+def private_pair_key(user_a, user_b) -> str:
+    """Ключ личного чата: id двух участников в каноническом порядке."""
+    low, high = sorted((str(user_a), str(user_b)))
+    return f"{low}:{high}"
+
 class Chat(Base):
     __tablename__ = "chats"
     id = Column(GUID(), primary_key=True, default=uuid.uuid4)
     title = Column(String, nullable=True)
     timestamp = Column(TIMESTAMP, server_default=func.now())
+    # Только у личных чатов: private_pair_key(...) участников, уникален
+    pair_key = Column(String(80), nullable=True)
+    # Последний выданный порядковый номер сообщения в чате
+    last_seq = Column(Integer, nullable=False, default=0, server_default="0")
+    # Счётчик правок уже отправленных сообщений; вместе с last_seq — версия истории
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Сводка для списка чатов, обновляется в той же транзакции, что и запись сообщений
+    last_message_id = Column(GUID(), nullable=True)
+    last_message_preview = Column(Text, nullable=True)
+    last_message_type = Column(String, nullable=True)
+    last_message_sender_id = Column(GUID(), nullable=True)
+    last_message_at = Column(TIMESTAMP, nullable=True)
+    last_activity_at = Column(TIMESTAMP, server_default=func.now(), index=True)
     messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan")
     participants = relationship("User", secondary=chat_participants, back_populates="chats")
 
@@ -103,6 +145,10 @@ class Chat(Base):
     def last_message(self, message):
         self._last_message = message
 
+    __table_args__ = (
+        Index("ix_chats_pair_key", "pair_key", unique=True),
+    )
+
 class Message(Base):
     __tablename__ = "messages"
     id = Column(GUID(), primary_key=True, default=uuid.uuid4)
@@ -112,9 +158,59 @@ class Message(Base):
     type = Column(String, default="text")
     timestamp = Column(TIMESTAMP, server_default=func.now())
     is_read = Column(Boolean, default=False, nullable=False)
+    # Порядковый номер внутри чата, выдаётся сервером при записи — в порядке
+    # поступления, а не времени: загруженная история получает номера после
+    # уже существующих сообщений. Хронология — по timestamp.
+    seq = Column(Integer, nullable=True)
+    # Сообщение загружено массовым импортом (/api/messages/bulk), а не отправлено вживую
+    imported = Column(Boolean, nullable=False, default=False, server_default=false())
+    # Текст для полнотекстового поиска: текст сообщения или расшифровка медиа
+    search_text = Column(Text, nullable=True)
 
     reply_to_message_id = Column(GUID(), ForeignKey("messages.id"), nullable=True)
     reply_to_message = relationship("Message", remote_side=[id], backref="replies")
 
     chat = relationship("Chat", back_populates="messages")
     sender = relationship("User", back_populates="messages_sent")
+
+    __table_args__ = (
+        Index("ix_messages_chat_id_seq", "chat_id", "seq", unique=True),
+        # Порядок истории чата и курсорная пагинация
+        Index("ix_messages_chat_id_timestamp_id", "chat_id", "timestamp", "id"),
+    )
+
+
+# --- Full-text search index ---
+# Индекс по messages.search_text живёт вне метаданных: в Postgres это GIN по
+# выражению, в SQLite — внешняя таблица FTS5 с триггерами. Здесь он создаётся
+# вместе со схемой (create_all), в рабочей базе — миграцией 0006.
+SEARCH_TEXT_CONFIG = "simple"
+SEARCH_INDEX_TABLE = "messages_fts"
+
+SEARCH_INDEX_DDL = {
+    "postgresql": [
+        f"CREATE INDEX ix_messages_search_text ON messages "
+        f"USING gin (to_tsvector('{SEARCH_TEXT_CONFIG}'::regconfig, search_text))",
+    ],
+    "sqlite": [
+        f"CREATE VIRTUAL TABLE {SEARCH_INDEX_TABLE} USING fts5("
+        f"search_text, content='messages', content_rowid='rowid')",
+        f"CREATE TRIGGER {SEARCH_INDEX_TABLE}_ai AFTER INSERT ON messages BEGIN "
+        f"INSERT INTO {SEARCH_INDEX_TABLE}(rowid, search_text) VALUES (new.rowid, new.search_text); END",
+        f"CREATE TRIGGER {SEARCH_INDEX_TABLE}_ad AFTER DELETE ON messages BEGIN "
+        f"INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}, rowid, search_text) "
+        f"VALUES ('delete', old.rowid, old.search_text); END",
+        f"CREATE TRIGGER {SEARCH_INDEX_TABLE}_au AFTER UPDATE OF search_text ON messages BEGIN "
+        f"INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}, rowid, search_text) "
+        f"VALUES ('delete', old.rowid, old.search_text); "
+        f"INSERT INTO {SEARCH_INDEX_TABLE}(rowid, search_text) VALUES (new.rowid, new.search_text); END",
+    ],
+}
+
+for _dialect, _statements in SEARCH_INDEX_DDL.items():
+    for _statement in _statements:
+        event.listen(Message.__table__, "after_create", DDL(_statement).execute_if(dialect=_dialect))
+event.listen(
+    Message.__table__, "before_drop",
+    DDL(f"DROP TABLE IF EXISTS {SEARCH_INDEX_TABLE}").execute_if(dialect="sqlite"),
+)
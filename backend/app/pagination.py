@@ -0,0 +1,57 @@
+# backend/app/pagination.py
+"""
+Курсорная (keyset) пагинация.
+
+Курсор — непрозрачная для клиента строка: значения ключа сортировки последней
+отданной строки, упакованные в URL-безопасный base64. Следующая страница
+выбирается условием "ключ больше/меньше курсора" по индексу, поэтому её цена
+не зависит от того, насколько далеко клиент пролистал.
+"""
+import base64
+import json
+from datetime import datetime
+from uuid import UUID as PyUUID
+
+# Заголовки, в которых отдаются курсоры соседних страниц
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+PREV_CURSOR_HEADER = "X-Prev-Cursor"
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def _to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, PyUUID):
+        return str(value)
+    return value
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps([_to_json(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    """
+    Распаковывает курсор, приводя значения к types (datetime, UUID, int, str).
+    Любой повреждённый курсор — ValueError.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception as e:
+        raise ValueError(f"Malformed cursor: {e}")
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError("Malformed cursor")
+
+    result = []
+    for value, type_ in zip(values, types):
+        if value is None:
+            result.append(None)
+        elif type_ is datetime:
+            result.append(datetime.fromisoformat(value))
+        else:
+            result.append(type_(value))
+    return tuple(result)
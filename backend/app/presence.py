@@ -0,0 +1,93 @@
+# backend/app/presence.py
+"""
+Присутствие пользователей в чатах: кто сейчас получает сообщения чата вживую.
+
+Локальные подписки узел знает сам, а о подписках на других узлах узнаёт из
+событий, которые узлы рассылают через транспорт pubsub: изменения (join/leave)
+сразу и полный снимок раз в PRESENCE_HEARTBEAT_SECONDS. Если узел перестал
+присылать снимки, его данные считаются устаревшими.
+"""
+import os
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+# Как часто узел рассылает полный снимок своих подписок
+PRESENCE_HEARTBEAT_SECONDS = float(os.getenv("PRESENCE_HEARTBEAT_SECONDS", "10"))
+# Сколько помним, когда пользователь последний раз был в чате
+PRESENCE_MEMORY_SECONDS = float(os.getenv("PRESENCE_MEMORY_SECONDS", "300"))
+
+# Пара (user_id, chat_id)
+PresenceKey = Tuple[str, str]
+
+
+def encode_keys(keys: Iterable[PresenceKey]) -> list:
+    return [f"{user_id}:{chat_id}" for user_id, chat_id in keys]
+
+
+def decode_keys(items: Iterable[str]) -> Set[PresenceKey]:
+    return {tuple(item.split(":", 1)) for item in items}
+
+
+class PresenceTracker:
+    """Присутствие на других узлах и время последнего ухода из чата."""
+
+    def __init__(
+            self,
+            heartbeat_seconds: float = PRESENCE_HEARTBEAT_SECONDS,
+            memory_seconds: float = PRESENCE_MEMORY_SECONDS,
+    ):
+        self.heartbeat_seconds = heartbeat_seconds
+        self.memory_seconds = memory_seconds
+        # { node_id: (действительно до, {(user_id, chat_id), ...}) }
+        self._remote: Dict[str, Tuple[float, Set[PresenceKey]]] = {}
+        # { (user_id, chat_id): когда ушёл } — по монотонным часам этого узла
+        self._last_seen: Dict[PresenceKey, float] = {}
+
+    def _ttl(self) -> float:
+        return time.monotonic() + self.heartbeat_seconds * 3
+
+    def apply_snapshot(self, node_id: str, keys: Set[PresenceKey]):
+        _, previous = self._remote.get(node_id, (0.0, set()))
+        for key in previous - keys:
+            self.mark_left(key)
+        self._remote[node_id] = (self._ttl(), keys)
+
+    def apply_delta(self, node_id: str, joined: Set[PresenceKey], left: Set[PresenceKey]):
+        expires_at, keys = self._remote.get(node_id, (self._ttl(), set()))
+        keys = (keys | joined) - left
+        self._remote[node_id] = (max(expires_at, time.monotonic()), keys)
+        for key in left:
+            self.mark_left(key)
+
+    def forget_node(self, node_id: str):
+        _, keys = self._remote.pop(node_id, (0.0, set()))
+        for key in keys:
+            self.mark_left(key)
+
+    def mark_left(self, key: PresenceKey):
+        now = time.monotonic()
+        self._last_seen[key] = now
+        if len(self._last_seen) > 10000:
+            self._prune(now)
+
+    def _prune(self, now: float):
+        stale = [key for key, seen in self._last_seen.items() if now - seen > self.memory_seconds]
+        for key in stale:
+            del self._last_seen[key]
+
+    def is_present_remotely(self, key: PresenceKey) -> bool:
+        now = time.monotonic()
+        for node_id, (expires_at, keys) in list(self._remote.items()):
+            if expires_at < now:
+                # Узел молчит дольше трёх интервалов — считаем его пропавшим
+                self.forget_node(node_id)
+                continue
+            if key in keys:
+                return True
+        return False
+
+    def seconds_since_seen(self, key: PresenceKey) -> Optional[float]:
+        seen = self._last_seen.get(key)
+        if seen is None:
+            return None
+        return time.monotonic() - seen
@@ -0,0 +1,58 @@
+# backend/app/principal_cache.py
+"""
+Кэш аутентифицированных пользователей для get_current_user.
+
+Токен несёт user_id, поэтому пользователь ищется по первичному ключу, а
+найденный хранится отсоединённым от сессии не дольше
+PRINCIPAL_CACHE_TTL_SECONDS. При попадании объект присоединяется к сессии
+запроса через merge(load=False) — без SELECT, так что обычный запрос
+проверяет только подпись токена. Изменения пользователя через API
+сбрасывают запись сразу; на других узлах она устаревает максимум на TTL.
+"""
+import os
+from typing import Optional
+from uuid import UUID as PyUUID
+
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from . import models
+from .chat_cache import TTLCache
+
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_MAX_USERS = int(os.getenv("PRINCIPAL_CACHE_MAX_USERS", "10000"))
+
+_COLUMNS = [column.key for column in models.User.__table__.columns]
+
+
+class PrincipalCache:
+    def __init__(self, ttl_seconds: float = PRINCIPAL_CACHE_TTL_SECONDS, max_users: int = PRINCIPAL_CACHE_MAX_USERS):
+        self.users = TTLCache(max_users, ttl_seconds)
+        self.db_loads = 0
+
+    def get_user(self, db: Session, user_id: PyUUID) -> Optional[models.User]:
+        """Пользователь, присоединённый к сессии db; None — если его нет."""
+        cached = self.users.get(user_id)
+        if cached is None:
+            user = db.get(models.User, user_id)
+            self.db_loads += 1
+            if user is None:
+                return None
+            self.users.set(user_id, self._detached_copy(user))
+            return user
+        return db.merge(cached, load=False)
+
+    @staticmethod
+    def _detached_copy(user: models.User) -> models.User:
+        # Копия, а не сам объект: он принадлежит сессии запроса и может меняться
+        copy = models.User(**{key: getattr(user, key) for key in _COLUMNS})
+        make_transient_to_detached(copy)
+        return copy
+
+    def invalidate(self, user_id):
+        self.users.invalidate(PyUUID(str(user_id)))
+
+    def clear(self):
+        self.users.clear()
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,78 @@
+# backend/app/profile_cache.py
+"""
+Кэш готовых профилей пользователей (UserProfileResponse).
+
+Профиль собирается один раз — пользователь с языками одним запросом,
+названия языков из справочника в памяти — и живёт не дольше
+PROFILE_CACHE_TTL_SECONDS. Изменения профиля, языков и аватара через API
+сбрасывают запись сразу; на других узлах она устаревает максимум на TTL.
+"""
+import os
+from typing import Dict, Iterable, List
+from uuid import UUID as PyUUID
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, joinedload
+
+from . import models, schemas
+from .chat_cache import TTLCache
+from .language_cache import language_cache
+
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "60"))
+PROFILE_CACHE_MAX_USERS = int(os.getenv("PROFILE_CACHE_MAX_USERS", "50000"))
+
+
+def language_link(assoc: models.UserLanguageAssociation) -> schemas.UserLanguageLink:
+    language = language_cache.get(assoc.language_id)
+    return schemas.UserLanguageLink(
+        id=assoc.language_id,
+        name=language.name if language else "",
+        code=language.code if language else "",
+        level=assoc.level,
+        type=assoc.type
+    )
+
+
+def profile_response(user: models.User) -> schemas.UserProfileResponse:
+    """Профиль пользователя с языками; language_associations должны быть загружены."""
+    profile = schemas.UserProfileResponse.model_validate(user)
+    profile.languages = [language_link(assoc) for assoc in user.language_associations]
+    return profile
+
+
+class ProfileCache:
+    def __init__(self, ttl_seconds: float = PROFILE_CACHE_TTL_SECONDS, max_users: int = PROFILE_CACHE_MAX_USERS):
+        self.cache = TTLCache(max_users, ttl_seconds)
+        self.db_loads = 0
+
+    def profiles(self, db: Session, user_ids: Iterable[PyUUID]) -> Dict[PyUUID, schemas.UserProfileResponse]:
+        """Профили пользователей; недостающие грузятся одним запросом. Несуществующих в ответе нет."""
+        found = {}
+        missing: List[PyUUID] = []
+        for user_id in user_ids:
+            profile = self.cache.get(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = profile
+
+        if missing:
+            users = db.execute(
+                select(models.User)
+                .options(joinedload(models.User.language_associations))
+                .where(models.User.id.in_(missing))
+            ).unique().scalars()
+            self.db_loads += 1
+            for user in users:
+                found[user.id] = profile_response(user)
+                self.cache.set(user.id, found[user.id])
+        return found
+
+    def invalidate(self, user_id):
+        self.cache.invalidate(PyUUID(str(user_id)))
+
+    def clear(self):
+        self.cache.clear()
+
+
+profile_cache = ProfileCache()
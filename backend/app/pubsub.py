@@ -0,0 +1,237 @@
+# backend/app/pubsub.py
+"""
+Транспорт публикации/подписки между узлами (воркерами uvicorn, контейнерами).
+
+ConnectionManager доставляет сообщение своим локальным сокетам сам, а через
+транспорт публикует его остальным узлам — каждый узел доставляет полученное
+только своим клиентам. Транспорт передаёт непрозрачные строки и ничего не знает
+о формате сообщений.
+"""
+import asyncio
+import os
+from abc import ABC, abstractmethod
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .logger import logger
+
+# Обработчик входящей публикации
+MessageHandler = Callable[[str], None]
+
+# Какой транспорт использовать: "inprocess" (один процесс) или "postgres" (LISTEN/NOTIFY)
+WS_PUBSUB_BACKEND = os.getenv("WS_PUBSUB_BACKEND", "inprocess")
+# Канал Postgres для рассылки
+WS_PUBSUB_CHANNEL = os.getenv("WS_PUBSUB_CHANNEL", "langbridge_ws")
+
+# Postgres ограничивает payload NOTIFY 8000 байтами. Берём с запасом и режем
+# по символам: 1800 символов UTF-8 гарантированно укладываются в 7200 байт.
+NOTIFY_MAX_BYTES = 7900
+NOTIFY_CHUNK_CHARS = 1800
+# Сколько секунд храним недособранные части сообщения
+CHUNK_REASSEMBLY_TTL = 30.0
+
+
+class PubSubBackend(ABC):
+    """Базовый интерфейс транспорта."""
+
+    # False — узел единственный, публиковать некому
+    distributed = True
+
+    @abstractmethod
+    async def start(self, on_message: MessageHandler):
+        ...
+
+    @abstractmethod
+    def publish(self, payload: str):
+        """Публикует payload другим узлам. Не блокирует вызывающего."""
+
+    async def stop(self):
+        pass
+
+
+class InProcessPubSub(PubSubBackend):
+    """Транспорт по умолчанию для одного процесса: все сокеты локальные."""
+
+    distributed = False
+
+    async def start(self, on_message: MessageHandler):
+        pass
+
+    def publish(self, payload: str):
+        pass
+
+
+class LocalBroker:
+    """
+    Локальная замена брокера для тестов: несколько узлов в одном процессе,
+    доставка асинхронная и только в виде строк — как через настоящий транспорт.
+    """
+
+    def __init__(self):
+        self.nodes: List["LocalPubSub"] = []
+
+    def backend(self) -> "LocalPubSub":
+        return LocalPubSub(self)
+
+
+class LocalPubSub(PubSubBackend):
+    def __init__(self, broker: LocalBroker):
+        self.broker = broker
+        self._on_message: Optional[MessageHandler] = None
+
+    async def start(self, on_message: MessageHandler):
+        self._on_message = on_message
+        self.broker.nodes.append(self)
+
+    def publish(self, payload: str):
+        loop = asyncio.get_running_loop()
+        for node in self.broker.nodes:
+            if node._on_message is not None:
+                loop.call_soon(node._on_message, payload)
+
+    async def stop(self):
+        if self in self.broker.nodes:
+            self.broker.nodes.remove(self)
+
+
+def split_notify_payload(payload: str) -> List[str]:
+    """Режет payload на части, каждая из которых помещается в один NOTIFY."""
+    if len(payload.encode("utf-8")) <= NOTIFY_MAX_BYTES - 2:
+        return ["0:" + payload]
+    message_id = uuid.uuid4().hex
+    parts = [payload[i:i + NOTIFY_CHUNK_CHARS] for i in range(0, len(payload), NOTIFY_CHUNK_CHARS)]
+    return [f"1:{message_id}:{index}:{len(parts)}:{part}" for index, part in enumerate(parts)]
+
+
+class ChunkAssembler:
+    """Собирает сообщения, разрезанные split_notify_payload."""
+
+    def __init__(self, ttl: float = CHUNK_REASSEMBLY_TTL):
+        self.ttl = ttl
+        # { message_id: (время первой части, [части]) }
+        self._pending: Dict[str, Tuple[float, List[Optional[str]]]] = {}
+
+    def feed(self, raw: str) -> Optional[str]:
+        if raw.startswith("0:"):
+            return raw[2:]
+        _, message_id, index, total, part = raw.split(":", 4)
+        now = time.monotonic()
+        self._purge(now)
+        started, parts = self._pending.setdefault(message_id, (now, [None] * int(total)))
+        parts[int(index)] = part
+        if any(p is None for p in parts):
+            return None
+        del self._pending[message_id]
+        return "".join(parts)
+
+    def _purge(self, now: float):
+        expired = [mid for mid, (started, _) in self._pending.items() if now - started > self.ttl]
+        for mid in expired:
+            logger.warning(f"Dropping incomplete pub/sub message {mid}")
+            del self._pending[mid]
+
+
+class PostgresPubSub(PubSubBackend):
+    """
+    Транспорт на Postgres LISTEN/NOTIFY. Одно соединение слушает канал, второе
+    публикует; публикация идёт через внутреннюю очередь одной задачей, поэтому
+    порядок сообщений сохраняется, а publish() не ждёт базу.
+    """
+
+    def __init__(self, dsn: str, channel: str = WS_PUBSUB_CHANNEL, reconnect_delay: float = 1.0):
+        self.dsn = dsn
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._on_message: Optional[MessageHandler] = None
+        self._assembler = ChunkAssembler()
+        self._outbox: Optional[asyncio.Queue] = None
+        self._listen_conn = None
+        self._publisher_task: Optional[asyncio.Task] = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self, on_message: MessageHandler):
+        self._on_message = on_message
+        self._outbox = asyncio.Queue()
+        self._stopping = False
+        self._listener_task = asyncio.create_task(self._listen_forever())
+        self._publisher_task = asyncio.create_task(self._publish_forever())
+
+    def publish(self, payload: str):
+        if self._outbox is None:
+            logger.error("PostgresPubSub.publish called before start(); dropping message")
+            return
+        self._outbox.put_nowait(payload)
+
+    async def stop(self):
+        self._stopping = True
+        for task in (self._listener_task, self._publisher_task):
+            if task:
+                task.cancel()
+        if self._listen_conn is not None and not self._listen_conn.is_closed():
+            await self._listen_conn.close()
+
+    def _on_notify(self, connection, pid, channel, raw: str):
+        try:
+            payload = self._assembler.feed(raw)
+        except ValueError:
+            logger.error(f"Malformed pub/sub notification on {channel}: {raw[:80]}")
+            return
+        if payload is not None and self._on_message:
+            self._on_message(payload)
+
+    async def _listen_forever(self):
+        import asyncpg
+
+        while not self._stopping:
+            try:
+                self._listen_conn = await asyncpg.connect(self.dsn)
+                await self._listen_conn.add_listener(self.channel, self._on_notify)
+                logger.info(f"Listening for WebSocket pub/sub on Postgres channel '{self.channel}'")
+                closed = asyncio.Event()
+                self._listen_conn.add_termination_listener(lambda conn: closed.set())
+                await closed.wait()
+                logger.warning("Postgres pub/sub listener connection lost, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Postgres pub/sub listener error: {e}")
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def _publish_forever(self):
+        import asyncpg
+
+        conn = None
+        while True:
+            payload = await self._outbox.get()
+            for chunk in split_notify_payload(payload):
+                for attempt in range(2):
+                    try:
+                        if conn is None or conn.is_closed():
+                            conn = await asyncpg.connect(self.dsn)
+                        await conn.execute("SELECT pg_notify($1, $2)", self.channel, chunk)
+                        break
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Failed to publish to Postgres channel '{self.channel}': {e}")
+                        conn = None
+                        await asyncio.sleep(self.reconnect_delay)
+
+
+def _asyncpg_dsn(database_url: str) -> str:
+    """postgresql+psycopg2://... -> postgresql://... (asyncpg не понимает имя драйвера)."""
+    scheme, sep, rest = database_url.partition("://")
+    return scheme.split("+", 1)[0] + sep + rest
+
+
+def create_pubsub() -> PubSubBackend:
+    """Выбирает транспорт по переменной окружения WS_PUBSUB_BACKEND."""
+    if WS_PUBSUB_BACKEND == "postgres":
+        from .database import DATABASE_URL
+        dsn = os.getenv("WS_PUBSUB_DSN") or _asyncpg_dsn(DATABASE_URL)
+        return PostgresPubSub(dsn)
+    if WS_PUBSUB_BACKEND != "inprocess":
+        logger.warning(f"Unknown WS_PUBSUB_BACKEND '{WS_PUBSUB_BACKEND}', falling back to in-process delivery")
+    return InProcessPubSub()
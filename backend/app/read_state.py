@@ -0,0 +1,108 @@
+# backend/app/read_state.py
+"""
+Прочитанность как "водяной знак": у каждого участника чата хранится номер
+последнего прочитанного сообщения (chat_participants.last_read_seq).
+
+Непрочитанных = chats.last_seq - last_read_seq, без подсчёта по messages.
+Пометить чат прочитанным — один UPDATE одной строки участника. Отправитель
+своим сообщением автоматически "дочитывает" чат до него. Импортированная
+история сдвигает знаки всех участников на число загруженных сообщений,
+чтобы старые сообщения не считались непрочитанными.
+"""
+import asyncio
+import os
+from typing import Dict, Optional, Tuple
+from uuid import UUID as PyUUID
+
+from sqlalchemy import case, func, select, update
+
+from . import models
+from .logger import logger
+
+# Окно склейки уведомлений о прочтении, в миллисекундах
+READ_RECEIPT_WINDOW_MS = float(os.getenv("READ_RECEIPT_WINDOW_MS", "500"))
+
+
+def unread_count_expression():
+    """Число непрочитанных для строки chat_participants, присоединённой к chats."""
+    return models.Chat.last_seq - models.chat_participants.c.last_read_seq
+
+
+def mark_read_statement(chat_id: PyUUID, user_id: PyUUID, up_to_seq: Optional[int] = None):
+    """
+    UPDATE водяного знака участника до последнего сообщения чата (или до
+    up_to_seq, если он меньше). Знак только растёт. RETURNING отдаёт новое
+    значение; пустой результат — знак не сдвинулся или участника нет.
+    """
+    participants = models.chat_participants.c
+    target = select(models.Chat.last_seq).where(models.Chat.id == chat_id).scalar_subquery()
+    if up_to_seq is not None:
+        target = case((target < up_to_seq, target), else_=up_to_seq)
+    return (
+        update(models.chat_participants)
+        .where(participants.chat_id == chat_id, participants.user_id == user_id, participants.last_read_seq < target)
+        .values(last_read_seq=target, last_read_timestamp=func.now())
+        .returning(participants.last_read_seq)
+    )
+
+
+def sender_watermark_statements(chat_id: PyUUID, rows) -> list:
+    """UPDATE водяных знаков отправителей пакета до их последнего сообщения в чате."""
+    participants = models.chat_participants.c
+    last_by_sender: Dict[PyUUID, int] = {}
+    for row in rows:
+        last_by_sender[row["sender_id"]] = max(row["seq"], last_by_sender.get(row["sender_id"], 0))
+    return [
+        update(models.chat_participants)
+        .where(participants.chat_id == chat_id, participants.user_id == sender_id, participants.last_read_seq < seq)
+        .values(last_read_seq=seq)
+        for sender_id, seq in last_by_sender.items()
+    ]
+
+
+def imported_watermark_statement(chat_id: PyUUID, count: int):
+    """UPDATE водяных знаков всех участников чата на count импортированных сообщений."""
+    participants = models.chat_participants.c
+    return (
+        update(models.chat_participants)
+        .where(participants.chat_id == chat_id)
+        .values(last_read_seq=participants.last_read_seq + count)
+    )
+
+
+class ReadReceiptCoalescer:
+    """
+    Склеивает уведомления о прочтении: за окно READ_RECEIPT_WINDOW_MS по каждой
+    паре (чат, пользователь) уходит одно событие с наибольшим номером.
+    """
+
+    def __init__(self, manager, window_ms: float = READ_RECEIPT_WINDOW_MS):
+        self.manager = manager
+        self.window = window_ms / 1000
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def submit(self, chat_id: str, user_id: str, last_read_seq: int):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Цикл событий сменился (перезапуск приложения): старый таймер уже не сработает
+            self._loop = loop
+            self._flush_handle = None
+        key = (chat_id, user_id)
+        self._pending[key] = max(last_read_seq, self._pending.get(key, 0))
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, lambda: asyncio.create_task(self.flush()))
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        self._flush_handle = None
+        for (chat_id, user_id), last_read_seq in pending.items():
+            await self.manager.broadcast_event(chat_id, {
+                "type": "read_receipt",
+                "chat_id": chat_id,
+                "user_id": user_id,
+                "last_read_seq": last_read_seq,
+            })
+        if pending:
+            logger.debug(f"Broadcasted {len(pending)} coalesced read receipts")
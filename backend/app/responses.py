@@ -0,0 +1,30 @@
+# backend/app/responses.py
+"""
+Готовые JSON-ответы для горячих эндпоинтов.
+
+Эндпоинт, собравший ответ из проекции столбцов, отдаёт его сразу через
+json_response, без повторной валидации через response_model. Формат дат
+и UUID совпадает с тем, что выдаёт Pydantic.
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional
+from uuid import UUID as PyUUID
+
+from fastapi import Response
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, PyUUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dump_json(payload: Any) -> bytes:
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def json_response(payload: Any, headers: Optional[Dict[str, str]] = None, status_code: int = 200) -> Response:
+    return Response(content=dump_json(payload), media_type="application/json", headers=headers, status_code=status_code)
@@ -1,16 +1,29 @@
-from typing import List
+import uuid
+from datetime import datetime
+from typing import List, Optional
 from uuid import UUID as PyUUID
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import and_, select, func, desc, join
-from sqlalchemy.orm import Session, aliased, joinedload, contains_eager
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, select, desc, join, tuple_, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, aliased, contains_eager, selectinload
 import json
 
+from ..chat_cache import chat_directory
 from ..fcm_service import send_push_notification
+from ..read_state import mark_read_statement, unread_count_expression
+from .ws import read_receipts
 from pydantic import BaseModel
 from .users import get_current_user
 from .. import models, database, schemas
 from ..logger import logger
+from ..etags import cache_headers, chat_version, etag_matches, inbox_version, make_etag, not_modified
+from ..export import export_chat_lines, gzip_chunks
+from ..responses import json_response
+from ..pagination import (
+    encode_cursor, decode_cursor, NEXT_CURSOR_HEADER, PREV_CURSOR_HEADER, MAX_PAGE_SIZE,
+)
 
 router = APIRouter(prefix="/api/chats", tags=["chats"])
 
@@ -69,47 +82,54 @@ def get_or_create_private_chat(
         current_user: models.User = Depends(get_current_user),
         db: Session = Depends(database.get_db)
 ):
+    """
+    Личный чат двух пользователей. Чат ищется по ключу пары участников
+    (один индексный поиск), а создаётся через INSERT ... ON CONFLICT DO NOTHING,
+    поэтому параллельные запросы не создают дубликатов.
+    """
     if current_user.id == partner_id:
         raise HTTPException(status_code=400, detail="Cannot create a chat with yourself.")
 
-    partner_participant = aliased(models.chat_participants)
-
-    chat = db.query(models.Chat).join(
-        models.chat_participants,
-        and_(
-            models.Chat.id == models.chat_participants.c.chat_id,
-            models.chat_participants.c.user_id == current_user.id
-        )
-    ).join(
-        partner_participant,
-        and_(
-            models.Chat.id == partner_participant.c.chat_id,
-            partner_participant.c.user_id == partner_id
-        )
-    ).options(
-        joinedload(models.Chat.participants).subqueryload(models.User.language_associations).joinedload(models.UserLanguageAssociation.language)
-    ).filter(
-        models.Chat.title.is_(None)
-    ).first()
-
+    pair_key = models.private_pair_key(current_user.id, partner_id)
+    chat = _private_chat_by_key(db, pair_key)
     if chat:
         logger.info(f"Found existing private chat between {current_user.id} and {partner_id}")
         return schemas.ChatWithParticipantsResponse.model_validate(chat)
 
-    logger.info(f"Creating new private chat between {current_user.id} and {partner_id}")
-    partner = db.query(models.User).filter(models.User.id == partner_id).first()
+    partner = db.get(models.User, partner_id)
     if not partner:
         raise HTTPException(status_code=404, detail="Partner user not found.")
 
-    new_chat = models.Chat()
-    new_chat.participants.append(current_user)
-    new_chat.participants.append(partner)
-
-    db.add(new_chat)
+    new_chat_id = db.scalar(
+        _insert_ignoring_conflict(db, models.Chat)
+        .values(id=uuid.uuid4(), pair_key=pair_key)
+        .on_conflict_do_nothing(index_elements=["pair_key"])
+        .returning(models.Chat.id)
+    )
+    if new_chat_id is not None:
+        logger.info(f"Creating new private chat between {current_user.id} and {partner_id}")
+        db.execute(insert(models.chat_participants), [
+            {"chat_id": new_chat_id, "user_id": current_user.id},
+            {"chat_id": new_chat_id, "user_id": partner_id},
+        ])
     db.commit()
-    db.refresh(new_chat)
 
-    return schemas.ChatWithParticipantsResponse.model_validate(new_chat)
+    chat = _private_chat_by_key(db, pair_key)
+    chat_directory.invalidate_chat(chat.id)
+    return schemas.ChatWithParticipantsResponse.model_validate(chat)
+
+
+def _private_chat_by_key(db: Session, pair_key: str):
+    return db.query(models.Chat).options(
+        selectinload(models.Chat.participants)
+    ).filter(models.Chat.pair_key == pair_key).first()
+
+
+def _insert_ignoring_conflict(db: Session, table):
+    """INSERT с поддержкой ON CONFLICT для диалекта текущей базы."""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
 
 
 @router.post("/", response_model=schemas.ChatWithParticipantsResponse, status_code=status.HTTP_201_CREATED)
@@ -127,6 +147,7 @@ async def create_chat(
         db.add(new_chat)
         db.commit()
         db.refresh(new_chat)
+        chat_directory.invalidate_chat(new_chat.id)
         logger.info(f"Successfully created chat '{new_chat.title}' with ID: {new_chat.id}")
         return schemas.ChatWithParticipantsResponse.model_validate(new_chat)
     except Exception as e:
@@ -141,17 +162,38 @@ async def create_chat(
 @router.get("/{chat_id_str}/messages", response_model=List[schemas.MessageResponse])
 async def get_chat_messages(
         chat_id_str: str,
+        request: Request,
+        response: Response,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
         db: Session = Depends(database.get_db)
 ):
+    """
+    Сообщения чата по возрастанию (timestamp, id).
+
+    Без параметров отдаётся вся история (как раньше). С limit — страница:
+    без курсора последние limit сообщений, с before — более старые, с after —
+    более новые. Курсоры соседних страниц приходят в заголовках X-Prev-Cursor
+    (передавать как before) и X-Next-Cursor (передавать как after).
+
+    Ответ помечается ETag по версии чата; при совпадении If-None-Match —
+    304 без чтения сообщений.
+    """
     logger.info(f"Request for messages from chat_id: {chat_id_str}")
     try:
         chat_uuid = PyUUID(chat_id_str)
     except ValueError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid chat_id format")
 
-    chat = db.query(models.Chat).filter(models.Chat.id == chat_uuid).first()
-    if not chat:
+    version = chat_version(db, chat_uuid)
+    if version is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
+    # Тег зависит и от параметров: у каждой страницы своё представление
+    etag = make_etag(chat_uuid, *version, before, after, limit)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers.update(cache_headers(etag))
 
     RepliedMessage = aliased(models.Message)
 
@@ -162,90 +204,191 @@ async def get_chat_messages(
             contains_eager(models.Message.reply_to_message.of_type(RepliedMessage))
         )
         .filter(models.Message.chat_id == chat_uuid)
-        .order_by(models.Message.timestamp)
     )
 
-    messages = db.execute(stmt).scalars().all()
+    if before is None and after is None and limit is None:
+        messages = db.execute(stmt.order_by(models.Message.timestamp, models.Message.id)).scalars().all()
+        logger.info(f"Found {len(messages)} messages for chat {chat_uuid}")
+        return messages
 
-    logger.info(f"Found {len(messages)} messages for chat {chat_uuid}")
+    if before is not None and after is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Use either 'before' or 'after', not both")
+    try:
+        cursor = decode_cursor(before or after, datetime, PyUUID) if (before or after) else None
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    page_size = limit or MAX_PAGE_SIZE
+    sort_key = tuple_(models.Message.timestamp, models.Message.id)
+    if cursor is not None:
+        cursor = tuple_(*cursor, types=[models.Message.timestamp.type, models.Message.id.type])
+    if after is not None:
+        # Вперёд: читаем по возрастанию ключа
+        stmt = stmt.where(sort_key > cursor).order_by(models.Message.timestamp, models.Message.id)
+    else:
+        # Последняя страница или назад: читаем по убыванию и разворачиваем
+        if cursor is not None:
+            stmt = stmt.where(sort_key < cursor)
+        stmt = stmt.order_by(desc(models.Message.timestamp), desc(models.Message.id))
+
+    # Одна лишняя строка показывает, есть ли что-то за пределами страницы
+    messages = db.execute(stmt.limit(page_size + 1)).scalars().all()
+    has_more = len(messages) > page_size
+    messages = messages[:page_size]
+    if after is None:
+        messages.reverse()
+
+    if messages:
+        first, last = messages[0], messages[-1]
+        has_older = has_more if after is None else True
+        has_newer = has_more if after is not None else before is not None
+        if has_older:
+            response.headers[PREV_CURSOR_HEADER] = encode_cursor(first.timestamp, first.id)
+        if has_newer:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.timestamp, last.id)
+
+    logger.info(f"Returning page of {len(messages)} messages for chat {chat_uuid}")
     return messages
 
 
+@router.get("/{chat_id_str}/export")
+async def export_chat(
+        chat_id_str: str,
+        compress: bool = False,
+        current_user: models.User = Depends(get_current_user),
+        db: Session = Depends(database.get_db)
+):
+    """
+    Выгрузка всей истории чата участником: NDJSON, по сообщению на строку,
+    отдаётся потоком. С compress=true — файл .ndjson.gz.
+    """
+    try:
+        chat_uuid = PyUUID(chat_id_str)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid chat_id format")
+
+    is_participant = db.execute(
+        select(models.chat_participants.c.chat_id).where(
+            models.chat_participants.c.chat_id == chat_uuid,
+            models.chat_participants.c.user_id == current_user.id,
+        )
+    ).first()
+    if not is_participant:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
+
+    logger.info(f"User {current_user.id} exporting chat {chat_uuid} (compress={compress})")
+    chunks = export_chat_lines(chat_uuid)
+    filename = f"chat-{chat_uuid}.ndjson"
+    media_type = "application/x-ndjson"
+    if compress:
+        chunks = gzip_chunks(chunks)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.get("/", response_model=List[schemas.ChatResponse])
 async def get_user_chats(
+        request: Request,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
         current_user: models.User = Depends(get_current_user),
         db: Session = Depends(database.get_db)
 ):
     """
     Возвращает список чатов, в которых состоит ТЕКУЩИЙ пользователь,
     с подсчетом непрочитанных сообщений и последним сообщением.
+
+    Последнее сообщение берётся из сводки чата, непрочитанные — разность
+    chats.last_seq и водяного знака участника, поэтому список — одно чтение,
+    упорядоченное по последней активности, плюс один запрос за участниками.
+    Читаются только нужные столбцы, и ответ собирается сразу в формате
+    ChatResponse, без ORM-объектов и повторной валидации.
+    С limit отдаётся страница, курсор следующей — в заголовке X-Next-Cursor.
+    Ответ помечается ETag по версии списка; при совпадении If-None-Match —
+    304 без основного запроса.
     """
     logger.info(f"Fetching chats for user {current_user.id} ({current_user.username})")
 
-    # 1. Правильно получаем все чаты, в которых состоит текущий пользователь
-    user_chats_query = db.query(models.Chat).join(
+    etag = make_etag(current_user.id, *inbox_version(db, current_user.id), limit, cursor)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    chats = models.Chat
+    stmt = select(
+        chats.id,
+        chats.title,
+        chats.timestamp,
+        chats.last_activity_at,
+        chats.last_message_id,
+        chats.last_message_preview,
+        chats.last_message_type,
+        chats.last_message_at,
+        unread_count_expression().label("unread_count"),
+    ).join(
         models.chat_participants,
-        models.Chat.id == models.chat_participants.c.chat_id
-    ).filter(
-        models.chat_participants.c.user_id == current_user.id
-    ).options(
-        # Предзагружаем участников, чтобы избежать N+1 запросов позже
-        joinedload(models.Chat.participants)
-    )
-
-    user_chats = user_chats_query.all()
-
-    if not user_chats:
-        logger.info(f"No chats found for user {current_user.id}")
-        return []
-
-    chat_ids = [chat.id for chat in user_chats]
-    logger.info(f"User {current_user.id} is a participant of {len(chat_ids)} chats. Fetching details.")
-
-    # 2. Оптимизированный запрос для получения последних сообщений
-    last_message_subquery = select(
-        models.Message.chat_id,
-        func.max(models.Message.timestamp).label('max_ts')
-    ).where(models.Message.chat_id.in_(chat_ids)).group_by(models.Message.chat_id).subquery('last_msg_sq')
-
-    last_messages_q = select(models.Message).join(
-        last_message_subquery,
         and_(
-            models.Message.chat_id == last_message_subquery.c.chat_id,
-            models.Message.timestamp == last_message_subquery.c.max_ts
+            chats.id == models.chat_participants.c.chat_id,
+            models.chat_participants.c.user_id == current_user.id
         )
-    )
-    last_messages = db.execute(last_messages_q).scalars().all()
-    last_messages_map = {msg.chat_id: msg for msg in last_messages}
-
-    # 3. Оптимизированный запрос для подсчета непрочитанных сообщений
-    unread_counts_q = select(
-        models.Message.chat_id,
-        func.count().label('unread_count')
-    ).where(
-        models.Message.chat_id.in_(chat_ids),
-        models.Message.is_read == False,
-        models.Message.sender_id != current_user.id # Считаем только чужие непрочитанные
-    ).group_by(models.Message.chat_id)
-
-    unread_counts_result = db.execute(unread_counts_q).all()
-    unread_counts_map = {chat_id: count for chat_id, count in unread_counts_result}
-
-    # 4. Собираем ответ
-    response_chats = []
-    for chat in user_chats:
-        chat_data = schemas.ChatResponse.model_validate(chat)
-        chat_data.last_message = last_messages_map.get(chat.id)
-        chat_data.unread_count = unread_counts_map.get(chat.id, 0)
-        response_chats.append(chat_data)
-
-    # 5. Сортировка
-    response_chats.sort(
-        key=lambda c: c.last_message.timestamp if c.last_message else c.timestamp,
-        reverse=True
-    )
+    ).order_by(desc(chats.last_activity_at), desc(chats.id))
+
+    if cursor:
+        try:
+            activity_at, chat_id = decode_cursor(cursor, datetime, PyUUID)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        stmt = stmt.where(
+            tuple_(chats.last_activity_at, chats.id)
+            < tuple_(activity_at, chat_id, types=[chats.last_activity_at.type, chats.id.type])
+        )
+    if limit:
+        stmt = stmt.limit(limit + 1)
+
+    rows = db.execute(stmt).all()
+    headers = cache_headers(etag)
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].last_activity_at, rows[-1].id)
+
+    # Участники всех чатов страницы — одним запросом и только нужные столбцы
+    participants = {row.id: [] for row in rows}
+    if participants:
+        participant_rows = db.execute(
+            select(
+                models.chat_participants.c.chat_id,
+                models.User.id,
+                models.User.username,
+                models.User.avatar_url,
+            ).join(
+                models.User, models.User.id == models.chat_participants.c.user_id
+            ).where(models.chat_participants.c.chat_id.in_(list(participants)))
+        )
+        for chat_id, user_id, username, avatar_url in participant_rows:
+            participants[chat_id].append({"id": user_id, "username": username, "avatar_url": avatar_url})
+
+    response_chats = [
+        {
+            "id": row.id,
+            "title": row.title,
+            "timestamp": row.timestamp,
+            "participants": participants[row.id],
+            "last_message": {
+                "content": row.last_message_preview,
+                "timestamp": row.last_message_at,
+                "type": row.last_message_type,
+            } if row.last_message_id is not None else None,
+            "unread_count": row.unread_count,
+        }
+        for row in rows
+    ]
+
     logger.info(f"Returning {len(response_chats)} chats for user {current_user.id}")
-    return response_chats
+    return json_response(response_chats, headers)
 
 @router.post("/{chat_id_str}/read", status_code=status.HTTP_204_NO_CONTENT)
 async def mark_chat_as_read(
@@ -253,17 +396,18 @@ async def mark_chat_as_read(
         current_user: models.User = Depends(get_current_user),
         db: Session = Depends(database.get_db)
 ):
-    """Помечает все сообщения в чате как прочитанные для текущего пользователя."""
+    """
+    Помечает все сообщения в чате как прочитанные для текущего пользователя:
+    сдвигает его водяной знак до последнего сообщения чата. Остальные участники
+    получают склеенное уведомление read_receipt.
+    """
     try:
         chat_uuid = PyUUID(chat_id_str)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid chat ID format")
 
-    # Обновляем все сообщения в чате, которые не от текущего пользователя
-    db.query(models.Message).filter(
-        models.Message.chat_id == chat_uuid,
-        models.Message.sender_id != current_user.id
-    ).update({"is_read": True}, synchronize_session=False)
-
+    last_read_seq = db.scalar(mark_read_statement(chat_uuid, current_user.id))
     db.commit()
+    if last_read_seq is not None:
+        read_receipts.submit(str(chat_uuid), str(current_user.id), last_read_seq)
     logger.info(f"User {current_user.id} marked chat {chat_id_str} as read.")
@@ -10,8 +10,12 @@ import subprocess
 from typing import List
 
 from .users import get_current_user
-from .. import database, models, schemas
+from .. import database, models
 from ..websocket_manager import ConnectionManager
+from ..message_writer import message_writer, new_message_values, message_edited_statement
+from ..principal_cache import principal_cache
+from ..profile_cache import profile_cache
+from ..search import message_search_text
 from ..logger import logger
 
 from .ws import manager
@@ -138,27 +142,22 @@ async def upload_video(
     duration_ms = get_video_duration(final_video_path) # Предполагаем, что у вас есть такая функция
     message_content_dict = {"video_url": video_url, "transcription": None, "duration_ms": duration_ms}
 
-    db_message = models.Message(
+    # Сохраняем через общий пакетный писатель сообщений
+    saved_message = await message_writer.submit(new_message_values(
         chat_id=chat_uuid,
         sender_id=sender_uuid,
         content=json.dumps(message_content_dict), # Контент должен быть строкой JSON
         type="video", # Указываем тип
         reply_to_message_id=reply_to_uuid_obj
-    )
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    # Загружаем связанный объект, если он есть, для корректной сериализации
-    db.refresh(db_message, ['reply_to_message'])
+    ))
 
-    # 4. Готовим сообщение для отправки по WebSocket
-    message_data_str = schemas.MessageResponse.model_validate(db_message).model_dump_json()
-    message_to_broadcast = json.loads(message_data_str)
+    # 4. Готовим сообщение для отправки по WebSocket (кодируется один раз для всех получателей)
+    message_frame = saved_message.model_dump_json()
 
     # 5. Отправляем сообщение всем в чате
-    await manager.broadcast(chat_id, message_to_broadcast)
+    await manager.broadcast(chat_id, message_frame)
 
-    return {"filename": final_video_filename, "url": video_url, "message_id": str(db_message.id)}
+    return {"filename": final_video_filename, "url": video_url, "message_id": str(saved_message.id)}
 
 def get_video_duration(video_path: str) -> int:
     try:
@@ -224,25 +223,20 @@ async def upload_audio(
         "duration_ms": duration_ms
     }
 
-    db_message = models.Message(
+    saved_message = await message_writer.submit(new_message_values(
         chat_id=chat_uuid,
         sender_id=sender_uuid,
         content=json.dumps(message_content_dict),
         type="audio",
         reply_to_message_id=reply_to_uuid_obj
-    )
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    db.refresh(db_message, ['reply_to_message'])
+    ))
 
-    # Валидируем через Pydantic, чтобы получить правильную структуру JSON
-    message_data_str = schemas.MessageResponse.model_validate(db_message).model_dump_json()
-    message_to_broadcast = json.loads(message_data_str)
+    # Готовый JSON-кадр для рассылки, кодируется один раз
+    message_frame = saved_message.model_dump_json()
 
-    await manager.broadcast(chat_id, message_to_broadcast)
+    await manager.broadcast(chat_id, message_frame)
 
-    return {"filename": audio_filename, "url": audio_url, "message_id": str(db_message.id)}
+    return {"filename": audio_filename, "url": audio_url, "message_id": str(saved_message.id)}
 
 
 # --- ДЕЛАЕМ ЭНДПОИНТ ТРАНСКРИПЦИИ УНИВЕРСАЛЬНЫМ ---
@@ -301,6 +295,8 @@ async def transcribe_media_message(  # Переименовываем функц
         logger.info(f"Successfully transcribed. First few words: {words_data[:5]}")
         content_data["transcription"] = transcription_result
         db_message.content = json.dumps(content_data)
+        db_message.search_text = message_search_text(db_message.content, db_message.type)
+        db.execute(message_edited_statement(db_message))
         db.commit()
 
     except Exception as e:
@@ -330,6 +326,8 @@ async def update_media_transcription( # Переименовываем
     content_data = json.loads(db_message.content)
     content_data["transcription"] = transcription_data
     db_message.content = json.dumps(content_data)
+    db_message.search_text = message_search_text(db_message.content, db_message.type)
+    db.execute(message_edited_statement(db_message))
     db.commit()
     return {"status": "success", "message_id": message_id_str}
 
@@ -370,6 +368,8 @@ async def upload_avatar(
     current_user.avatar_url = avatar_url
     db.add(current_user)
     db.commit()
+    principal_cache.invalidate(current_user.id)
+    profile_cache.invalidate(current_user.id)
     # db.refresh(current_user) # refresh не обязателен, т.к. мы возвращаем только URL
 
     return {"avatar_url": avatar_url}
@@ -1,22 +1,64 @@
-import uuid
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-from .. import models, database
+from .. import models, database, schemas, security
+from ..ingest import MessageIngest, ndjson_lines
+from ..message_writer import new_message_values, chat_summary_statement, assign_seq
+from ..read_state import sender_watermark_statements
 from ..logger import logger
+from .users import get_current_user
+from .ws import manager
 
 router = APIRouter(prefix="/api/messages", tags=["messages"])
 
 @router.post("/")
 def send_message(chat_id: str, sender_id: str, content: str, type: str = "text", db: Session = Depends(database.get_db)):
     logger.info(f"Got request to send message {chat_id}")
-    message = models.Message(
-        id=uuid.uuid4(),
-        chat_id=chat_id,
-        sender_id=sender_id,
-        content=content,
-        type=type,
-    )
+    values = new_message_values(chat_id=chat_id, sender_id=sender_id, content=content, type=type)
+    last_seq = db.scalar(chat_summary_statement(chat_id, [values]))
+    if last_seq is None:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    assign_seq([values], last_seq)
+    for statement in sender_watermark_statements(chat_id, [values]):
+        db.execute(statement)
+    message = models.Message(**values)
     db.add(message)
     db.commit()
     db.refresh(message)
-    return message
\ No newline at end of file
+    return message
+
+
+@router.post("/bulk", response_model=schemas.IngestReport)
+async def ingest_messages(
+        request: Request,
+        notify: bool = False,
+        any_sender: bool = False,
+        current_user: models.User = Depends(get_current_user),
+):
+    """
+    Массовая загрузка сообщений в чаты текущего пользователя. Тело — NDJSON,
+    по сообщению (MessageIngestItem) на строку, читается потоком и пишется
+    пакетами. Негодные строки и строки пакетов, которые не удалось записать,
+    пропускаются и перечисляются в отчёте.
+
+    Ограничение: обычный пользователь загружает только свои сообщения —
+    строки с чужим sender_id отклоняются, поэтому переписку двух людей так
+    перенести нельзя. Для переноса целиком администратор (security.ADMIN_USERNAMES)
+    передаёт any_sender=true: тогда принимаются сообщения любого участника чата.
+    С notify=true участникам каждого затронутого чата уходит одно событие
+    messages_ingested с числом сообщений и последним seq.
+    """
+    if any_sender and current_user.username not in security.ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Importing other participants' messages requires admin privileges")
+    logger.info(f"User {current_user.id} started bulk message ingest (any_sender={any_sender})")
+    ingest = MessageIngest(current_user.id, any_sender=any_sender)
+    report = await ingest.run(ndjson_lines(request.stream()))
+
+    if notify:
+        for chat_id, (count, last_seq) in ingest.chats.items():
+            await manager.broadcast_event(str(chat_id), {
+                "type": "messages_ingested",
+                "chat_id": str(chat_id),
+                "count": count,
+                "last_seq": last_seq,
+            })
+    return report
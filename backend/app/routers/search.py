@@ -0,0 +1,49 @@
+# backend/app/routers/search.py
+from typing import List, Optional
+from uuid import UUID as PyUUID
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.orm import Session
+
+from .users import get_current_user
+from .. import database, models, schemas
+from ..logger import logger
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
+from ..search import matched_words, search_messages
+
+router = APIRouter(prefix="/api/search", tags=["search"])
+
+
+@router.get("/messages", response_model=List[schemas.SearchHitResponse])
+async def search_chat_messages(
+        response: Response,
+        q: str = Query(..., min_length=1, max_length=200),
+        chat_id: Optional[PyUUID] = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        current_user: models.User = Depends(get_current_user),
+        db: Session = Depends(database.get_db)
+):
+    """
+    Поиск по сообщениям и расшифровкам медиа в чатах текущего пользователя
+    (или в одном chat_id). Самые релевантные — первыми; курсор следующей
+    страницы — в заголовке X-Next-Cursor. Для медиа возвращаются совпавшие
+    слова расшифровки с временем начала и конца.
+    """
+    logger.info(f"User {current_user.id} searching messages (chat={chat_id})")
+    try:
+        rows, next_cursor = search_messages(db, current_user.id, q, limit, chat_id=chat_id, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    logger.info(f"Returning {len(rows)} search hits for user {current_user.id}")
+    return [
+        schemas.SearchHitResponse(
+            message=schemas.MessageResponse.model_validate(message),
+            rank=rank,
+            words=matched_words(message, q),
+        )
+        for message, rank in rows
+    ]
@@ -1,7 +1,8 @@
 # backend/app/routers/translate.py
 from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel
-from googletrans import Translator, LANGUAGES
+from googletrans import Translator
+from ..language_cache import language_cache
 from ..logger import logger
 
 router = APIRouter(prefix="/api/translate", tags=["translate"])
@@ -9,6 +10,9 @@ router = APIRouter(prefix="/api/translate", tags=["translate"])
 # Используем одного и того же переводчика
 translator = Translator()
 
+# Коды справочника, которые googletrans называет иначе
+GOOGLE_LANGUAGE_CODES = {"zh": "zh-cn"}
+
 class TranslationRequest(BaseModel):
     text: str
     target_lang: str # Например, 'en', 'ru'
@@ -25,12 +29,14 @@ async def translate_text(request: TranslationRequest):
     if not request.text.strip():
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Text to translate cannot be empty.")
 
-    if request.target_lang not in LANGUAGES:
+    # Переводим только на языки из справочника приложения
+    if await language_cache.by_code_async(request.target_lang) is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid target language code: {request.target_lang}")
 
     try:
         logger.info(f"Translating text to '{request.target_lang}': '{request.text[:30]}...'")
-        translation = translator.translate(request.text, dest=request.target_lang)
+        translation = translator.translate(
+            request.text, dest=GOOGLE_LANGUAGE_CODES.get(request.target_lang, request.target_lang))
 
         response = TranslationResponse(
             translated_text=translation.text,
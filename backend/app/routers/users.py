@@ -1,19 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status, Query
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from sqlalchemy.orm import Session, joinedload, aliased
+from sqlalchemy.orm import Session
 from datetime import timedelta
 from typing import List, Optional
 from uuid import UUID as PyUUID
 from pydantic import BaseModel
 
 from .. import models, schemas, database, security
+from ..chat_cache import chat_directory
+from ..principal_cache import principal_cache
+from ..profile_cache import profile_cache, profile_response
+from ..etags import cache_headers, etag_matches, not_modified
+from ..language_cache import language_cache
 from ..logger import logger
+from ..matching import Searcher, find_partners, sync_user_matches, touch_statement
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
 from jose import JWTError, jwt
 
 router = APIRouter(prefix="/api/users", tags=["Users"])
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/users/token")
 
+# Сколько профилей можно запросить за раз
+PROFILE_BATCH_MAX_IDS = 100
+
 class FCMTokenUpdate(BaseModel):
     fcm_token: str
 
@@ -29,13 +39,32 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         if username is None:
             raise credentials_exception
         token_data = schemas.TokenData(username=username)
-    except JWTError:
+        user_id = PyUUID(payload["user_id"]) if payload.get("user_id") else None
+    except (JWTError, ValueError):
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
-    if user is None:
+    if user_id is not None:
+        user = principal_cache.get_user(db, user_id)
+    else:
+        # Токены, выданные до появления user_id
+        user = db.query(models.User).filter(models.User.username == token_data.username).first()
+    if user is None or user.username != token_data.username:
         raise credentials_exception
     return user
 
+
+def get_admin_user(current_user: models.User = Depends(get_current_user)):
+    """Текущий пользователь, если он из security.ADMIN_USERNAMES; иначе 403."""
+    if current_user.username not in security.ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return current_user
+
+
+def _user_changed(user_id):
+    """Сбрасывает кэши, в которых лежат данные пользователя."""
+    principal_cache.invalidate(user_id)
+    profile_cache.invalidate(user_id)
+    chat_directory.invalidate_user(user_id)
+
 @router.post("/update-fcm-token", status_code=status.HTTP_204_NO_CONTENT)
 async def update_fcm_token(
         token_data: FCMTokenUpdate,
@@ -46,10 +75,19 @@ async def update_fcm_token(
     logger.info(f"Updating FCM token for user {current_user.id}")
     current_user.fcm_token = token_data.fcm_token
     db.commit()
+    _user_changed(current_user.id)
     logger.info(f"FCM token for user {current_user.id} updated successfully.")
     return
 
 # --- Аутентификация и Регистрация ---
+def _hasher_busy() -> HTTPException:
+    logger.warning("Password hashing pool is saturated, rejecting request")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy, please retry",
+        headers={"Retry-After": "1"},
+    )
+
 @router.post("/register", response_model=schemas.UserProfileResponse, status_code=status.HTTP_201_CREATED)
 async def register_user(user_data: schemas.UserCreate, db: Session = Depends(database.get_db)):
     logger.info(f"Attempting to register new user: '{user_data.username}'")
@@ -58,12 +96,14 @@ async def register_user(user_data: schemas.UserCreate, db: Session = Depends(dat
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already registered")
 
     # 1. Проверяем, существует ли язык
-    language = db.query(models.Language).filter(models.Language.id == user_data.native_language_id).first()
-    if not language:
+    if await language_cache.get_async(user_data.native_language_id) is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid native language ID")
 
     # 2. Создаем пользователя и сразу добавляем язык
-    hashed_password = security.get_password_hash(user_data.password)
+    try:
+        hashed_password = await security.hash_password(user_data.password)
+    except security.PasswordHasherBusy:
+        raise _hasher_busy()
     new_user = models.User(username=user_data.username, hashed_password=hashed_password)
 
     # 3. Создаем ассоциацию с родным языком
@@ -75,6 +115,8 @@ async def register_user(user_data: schemas.UserCreate, db: Session = Depends(dat
     new_user.language_associations.append(native_language_association)
 
     db.add(new_user)
+    db.flush()
+    sync_user_matches(db, new_user.id, [(user_data.native_language_id, 'native')])
     db.commit()
     db.refresh(new_user)
 
@@ -83,34 +125,81 @@ async def register_user(user_data: schemas.UserCreate, db: Session = Depends(dat
 
     logger.info(f"User '{new_user.username}' registered with ID: {new_user.id}")
 
-    # Валидация и возврат ответа
-    user_profile = schemas.UserProfileResponse.model_validate(new_user)
-    languages_data = []
-    for assoc in new_user.language_associations:
-        # Для свежесозданного пользователя язык может быть еще не загружен в сессию
-        db.refresh(assoc, ['language'])
-        languages_data.append(schemas.UserLanguageLink(
-            id=assoc.language.id,
-            name=assoc.language.name,
-            code=assoc.language.code,
-            level=assoc.level,
-            type=assoc.type
-        ))
-    user_profile.languages = languages_data
-    return user_profile
+    return profile_response(new_user)
 
 @router.post("/token", response_model=schemas.Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    # ... (код этой функции не меняется)
     user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    try:
+        password_ok = user is not None and await security.check_password(form_data.password, user.hashed_password)
+    except security.PasswordHasherBusy:
+        raise _hasher_busy()
+    if not password_ok:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password", headers={"WWW-Authenticate": "Bearer"})
+    # Вход — активность: поднимает пользователя в выдаче поиска собеседников
+    db.execute(touch_statement(user.id))
+    db.commit()
     access_token_expires = timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = security.create_access_token(data={"sub": user.username, "user_id": str(user.id)}, expires_delta=access_token_expires)
     return {"access_token": access_token, "token_type": "bearer", "user_id": str(user.id)}
 
+@router.get("/partners", response_model=List[schemas.PartnerResponse])
+async def find_partners_for_me(
+        response: Response,
+        native_lang_code: Optional[str] = Query(None, description="Partner's native language code"),
+        learning_lang_code: Optional[str] = Query(None, description="Partner's learning language code"),
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        current_user: models.User = Depends(get_current_user),
+        db: Session = Depends(database.get_db)
+):
+    """
+    Подбор собеседников для текущего пользователя. Первыми идут взаимные
+    совпадения (говорит на изучаемом мной языке и учит мой родной), внутри
+    каждой группы — недавно активные. Курсор следующей страницы — в X-Next-Cursor.
+    """
+    language_ids = await _language_ids(native_lang_code, learning_lang_code)
+    if language_ids is None:
+        return []
+    searcher = Searcher(current_user.id, [(a.language_id, a.type) for a in current_user.language_associations])
+    try:
+        page, next_cursor = find_partners(db, *language_ids, limit, cursor, searcher=searcher)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+    reciprocal = {user_id for user_id, is_reciprocal in page if is_reciprocal}
+    users = _users_in_order(db, [user_id for user_id, _ in page])
+    logger.info(f"Returning {len(users)} partners for user {current_user.id}")
+    return [
+        schemas.PartnerResponse.model_validate(user).model_copy(update={"reciprocal": user.id in reciprocal})
+        for user in users
+    ]
+
+
 # --- Профиль пользователя ---
 
+@router.get("/batch", response_model=List[schemas.UserProfileResponse])
+async def get_user_profiles(
+        ids: List[str] = Query(..., description="User ids: repeated or comma-separated"),
+        db: Session = Depends(database.get_db)
+):
+    """
+    Профили нескольких пользователей за один запрос (шапки чатов, списки
+    участников) в порядке ids. Неизвестные id пропускаются.
+    """
+    try:
+        user_ids = list(dict.fromkeys(PyUUID(part) for value in ids for part in value.split(",") if part))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid user ID format")
+    if len(user_ids) > PROFILE_BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {PROFILE_BATCH_MAX_IDS} ids per request")
+
+    profiles = profile_cache.profiles(db, user_ids)
+    return [profiles[user_id] for user_id in user_ids if user_id in profiles]
+
+
 @router.get("/{user_id_str}", response_model=schemas.UserProfileResponse)
 async def get_user_profile(user_id_str: str, db: Session = Depends(database.get_db)):
     try:
@@ -118,28 +207,10 @@ async def get_user_profile(user_id_str: str, db: Session = Depends(database.get_
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid user ID format")
 
-    user = db.query(models.User).options(
-        joinedload(models.User.language_associations).joinedload(models.UserLanguageAssociation.language)
-    ).filter(models.User.id == user_uuid).first()
-
-    if not user:
+    profile = profile_cache.profiles(db, [user_uuid]).get(user_uuid)
+    if not profile:
         raise HTTPException(status_code=404, detail="User not found")
-
-    # Валидируем базовый профиль
-    user_profile = schemas.UserProfileResponse.model_validate(user)
-
-    # Правильно собираем языки через Association Object
-    languages_data = []
-    for assoc in user.language_associations:
-        languages_data.append(schemas.UserLanguageLink(
-            id=assoc.language.id,
-            name=assoc.language.name,
-            code=assoc.language.code,
-            level=assoc.level,
-            type=assoc.type
-        ))
-    user_profile.languages = languages_data
-    return user_profile
+    return profile
 
 
 @router.put("/{user_id_str}", response_model=schemas.UserProfileResponse)
@@ -159,6 +230,7 @@ async def update_user_profile(
 
     db.add(current_user)
     db.commit()
+    _user_changed(current_user.id)
     db.refresh(current_user)
     logger.info(f"User profile for '{current_user.username}' updated.")
 
@@ -174,6 +246,9 @@ async def update_user_languages(
 ):
     if str(current_user.id) != user_id_str:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
+    unknown = [l.language_id for l in languages_update if await language_cache.get_async(l.language_id) is None]
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid language ID: {unknown[0]}")
 
     try:
         current_user.language_associations.clear()
@@ -186,8 +261,10 @@ async def update_user_languages(
                 type=lang_data.type
             )
             current_user.language_associations.append(assoc)
+        sync_user_matches(db, current_user.id, [(l.language_id, l.type) for l in languages_update])
 
         db.commit()
+        _user_changed(current_user.id)
     except Exception as e:
         db.rollback()
         logger.error(f"Could not update languages for user {current_user.id}: {e}", exc_info=True)
@@ -197,42 +274,64 @@ async def update_user_languages(
 
 
 # --- ПОИСК ПОЛЬЗОВАТЕЛЕЙ ---
+async def _language_ids(*codes: Optional[str]) -> Optional[List[Optional[int]]]:
+    """id языков по кодам (None остаётся None); None — если какого-то кода нет."""
+    ids = []
+    for code in codes:
+        language = await language_cache.by_code_async(code) if code else None
+        if code and language is None:
+            return None
+        ids.append(language.id if language else None)
+    return ids
+
+
+def _users_in_order(db: Session, user_ids: List[PyUUID]) -> List[models.User]:
+    users = {user.id: user for user in db.query(models.User).filter(models.User.id.in_(user_ids))} if user_ids else {}
+    return [users[user_id] for user_id in user_ids if user_id in users]
+
+
 @router.get("/", response_model=List[schemas.UserInListResponse])
 async def find_users(
+        response: Response,
         native_lang_code: Optional[str] = Query(None, description="Native language code (e.g., 'en')"),
         learning_lang_code: Optional[str] = Query(None, description="Learning language code (e.g., 'ru')"),
+        limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
         db: Session = Depends(database.get_db)
 ):
-    query = db.query(models.User).options(
-        joinedload(models.User.language_associations).joinedload(models.UserLanguageAssociation.language)
-    )
-
-    if native_lang_code:
-        native_assoc_alias = aliased(models.UserLanguageAssociation)
-        native_lang_alias = aliased(models.Language)
-        query = query.join(native_assoc_alias, models.User.language_associations)
-        query = query.join(native_lang_alias, native_assoc_alias.language)
-        query = query.filter(
-            native_lang_alias.code == native_lang_code,
-            native_assoc_alias.type == 'native'
-        )
-
-    if learning_lang_code:
-        learning_assoc_alias = aliased(models.UserLanguageAssociation)
-        learning_lang_alias = aliased(models.Language)
-        query = query.join(learning_assoc_alias, models.User.language_associations)
-        query = query.join(learning_lang_alias, learning_assoc_alias.language)
-        query = query.filter(
-            learning_lang_alias.code == learning_lang_code,
-            learning_assoc_alias.type == 'learning'
-        )
-
-    users = query.distinct().limit(100).all()
-
-    return users
+    """
+    Пользователи с заданными родным и/или изучаемым языком, недавно
+    активные — первыми. Курсор следующей страницы — в заголовке X-Next-Cursor.
+    """
+    language_ids = await _language_ids(native_lang_code, learning_lang_code)
+    if language_ids is None:
+        return []
+    try:
+        page, next_cursor = find_partners(db, *language_ids, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return _users_in_order(db, [user_id for user_id, _ in page])
 
 # --- Get all languages ---
 @router.get("/languages/all", response_model=List[schemas.LanguageInDB])
-async def get_all_languages(db: Session = Depends(database.get_db)):
-    return db.query(models.Language).order_by(models.Language.name).all()
-
+async def get_all_languages(request: Request, response: Response):
+    """Справочник языков из памяти, с ETag по версии справочника."""
+    snapshot = await language_cache.snapshot_async()
+    if etag_matches(request, snapshot.etag):
+        return not_modified(snapshot.etag)
+    response.headers.update(cache_headers(snapshot.etag))
+    return snapshot.languages
+
+
+@router.post("/languages/refresh", response_model=List[schemas.LanguageInDB])
+async def refresh_languages(response: Response, current_user: models.User = Depends(get_admin_user)):
+    """
+    Перечитывает справочник языков из базы (после ручного изменения таблицы).
+    Полная перезагрузка в обход ограничения на промахи — только для администраторов.
+    """
+    snapshot = await language_cache.refresh_async()
+    logger.info(f"Languages refreshed by user {current_user.id}, version {snapshot.version}")
+    response.headers.update(cache_headers(snapshot.etag))
+    return snapshot.languages
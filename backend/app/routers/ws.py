@@ -1,24 +1,330 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from uuid import UUID as PyUUID
-from datetime import datetime
+from typing import Dict, Optional
 import json
+import os
 
-from .. import database, models, schemas
+from jose import JWTError, jwt
+
+from .. import security
+from ..chat_cache import chat_directory
 from ..fcm_service import send_push_notification
-from .. import database, models
-from ..schemas import MessageResponse
-from ..websocket_manager import ConnectionManager
+from ..database import AsyncSessionLocal
+from ..message_writer import message_writer, new_message_values, fetch_messages_since
+from ..websocket_manager import ConnectionManager, ClientConnection, Frame, encode_frame
+from ..pubsub import create_pubsub
+from ..read_state import ReadReceiptCoalescer, mark_read_statement
 from ..logger import logger # Предполагаем, что у вас есть logger
 
 router = APIRouter(prefix="/ws", tags=["websocket"])
 
-manager = ConnectionManager()
+# Транспорт между узлами выбирается переменной окружения WS_PUBSUB_BACKEND
+manager = ConnectionManager(pubsub=create_pubsub())
+read_receipts = ReadReceiptCoalescer(manager)
 
-@router.websocket("/{chat_id_str}")
-async def websocket_endpoint(
-        websocket: WebSocket, chat_id_str: str, db: Session = Depends(database.get_db)
+SIGNALING_TYPES = ["call_offer", "call_answer", "ice_candidate", "call_end"]
+
+# Сколько секунд после ухода из чата откладываем push: за это время клиент
+# с нестабильной связью обычно успевает переподключиться и получить сообщение сам
+PUSH_PRESENCE_GRACE_SECONDS = float(os.getenv("PUSH_PRESENCE_GRACE_SECONDS", "15"))
+
+# Сколько пропущенных сообщений на чат досылается при переподключении;
+# если пропущено больше, клиент догружает историю через REST
+WS_REPLAY_LIMIT = int(os.getenv("WS_REPLAY_LIMIT", "500"))
+# Код закрытия /ws/{chat_id}, когда пропуск больше WS_REPLAY_LIMIT:
+# клиент догружает историю через REST и переподключается с новым since_seq
+REPLAY_GAP_CLOSE_CODE = 4409
+
+
+async def handle_client_message(
+        connection: ClientConnection,
+        chat_id_str: str,
+        chat_uuid_obj: PyUUID,
+        sender_id: Optional[str],
+        data: dict,
 ):
+    """
+    Обрабатывает одно входящее сообщение клиента в контексте чата chat_id_str.
+    Для каждого сообщения открывается своя короткая асинхронная сессия БД.
+    """
+    user_id = connection.user_id
+    message_type = data.get("type", "text")
+    client_message_id = data.get("client_message_id")
+
+    # 1. Сигнальные сообщения WebRTC пересылаются напрямую другому участнику
+    if message_type in SIGNALING_TYPES:
+        # chat_id нужен мультиплексным клиентам, чтобы понять, к какому чату относится сигнал
+        data["chat_id"] = chat_id_str
+        await manager.broadcast_to_others(chat_id_str, user_id, data)
+        logger.info(f"Broadcasted WebRTC signal '{message_type}' from {user_id} in chat {chat_id_str}")
+        return
+
+    # 2. Обработка обычных текстовых сообщений
+    try:
+        sender_uuid_obj = PyUUID(sender_id)
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error(f"Invalid or missing sender_id: {sender_id}. Error: {e}")
+        connection.send({"error": "Invalid or missing sender_id"})
+        return
+
+    content = data.get("content")
+    if not content:
+        logger.warning(f"Empty content received for chat '{chat_id_str}'.")
+        connection.send({"error": "Content cannot be empty"})
+        return
+
+    reply_to_id_str = data.get("reply_to_message_id")
+    reply_to_uuid_obj = None
+    if reply_to_id_str:
+        try:
+            reply_to_uuid_obj = PyUUID(reply_to_id_str)
+        except (ValueError, TypeError):
+            logger.warning(f"Invalid reply_to_message_id format: {reply_to_id_str}")
+
+    # Время и порядковый номер назначает сервер, а не клиент.
+    # Сообщение пишется пакетом вместе с сообщениями других сокетов;
+    # ответ приходит только после commit пакета
+    try:
+        response_model = await message_writer.submit(new_message_values(
+            chat_id=chat_uuid_obj,
+            sender_id=sender_uuid_obj,
+            content=content,
+            type=message_type,
+            reply_to_message_id=reply_to_uuid_obj,
+        ))
+    except Exception as e:
+        logger.error(f"Could not save message from {user_id} in chat {chat_id_str}: {e}")
+        connection.send({"error": "Could not save message", "client_message_id": client_message_id})
+        return
+    logger.info(f"Message (ID: {response_model.id}) saved to DB for chat (UUID: {chat_uuid_obj})")
+
+    # Добавляем временный ID в модель ответа, если он был
+    if client_message_id:
+        response_model.client_message_id = client_message_id
+
+    # Кодируем один раз — готовый кадр уходит всем участникам без повторной сериализации
+    await manager.broadcast(chat_id_str, response_model.model_dump_json())
+
+    # Участники чата, их FCM токены и имя отправителя берутся из кэша
+    sender_key = str(sender_uuid_obj)
+    members = await chat_directory.chat_members(str(chat_uuid_obj)) or frozenset()
+    profiles = await chat_directory.push_profiles(members | {sender_key})
+
+    # Кто сейчас в чате (на любом узле), уже получил сообщение через сокет.
+    # Недавно ушедшим push откладывается до конца окна ожидания.
+    fcm_tokens = []
+    deferred = [] # [(задержка, user_id, token)]
+    for recipient_id in members - {sender_key}:
+        profile = profiles.get(recipient_id)
+        if profile is None or not profile.fcm_token or manager.is_present(recipient_id, chat_id_str):
+            continue
+        since_seen = manager.seconds_since_seen(recipient_id, chat_id_str)
+        if since_seen is not None and since_seen < PUSH_PRESENCE_GRACE_SECONDS:
+            deferred.append((PUSH_PRESENCE_GRACE_SECONDS - since_seen, recipient_id, profile.fcm_token))
+        else:
+            fcm_tokens.append(profile.fcm_token)
+
+    if fcm_tokens or deferred:
+        sender_profile = profiles.get(sender_key)
+        sender_name = sender_profile.username if sender_profile else "New message"
+
+        # Формируем видимую часть уведомления
+        notification_payload = {
+            "title": sender_name,
+            "body": content, # Текст сообщения
+        }
+
+        # Формируем данные для обработки в приложении.
+        # ВАЖНО: ВСЕ значения должны быть строками!
+        data_payload = {
+            "type": "new_message",
+            "chat_id": str(chat_id_str), # Приводим к строке на всякий случай
+            "sender_name": str(sender_name),
+            "message_id": str(response_model.id), # Добавляем ID сообщения
+            "message_content": str(content) # Добавляем текст сообщения
+        }
+
+        logger.debug(f"Preparing to send push notification. Data payload: {data_payload}")
+        if fcm_tokens:
+            await send_push_notification(fcm_tokens, notification_payload, data_payload)
+        for delay, recipient_id, token in deferred:
+            await send_push_notification(
+                [token], notification_payload, data_payload,
+                delay=delay,
+                condition=lambda uid=recipient_id: not manager.is_present(uid, chat_id_str),
+            )
+
+
+async def mark_chat_read(connection: ClientConnection, chat_id_str: str, chat_uuid_obj: PyUUID, seq=None):
+    """Сдвигает водяной знак прочтения пользователя соединения и рассылает read_receipt."""
+    try:
+        user_uuid = PyUUID(connection.user_id)
+        up_to_seq = int(seq) if seq is not None else None
+    except (ValueError, TypeError):
+        connection.send({"error": "Invalid mark_read frame", "chat_id": chat_id_str})
+        return
+    async with AsyncSessionLocal() as db:
+        last_read_seq = await db.scalar(mark_read_statement(chat_uuid_obj, user_uuid, up_to_seq))
+        await db.commit()
+    if last_read_seq is not None:
+        read_receipts.submit(str(chat_uuid_obj), connection.user_id, last_read_seq)
+
+
+def get_user_id_from_token(token: Optional[str]) -> Optional[str]:
+    """Достаёт user_id из JWT, выданного /api/users/token. None — если токен недействителен."""
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
+        return str(PyUUID(payload.get("user_id")))
+    except (JWTError, ValueError, TypeError):
+        return None
+
+
+async def user_chat_ids(user_id: str, chat_uuids) -> set:
+    """Возвращает те из chat_uuids, в которых пользователь состоит."""
+    members = await chat_directory.chats_members([str(chat_id) for chat_id in chat_uuids])
+    return {chat_id for chat_id, users in members.items() if user_id in users}
+
+
+def _parse_since_seq(raw) -> Optional[int]:
+    try:
+        value = int(raw)
+    except (TypeError, ValueError):
+        return None
+    return value if value >= 0 else None
+
+
+def _frame_message_id(frame: Frame) -> Optional[str]:
+    try:
+        data = json.loads(frame)
+    except ValueError:
+        return None
+    return data.get("id") if isinstance(data, dict) else None
+
+
+async def replay_missed(connection: ClientConnection, since: Dict[str, int], ack: Optional[dict] = None) -> list:
+    """
+    Досылает сообщения с seq > since[chat_id] раньше живого трафика. Соединение
+    должно быть придержано (connection.hold()) ещё до подписки на чаты: живые
+    сообщения, пришедшие за время загрузки, уходят следом, без дублей.
+    ack, если задан, отправляется первым. Возвращает чаты, где пропущено больше WS_REPLAY_LIMIT.
+    """
+    frames = []
+    replayed_ids = set()
+    truncated = []
+    try:
+        async with AsyncSessionLocal() as db:
+            for chat_id, since_seq in since.items():
+                missed = await fetch_messages_since(db, PyUUID(chat_id), since_seq, WS_REPLAY_LIMIT + 1)
+                if len(missed) > WS_REPLAY_LIMIT:
+                    truncated.append(chat_id)
+                    missed = missed[:WS_REPLAY_LIMIT]
+                for message in missed:
+                    frames.append(message.model_dump_json())
+                    replayed_ids.add(str(message.id))
+    except Exception as e:
+        logger.error(f"Could not replay missed messages for {connection.user_id}: {e}", exc_info=True)
+    finally:
+        first = frames
+        if ack is not None:
+            if truncated:
+                ack["replay_truncated"] = truncated
+            first = [encode_frame(ack)] + frames
+        connection.resume(first, skip=lambda frame: _frame_message_id(frame) in replayed_ids)
+    logger.info(f"Replayed {len(frames)} missed messages to {connection.user_id} in {len(since)} chats")
+    return truncated
+
+
+def _parse_chat_ids(data: dict) -> list:
+    raw_ids = data.get("chat_ids") or ([data["chat_id"]] if data.get("chat_id") else [])
+    chat_uuids = []
+    for raw in raw_ids:
+        try:
+            chat_uuids.append(PyUUID(str(raw)))
+        except ValueError:
+            logger.warning(f"Invalid chat_id in subscription frame: {raw}")
+    return chat_uuids
+
+
+@router.websocket("/user")
+async def user_websocket_endpoint(websocket: WebSocket):
+    """
+    Одно соединение на пользователя для всех его чатов.
+
+    Подключение: /ws/user?token=<JWT>. Управляющие кадры клиента:
+      {"action": "subscribe", "chat_ids": [...]}   (или "chat_id": "...")
+      {"action": "unsubscribe", "chat_ids": [...]}
+      {"action": "mark_read", "chat_id": "...", "seq": N}   (seq необязателен)
+    В subscribe можно передать "since_seq": N (для всех чатов кадра) или
+    {"<chat_id>": N, ...} — тогда сначала придут сообщения с seq > N.
+    Сообщения и сигналы звонков отправляются как в /ws/{chat_id}, но с полем
+    "chat_id"; чат должен быть в подписках соединения.
+    """
+    user_id = get_user_id_from_token(websocket.query_params.get("token"))
+    if not user_id:
+        logger.error("Multiplexed WebSocket rejected: missing or invalid token.")
+        await websocket.close(code=1008)
+        return
+
+    connection = await manager.connect_user(user_id, websocket)
+
+    try:
+        while True:
+            data = json.loads(await websocket.receive_text())
+            action = data.get("action")
+
+            if action == "subscribe":
+                requested = _parse_chat_ids(data)
+                allowed = await user_chat_ids(user_id, requested) if requested else set()
+                raw_since = data.get("since_seq")
+                since = {}
+                for chat_id in allowed:
+                    value = raw_since.get(chat_id) if isinstance(raw_since, dict) else raw_since
+                    if _parse_since_seq(value) is not None:
+                        since[chat_id] = _parse_since_seq(value)
+                if since:
+                    connection.hold()
+                for chat_id in allowed:
+                    manager.subscribe(connection, chat_id)
+                denied = [str(c) for c in requested if str(c) not in allowed]
+                ack = {"type": "subscribed", "chat_ids": sorted(allowed), "denied": denied}
+                if since:
+                    await replay_missed(connection, since, ack)
+                else:
+                    connection.send(ack)
+                logger.info(f"User {user_id} subscribed to {len(allowed)} chats ({len(denied)} denied)")
+                continue
+
+            if action == "unsubscribe":
+                unsubscribed = [str(c) for c in _parse_chat_ids(data)]
+                for chat_id in unsubscribed:
+                    manager.unsubscribe(connection, chat_id)
+                connection.send({"type": "unsubscribed", "chat_ids": unsubscribed})
+                continue
+
+            chat_id_str = str(data.get("chat_id", ""))
+            if chat_id_str not in connection.chats:
+                connection.send({"error": "Not subscribed to chat", "chat_id": chat_id_str})
+                continue
+
+            # Отметка о прочтении меняет состояние пользователя — только на сокете с токеном
+            if action == "mark_read":
+                await mark_chat_read(connection, chat_id_str, PyUUID(chat_id_str), data.get("seq"))
+                continue
+
+            await handle_client_message(connection, chat_id_str, PyUUID(chat_id_str), user_id, data)
+
+    except WebSocketDisconnect:
+        logger.info(f"User {user_id} closed multiplexed connection")
+    except Exception as e:
+        logger.error(f"Unexpected error in multiplexed WebSocket for user {user_id}: {e}", exc_info=True)
+    finally:
+        manager.disconnect(connection)
+
+
+@router.websocket("/{chat_id_str}")
+async def websocket_endpoint(websocket: WebSocket, chat_id_str: str):
     logger.info(f"WebSocket connection attempt for chat_id_str: {chat_id_str}")
 
     try:
@@ -28,8 +334,8 @@ async def websocket_endpoint(
         await websocket.close(code=1008)
         return
 
-    chat_db_entry = db.query(models.Chat).filter(models.Chat.id == chat_uuid_obj).first()
-    if not chat_db_entry:
+    # Существование чата проверяем по кэшу участников
+    if await chat_directory.chat_members(str(chat_uuid_obj)) is None:
         logger.warning(f"Chat with UUID '{chat_uuid_obj}' not found in database. Closing WebSocket.")
         await websocket.close(code=1003)
         return
@@ -41,8 +347,21 @@ async def websocket_endpoint(
         await websocket.close(code=1008)
         return
 
-    logger.info(f"Chat '{chat_db_entry.title}' (UUID: {chat_uuid_obj}) found. Accepting WebSocket connection for user {user_id}.")
-    await manager.connect(chat_id_str, user_id, websocket)
+    logger.info(f"Chat (UUID: {chat_uuid_obj}) found. Accepting WebSocket connection for user {user_id}.")
+    connection = await manager.connect(chat_id_str, user_id, websocket)
+
+    # ?since_seq=N — переподключение: сначала пропущенное, потом живые сообщения.
+    # Между подпиской в connect() и hold() нет await, поэтому живые кадры не проскочат.
+    since_seq = _parse_since_seq(websocket.query_params.get("since_seq"))
+    if since_seq is not None:
+        connection.hold()
+        truncated = await replay_missed(connection, {str(chat_uuid_obj): since_seq})
+        if truncated:
+            # Между resume() и disconnect() нет await: неполная догрузка не уходит клиенту
+            logger.info(f"Replay gap for user {user_id} in chat {chat_id_str} exceeds {WS_REPLAY_LIMIT}, closing")
+            manager.disconnect(connection)
+            await websocket.close(code=REPLAY_GAP_CLOSE_CODE)
+            return
 
     try:
         while True:
@@ -50,104 +369,17 @@ async def websocket_endpoint(
             data = json.loads(data_str)
             logger.debug(f"Received data from user '{user_id}' in chat '{chat_id_str}': {data}")
 
-            message_type = data.get("type", "text")
-            sender_id = data.get("sender_id")
-            client_message_id = data.get("client_message_id")
-
-            # 1. Сигнальные сообщения WebRTC пересылаются напрямую другому участнику
-            if message_type in ["call_offer", "call_answer", "ice_candidate", "call_end"]:
-                await manager.broadcast_to_others(chat_id_str, user_id, data)
-                logger.info(f"Broadcasted WebRTC signal '{message_type}' from {user_id} in chat {chat_id_str}")
-                continue # Переходим к следующему сообщению
-
-            # 2. Обработка обычных текстовых сообщений
-            try:
-                sender_uuid_obj = PyUUID(sender_id)
-            except (ValueError, KeyError, TypeError) as e:
-                logger.error(f"Invalid or missing sender_id: {sender_id}. Error: {e}")
-                await websocket.send_json({"error": "Invalid or missing sender_id"})
+            # user_id здесь из query-параметра без проверки: двигать чужой водяной знак нельзя
+            if data.get("action") == "mark_read":
+                connection.send({"error": "mark_read is only supported on /ws/user", "chat_id": chat_id_str})
                 continue
 
-            content = data.get("content")
-            if not content:
-                logger.warning(f"Empty content received for chat '{chat_id_str}'.")
-                await websocket.send_json({"error": "Content cannot be empty"})
-                continue
-
-            reply_to_id_str = data.get("reply_to_message_id")
-            reply_to_uuid_obj = None
-            if reply_to_id_str:
-                try:
-                    reply_to_uuid_obj = PyUUID(reply_to_id_str)
-                except (ValueError, TypeError):
-                    logger.warning(f"Invalid reply_to_message_id format: {reply_to_id_str}")
-
-            db_message = models.Message(
-                chat_id=chat_uuid_obj,
-                sender_id=sender_uuid_obj,
-                content=content,
-                type=message_type,
-                timestamp=data.get("timestamp", datetime.now()),
-                reply_to_message_id=reply_to_uuid_obj
-            )
-            db.add(db_message)
-            db.commit()
-            db.refresh(db_message)
-            logger.info(f"Message (ID: {db_message.id}) saved to DB for chat (UUID: {chat_uuid_obj})")
-
-            db.refresh(db_message, ['reply_to_message'])
-
-            # Преобразуем сообщение из БД в Pydantic-схему
-            response_model = schemas.MessageResponse.model_validate(db_message)
-
-            # Добавляем временный ID в модель ответа, если он был
-            if client_message_id:
-                response_model.client_message_id = client_message_id
-
-            message_to_broadcast = json.loads(response_model.model_dump_json())
-            await manager.broadcast(chat_id_str, message_to_broadcast)
-
-            # Получаем всех участников чата, кроме отправителя
-            participants_to_notify = db.query(models.User).join(
-                models.chat_participants
-            ).filter(
-                models.chat_participants.c.chat_id == chat_uuid_obj,
-                models.User.id != sender_uuid_obj
-            ).all()
-
-            # Собираем их FCM токены
-            fcm_tokens = [p.fcm_token for p in participants_to_notify if p.fcm_token]
-
-            if fcm_tokens:
-                # Получаем имя отправителя
-                sender_profile = db.query(models.User).filter(models.User.id == sender_uuid_obj).first()
-                sender_name = sender_profile.username if sender_profile else "New message"
-
-                # Формируем видимую часть уведомления
-                notification_payload = {
-                    "title": sender_name,
-                    "body": content, # Текст сообщения
-                }
-
-                # Формируем данные для обработки в приложении.
-                # ВАЖНО: ВСЕ значения должны быть строками!
-                data_payload = {
-                    "type": "new_message",
-                    "chat_id": str(chat_id_str), # Приводим к строке на всякий случай
-                    "sender_name": str(sender_name),
-                    "message_id": str(db_message.id), # Добавляем ID сообщения
-                    "message_content": str(content) # Добавляем текст сообщения
-                }
-
-                logger.debug(f"Preparing to send push notification. Data payload: {data_payload}")
-                await send_push_notification(fcm_tokens, notification_payload, data_payload)
-
+            await handle_client_message(connection, chat_id_str, chat_uuid_obj, data.get("sender_id"), data)
 
     except WebSocketDisconnect:
         logger.info(f"User {user_id} disconnected from chat: {chat_id_str}")
     except Exception as e:
         logger.error(f"Unexpected error in WebSocket for user {user_id} in chat {chat_id_str}: {e}", exc_info=True)
     finally:
-        manager.disconnect(chat_id_str, user_id)
+        manager.disconnect(connection)
         logger.info(f"WebSocket connection for user {user_id} in chat {chat_id_str} fully closed.")
-
@@ -65,6 +65,10 @@ class ParticipantResponse(BaseModel):
 class UserInListResponse(UserProfileResponse):
     pass
 
+class PartnerResponse(UserInListResponse):
+    # Взаимное совпадение: говорит на изучаемом мной языке и учит мой родной
+    reciprocal: bool = False
+
 # --- Tokens for authentication ---
 class Token(BaseModel):
     access_token: str
@@ -115,6 +119,7 @@ class MessageResponse(BaseModel):
     content: str
     type: str
     timestamp: datetime
+    seq: Optional[int] = None
     reply_to_message: Optional[RepliedMessageInfo] = None
     client_message_id: Optional[str] = None
     model_config = ConfigDict(from_attributes=True)
@@ -125,3 +130,41 @@ class MessageResponse(BaseModel):
         if isinstance(v, models.Message):
             return RepliedMessageInfo.model_validate(v)
         return v
+
+
+class MessageIngestItem(BaseModel):
+    """Строка NDJSON массовой загрузки сообщений."""
+    chat_id: PyUUID
+    sender_id: PyUUID
+    content: str = Field(..., min_length=1)
+    type: str = "text"
+    timestamp: Optional[datetime] = None
+    reply_to_message_id: Optional[PyUUID] = None
+
+    @field_validator('timestamp')
+    @classmethod
+    def to_naive_local(cls, v):
+        # В базе время хранится без пояса, как его выдаёт datetime.now()
+        if v is not None and v.tzinfo is not None:
+            return v.astimezone().replace(tzinfo=None)
+        return v
+
+class IngestError(BaseModel):
+    line: int
+    detail: str
+
+class IngestReport(BaseModel):
+    accepted: int
+    rejected: int
+    errors: List[IngestError]
+
+class WordTiming(BaseModel):
+    word: str
+    start: float
+    end: float
+
+class SearchHitResponse(BaseModel):
+    message: MessageResponse
+    rank: float
+    # Совпавшие слова расшифровки медиа-сообщения с их временем в записи
+    words: List[WordTiming] = []
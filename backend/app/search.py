@@ -0,0 +1,138 @@
+# backend/app/search.py
+"""
+Полнотекстовый поиск по сообщениям.
+
+Индексируется messages.search_text: текст обычных сообщений и
+transcription.full_text из JSON медиа-сообщений. Индекс — GIN по tsvector
+в Postgres и внешняя таблица FTS5 в SQLite (см. models.SEARCH_INDEX_DDL).
+Поиск идёт только по чатам пользователя; совпадение — все слова запроса,
+выдача упорядочена по релевантности и листается курсором.
+"""
+import json
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+from uuid import UUID as PyUUID
+
+from sqlalchemy import Float, desc, func, literal_column, select, table, column, tuple_
+from sqlalchemy.orm import Session, selectinload
+
+from . import models
+from .pagination import decode_cursor, encode_cursor
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Столбцы внешней таблицы FTS5 (rowid совпадает с rowid строки messages)
+_fts = table(models.SEARCH_INDEX_TABLE, column("rowid"), column("search_text"))
+
+
+def message_search_text(content: Optional[str], type: str) -> Optional[str]:
+    """Текст сообщения для индекса; у медиа — расшифровка, если она есть."""
+    if type == "text":
+        return content
+    try:
+        transcription = json.loads(content or "").get("transcription") or {}
+    except (ValueError, AttributeError):
+        return None
+    return transcription.get("full_text") or None
+
+
+def search_terms(query: str) -> List[str]:
+    return [word.lower() for word in _WORD_RE.findall(query)]
+
+
+def _hits(db: Session, query: str, terms: List[str], user_id: PyUUID, chat_id: Optional[PyUUID]):
+    """
+    Подзапрос (message_id, rank) по индексу; rank — чем больше, тем релевантнее.
+    Ранжируются только сообщения из чатов пользователя, а не вся таблица.
+    """
+    participants = models.chat_participants.c
+    in_user_chats = models.Message.chat_id.in_(
+        select(participants.chat_id).where(participants.user_id == user_id)
+    )
+    if chat_id is not None:
+        in_user_chats = in_user_chats & (models.Message.chat_id == chat_id)
+
+    if db.get_bind().dialect.name == "postgresql":
+        config = literal_column(f"'{models.SEARCH_TEXT_CONFIG}'::regconfig")
+        # Выражение совпадает с выражением индекса ix_messages_search_text
+        vector = func.to_tsvector(config, models.Message.search_text)
+        ts_query = func.plainto_tsquery(config, query)
+        return (
+            select(models.Message.id.label("message_id"), func.ts_rank(vector, ts_query).label("rank"))
+            .where(vector.op("@@")(ts_query), in_user_chats)
+            .subquery()
+        )
+
+    # FTS5: каждое слово в кавычках, чтобы ввод пользователя не разбирался как синтаксис запроса
+    match = " ".join(f'"{term}"' for term in terms)
+    return (
+        select(models.Message.id.label("message_id"), (-func.bm25(literal_column(_fts.name))).label("rank"))
+        .select_from(_fts)
+        .join(models.Message.__table__, literal_column("messages.rowid") == _fts.c.rowid)
+        .where(literal_column(_fts.name).op("MATCH")(match), in_user_chats)
+        .subquery()
+    )
+
+
+def search_messages(
+        db: Session,
+        user_id: PyUUID,
+        query: str,
+        limit: int,
+        chat_id: Optional[PyUUID] = None,
+        cursor: Optional[str] = None,
+) -> Tuple[List[Tuple[models.Message, float]], Optional[str]]:
+    """
+    Страница совпадений по чатам пользователя: [(сообщение, rank)] и курсор
+    следующей страницы. Пустой запрос или повреждённый курсор — ValueError.
+    """
+    terms = search_terms(query)
+    if not terms:
+        raise ValueError("Empty search query")
+
+    hits = _hits(db, query, terms, user_id, chat_id)
+    stmt = (
+        select(models.Message, hits.c.rank)
+        .join(hits, hits.c.message_id == models.Message.id)
+        .options(selectinload(models.Message.reply_to_message))
+        .order_by(desc(hits.c.rank), desc(models.Message.timestamp), desc(models.Message.id))
+        .limit(limit + 1)
+    )
+    if cursor:
+        rank, timestamp, message_id = decode_cursor(cursor, float, datetime, PyUUID)
+        stmt = stmt.where(
+            tuple_(hits.c.rank, models.Message.timestamp, models.Message.id)
+            < tuple_(rank, timestamp, message_id,
+                     types=[Float(), models.Message.timestamp.type, models.Message.id.type])
+        )
+
+    rows = [(message, rank) for message, rank in db.execute(stmt)]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last, rank = rows[-1]
+        next_cursor = encode_cursor(rank, last.timestamp, last.id)
+    return rows, next_cursor
+
+
+def matched_words(message: models.Message, query: str) -> List[dict]:
+    """Слова расшифровки медиа-сообщения, совпавшие с запросом, с их временем."""
+    if message.type == "text":
+        return []
+    try:
+        words = (json.loads(message.content or "").get("transcription") or {}).get("words") or []
+    except (ValueError, AttributeError):
+        return []
+    terms = set(search_terms(query))
+    matched = []
+    for word in words:
+        # Слово без текста или времени пропускаем, а не роняем весь ответ
+        if not isinstance(word, dict):
+            continue
+        text, start, end = word.get("word"), word.get("start"), word.get("end")
+        if not isinstance(text, str) or start is None or end is None:
+            continue
+        if terms.intersection(search_terms(text)):
+            matched.append({"word": text.strip(), "start": start, "end": end})
+    return matched
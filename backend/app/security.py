@@ -1,3 +1,7 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 from passlib.context import CryptContext
@@ -7,6 +11,13 @@ from jose import jwt
 SECRET_KEY = "a-very-secret-key-that-should-be-in-env-vars" # ЗАМЕНИТЕ НА СЕКРЕТ ИЗ ПЕРЕМЕННЫХ ОКРУЖЕНИЯ
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Пользователи с правами администратора (через запятую): служебные операции
+ADMIN_USERNAMES = frozenset(name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip())
+
+# Пул для bcrypt: один вызов — 100-300 мс CPU, в event loop он остановил бы все сокеты
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Сколько хэширований может выполняться и ждать одновременно; сверх — отказ
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 8)))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -25,3 +36,51 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+
+class PasswordHasherBusy(Exception):
+    """Очередь хэширования паролей заполнена, запрос стоит повторить позже."""
+
+
+class PasswordHasher:
+    """
+    Ограниченный пул потоков для bcrypt (библиотека отпускает GIL на время
+    хэширования). Если выполняется и ждёт уже max_pending вызовов, новый сразу
+    получает PasswordHasherBusy: при волне входов после сбоя лишние запросы
+    отклоняются, а не копятся, и realtime-трафик не страдает.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        # Слот освобождается в потоке пула, когда bcrypt действительно закончил
+        self._lock = threading.Lock()
+
+    def _release(self, _future):
+        with self._lock:
+            self.pending -= 1
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordHasherBusy()
+            self.pending += 1
+        # Отмена запроса (клиент отключился) не останавливает уже начатый bcrypt,
+        # поэтому слот держится до завершения задачи в пуле, а не корутины
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+
+password_hasher = PasswordHasher()
+
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.run(get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(verify_password, plain_password, hashed_password)
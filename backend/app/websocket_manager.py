@@ -1,49 +1,382 @@
-from typing import Dict, List, Any
+import asyncio
+import base64
+import json
+import os
+import uuid
+from typing import Dict, Any, Optional, Callable, Iterable, List, Union, Set
 from fastapi import WebSocket
-from starlette.websockets import WebSocketState
+from pydantic import BaseModel
 from .logger import logger
+from .pubsub import PubSubBackend, InProcessPubSub
+from .presence import PresenceTracker, encode_keys, decode_keys
+
+# Максимальное число кадров, ожидающих отправки одному клиенту.
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# Сколько секунд даём клиенту на приём одного кадра, прежде чем считать его зависшим.
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+# Сколько ждём корректного закрытия сокета при вытеснении клиента.
+WS_CLOSE_TIMEOUT = float(os.getenv("WS_CLOSE_TIMEOUT", "2"))
+
+# RFC 6455: 1013 "Try Again Later" — клиент может переподключиться.
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# Готовый к отправке кадр: str уходит текстовым кадром, bytes — бинарным.
+Frame = Union[str, bytes]
+
+
+def encode_frame(message: Any) -> Frame:
+    """
+    Сериализует сообщение один раз перед рассылкой. Уже закодированные
+    str/bytes возвращаются как есть, Pydantic-модели — через model_dump_json().
+    """
+    if isinstance(message, (str, bytes)):
+        return message
+    if isinstance(message, BaseModel):
+        return message.model_dump_json()
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+# Тип адресата в конверте между узлами
+TARGET_CHAT = "c"
+TARGET_USER = "u"
+TARGET_PRESENCE = "p"
+# События чата (не сообщения) — только мультиплексным соединениям
+TARGET_CHAT_EVENT = "e"
+
+
+def pack_envelope(node_id: str, target_kind: str, target_id: str, exclude_user_id: Optional[str], frame: Frame) -> str:
+    """Упаковывает кадр для передачи другим узлам: заголовок построчно, затем сам кадр."""
+    if isinstance(frame, bytes):
+        body = "b" + base64.b64encode(frame).decode("ascii")
+    else:
+        body = "t" + frame
+    return f"{node_id}\n{target_kind}\n{target_id}\n{exclude_user_id or ''}\n{body}"
+
+
+def unpack_envelope(payload: str):
+    node_id, target_kind, target_id, exclude_user_id, body = payload.split("\n", 4)
+    frame: Frame = base64.b64decode(body[1:]) if body[0] == "b" else body[1:]
+    return node_id, target_kind, target_id, exclude_user_id or None, frame
+
+
+class ClientConnection:
+    """
+    Одно WebSocket-соединение с собственной ограниченной очередью исходящих
+    сообщений и задачей-писателем. Рассылка только кладёт сообщение в очередь,
+    поэтому медленный клиент не задерживает остальных участников чата.
+    """
+
+    def __init__(
+            self,
+            websocket: WebSocket,
+            user_id: str,
+            max_queue_size: int = WS_SEND_QUEUE_SIZE,
+            send_timeout: float = WS_SEND_TIMEOUT,
+            on_evict: Optional[Callable[["ClientConnection"], None]] = None,
+            multiplexed: bool = False,
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        # Мультиплексное соединение пользователя получает события всех чатов,
+        # на которые подписано; старое соединение /ws/{chat_id} — только одного чата.
+        self.multiplexed = multiplexed
+        self.chats: Set[str] = set()
+        self.send_timeout = send_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.closed = False
+        self._on_evict = on_evict
+        self._writer_task: Optional[asyncio.Task] = None
+        # Кадры, придержанные на время догрузки пропущенных сообщений
+        self._held: Optional[List[Frame]] = None
+
+    def start(self):
+        self._writer_task = asyncio.create_task(self._writer())
+
+    def enqueue(self, frame: Frame) -> bool:
+        """Ставит готовый кадр в очередь без ожидания. Переполнение очереди вытесняет клиента."""
+        if self.closed:
+            return False
+        if self._held is not None:
+            if len(self._held) >= self.queue.maxsize:
+                self.evict(f"held frames overflow ({len(self._held)} pending)")
+                return False
+            self._held.append(frame)
+            return True
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            self.evict(f"send queue overflow ({self.queue.maxsize} pending)")
+            return False
+
+    def hold(self):
+        """Придерживает новые кадры, пока соединению догружаются пропущенные сообщения."""
+        if self._held is None:
+            self._held = []
+
+    def resume(self, first: Iterable[Frame] = (), skip: Optional[Callable[[Frame], bool]] = None):
+        """
+        Отправляет кадры first, затем придержанные с момента hold() — кроме тех,
+        для которых skip() истинно (например, уже попавших в first).
+        """
+        held, self._held = self._held or [], None
+        for frame in first:
+            self.enqueue(frame)
+        for frame in held:
+            if skip is None or not skip(frame):
+                self.enqueue(frame)
+
+    def evict(self, reason: str):
+        """Отключает клиента, который не успевает принимать сообщения или чей сокет сломан."""
+        if self.closed:
+            return
+        logger.warning(f"Evicting WebSocket client {self.user_id}: {reason}")
+        self.closed = True
+        if self._writer_task and self._writer_task is not asyncio.current_task():
+            self._writer_task.cancel()
+        if self._on_evict:
+            self._on_evict(self)
+        asyncio.create_task(self._close(SLOW_CONSUMER_CLOSE_CODE))
+
+    def stop(self):
+        """Останавливает писателя при штатном отключении клиента."""
+        self.closed = True
+        if self._writer_task and not self._writer_task.done():
+            self._writer_task.cancel()
+
+    async def _close(self, code: int):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), timeout=WS_CLOSE_TIMEOUT)
+        except Exception as e:
+            logger.debug(f"Error while closing WebSocket of {self.user_id}: {e}")
+
+    def send(self, message: Any) -> bool:
+        """Отправляет сообщение только этому клиенту (например, ошибку валидации)."""
+        return self.enqueue(encode_frame(message))
+
+    async def _send_frame(self, frame: Frame):
+        if isinstance(frame, bytes):
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+
+    async def _writer(self):
+        while not self.closed:
+            frame = await self.queue.get()
+            try:
+                await asyncio.wait_for(self._send_frame(frame), timeout=self.send_timeout)
+            except asyncio.TimeoutError:
+                self.evict(f"send timed out after {self.send_timeout}s")
+                return
+            except Exception as e:
+                # Сломанный сокет убираем из реестра так же, как зависший
+                self.evict(f"send failed: {e}")
+                return
+
 
 class ConnectionManager:
-    def __init__(self):
-        # Структура: { "chat_id": { "user_id": WebSocket } }
-        self.active_connections: Dict[str, Dict[str, WebSocket]] = {}
+    """
+    Хранит локальные сокеты этого узла. Рассылка доставляется локальным
+    клиентам напрямую и публикуется через транспорт pubsub остальным узлам,
+    каждый из которых доставляет её уже своим клиентам.
+
+    У одного пользователя может быть несколько соединений (несколько устройств),
+    а одно соединение может быть подписано на несколько чатов.
+    """
 
-    async def connect(self, chat_id: str, user_id: str, websocket: WebSocket):
+    def __init__(
+            self,
+            max_queue_size: int = WS_SEND_QUEUE_SIZE,
+            send_timeout: float = WS_SEND_TIMEOUT,
+            pubsub: Optional[PubSubBackend] = None,
+    ):
+        # Структура: { "user_id": {ClientConnection, ...} }
+        self.user_connections: Dict[str, Set[ClientConnection]] = {}
+        # Структура: { "chat_id": {ClientConnection, ...} }
+        self.chat_subscribers: Dict[str, Set[ClientConnection]] = {}
+        self.max_queue_size = max_queue_size
+        self.send_timeout = send_timeout
+        self.pubsub = pubsub or InProcessPubSub()
+        self.node_id = uuid.uuid4().hex
+        self.presence = PresenceTracker()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.pubsub.start(self._on_pubsub_message)
+        if self.pubsub.distributed:
+            self._heartbeat_task = asyncio.create_task(self._presence_heartbeat())
+        logger.info(f"ConnectionManager node {self.node_id} started with {type(self.pubsub).__name__}")
+
+    async def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            # Пустой снимок: остальные узлы сразу узнают, что наши клиенты ушли
+            self._publish_presence({"snapshot": []})
+        await self.pubsub.stop()
+
+    # --- Соединения и подписки ---
+
+    async def connect(self, chat_id: str, user_id: str, websocket: WebSocket) -> ClientConnection:
+        """Соединение старого формата /ws/{chat_id}: сразу подписано на один чат."""
         logger.info(f"Got connection request from {chat_id}")
-        await websocket.accept()
-        if chat_id not in self.active_connections:
-            self.active_connections[chat_id] = {}
-        self.active_connections[chat_id][user_id] = websocket
+        connection = await self._accept(user_id, websocket, multiplexed=False)
+        self.subscribe(connection, chat_id)
         logger.info(f"User {user_id} connected to chat {chat_id}")
+        return connection
+
+    async def connect_user(self, user_id: str, websocket: WebSocket) -> ClientConnection:
+        """Мультиплексное соединение пользователя; чаты добавляются через subscribe()."""
+        connection = await self._accept(user_id, websocket, multiplexed=True)
+        logger.info(f"User {user_id} opened a multiplexed connection "
+                    f"({len(self.user_connections[user_id])} active for this user)")
+        return connection
+
+    async def _accept(self, user_id: str, websocket: WebSocket, multiplexed: bool) -> ClientConnection:
+        await websocket.accept()
+        connection = ClientConnection(
+            websocket,
+            user_id,
+            max_queue_size=self.max_queue_size,
+            send_timeout=self.send_timeout,
+            on_evict=self._remove,
+            multiplexed=multiplexed,
+        )
+        connection.start()
+        self.user_connections.setdefault(user_id, set()).add(connection)
+        return connection
+
+    def subscribe(self, connection: ClientConnection, chat_id: str):
+        if connection.closed:
+            return
+        was_present = self._is_present_locally(connection.user_id, chat_id)
+        connection.chats.add(chat_id)
+        self.chat_subscribers.setdefault(chat_id, set()).add(connection)
+        if not was_present:
+            self._publish_presence({"join": encode_keys([(connection.user_id, chat_id)])})
+
+    def unsubscribe(self, connection: ClientConnection, chat_id: str):
+        if chat_id not in connection.chats:
+            return
+        connection.chats.discard(chat_id)
+        subscribers = self.chat_subscribers.get(chat_id)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.chat_subscribers[chat_id]
+        if not self._is_present_locally(connection.user_id, chat_id):
+            self.presence.mark_left((connection.user_id, chat_id))
+            self._publish_presence({"leave": encode_keys([(connection.user_id, chat_id)])})
+
+    def disconnect(self, connection: ClientConnection):
+        connection.stop()
+        self._remove(connection)
+        logger.info(f"User {connection.user_id} disconnected ({len(connection.chats)} chat subscriptions dropped)")
+
+    def _remove(self, connection: ClientConnection):
+        for chat_id in list(connection.chats):
+            self.unsubscribe(connection, chat_id)
+        user_set = self.user_connections.get(connection.user_id)
+        if user_set is not None:
+            user_set.discard(connection)
+            if not user_set:
+                del self.user_connections[connection.user_id]
+
+    def chat_connections(self, chat_id: str) -> Set[ClientConnection]:
+        return self.chat_subscribers.get(chat_id, set())
 
-    def disconnect(self, chat_id: str, user_id: str):
-        logger.info(f"Got disconnect request from {chat_id}")
-        if chat_id in self.active_connections and user_id in self.active_connections[chat_id]:
-            del self.active_connections[chat_id][user_id]
-            if not self.active_connections[chat_id]:
-                del self.active_connections[chat_id]
-            logger.info(f"User {user_id} disconnected from chat {chat_id}")
+    # --- Присутствие ---
+
+    def _is_present_locally(self, user_id: str, chat_id: str) -> bool:
+        return any(chat_id in c.chats for c in self.user_connections.get(user_id, ()))
+
+    def is_present(self, user_id: str, chat_id: str) -> bool:
+        """Получает ли пользователь сообщения чата вживую — на этом или любом другом узле."""
+        return self._is_present_locally(user_id, chat_id) or self.presence.is_present_remotely((user_id, chat_id))
+
+    def seconds_since_seen(self, user_id: str, chat_id: str) -> Optional[float]:
+        """Сколько секунд назад пользователь перестал получать сообщения чата (None — давно или никогда)."""
+        return self.presence.seconds_since_seen((user_id, chat_id))
+
+    def _local_presence_keys(self):
+        return {(c.user_id, chat_id) for conns in self.user_connections.values() for c in conns for chat_id in c.chats}
+
+    def _publish_presence(self, event: dict):
+        if self.pubsub.distributed:
+            body = json.dumps(event, separators=(",", ":"))
+            self.pubsub.publish(pack_envelope(self.node_id, TARGET_PRESENCE, "", None, body))
+
+    async def _presence_heartbeat(self):
+        while True:
+            self._publish_presence({"snapshot": encode_keys(self._local_presence_keys())})
+            await asyncio.sleep(self.presence.heartbeat_seconds)
+
+    def _on_presence_event(self, node_id: str, event: dict):
+        if "snapshot" in event:
+            self.presence.apply_snapshot(node_id, decode_keys(event["snapshot"]))
+        else:
+            self.presence.apply_delta(node_id, decode_keys(event.get("join", [])), decode_keys(event.get("leave", [])))
+
+    # --- Доставка ---
+
+    def _on_pubsub_message(self, payload: str):
+        try:
+            node_id, target_kind, target_id, exclude_user_id, frame = unpack_envelope(payload)
+        except (ValueError, IndexError) as e:
+            logger.error(f"Malformed pub/sub envelope: {e}")
+            return
+        if node_id == self.node_id:
+            return # Своим клиентам уже доставили напрямую
+        if target_kind == TARGET_PRESENCE:
+            self._on_presence_event(node_id, json.loads(frame))
+        elif target_kind == TARGET_USER:
+            self._deliver_local(self.user_connections.get(target_id, ()), frame)
+        else:
+            self._deliver_local(self.chat_subscribers.get(target_id, ()), frame, exclude_user_id,
+                                multiplexed_only=target_kind == TARGET_CHAT_EVENT)
+
+    @staticmethod
+    def _deliver_local(connections, frame: Frame, exclude_user_id: Optional[str] = None,
+                       multiplexed_only: bool = False) -> int:
+        delivered = 0
+        for connection in list(connections):
+            if multiplexed_only and not connection.multiplexed:
+                continue
+            if connection.user_id != exclude_user_id and connection.enqueue(frame):
+                delivered += 1
+        return delivered
+
+    def _fan_out(self, target_kind: str, target_id: str, frame: Frame, exclude_user_id: Optional[str] = None) -> int:
+        if target_kind == TARGET_USER:
+            local = self.user_connections.get(target_id, ())
+        else:
+            local = self.chat_subscribers.get(target_id, ())
+        delivered = self._deliver_local(local, frame, exclude_user_id,
+                                        multiplexed_only=target_kind == TARGET_CHAT_EVENT)
+        if self.pubsub.distributed:
+            self.pubsub.publish(pack_envelope(self.node_id, target_kind, target_id, exclude_user_id, frame))
+        return delivered
 
     async def broadcast(self, chat_id: str, message: Any):
+        """
+        Рассылает сообщение всем в чате. Сообщение кодируется один раз,
+        и один и тот же кадр кладётся в очереди всех получателей.
+        """
         logger.info(f"Got broadcast for chat {chat_id}")
-        if chat_id in self.active_connections:
-            for user_id, connection in self.active_connections[chat_id].items():
-                if connection.client_state == WebSocketState.CONNECTED:
-                    try:
-                        await connection.send_json(message)
-                        logger.debug(f"Broadcasted to a client in chat {chat_id}")
-                    except Exception as e:
-                        logger.error(f"Error broadcasting to {user_id} in chat {chat_id}: {e}")
+        self._fan_out(TARGET_CHAT, chat_id, encode_frame(message))
 
     async def broadcast_to_others(self, chat_id: str, sender_id: str, message: Any):
-        """Отправляет сообщение всем в чате, кроме отправителя."""
-        if chat_id in self.active_connections:
-            for user_id, connection in self.active_connections[chat_id].items():
-                if user_id != sender_id: # Ключевое условие
-                    if connection.client_state == WebSocketState.CONNECTED:
-                        try:
-                            await connection.send_json(message)
-                            logger.info(f"Sent signal from {sender_id} to {user_id} in chat {chat_id}")
-                        except Exception as e:
-                            logger.error(f"Error sending signal to {user_id} in chat {chat_id}: {e}")
+        """Отправляет сообщение всем в чате, кроме отправителя (всех его устройств)."""
+        delivered = self._fan_out(TARGET_CHAT, chat_id, encode_frame(message), exclude_user_id=sender_id)
+        logger.info(f"Queued signal from {sender_id} to {delivered} local clients in chat {chat_id}")
+
+    async def broadcast_event(self, chat_id: str, message: Any):
+        """
+        Рассылает служебное событие чата (например, read_receipt). Старые соединения
+        /ws/{chat_id} принимают любой кадр за сообщение, поэтому событие получают
+        только мультиплексные.
+        """
+        self._fan_out(TARGET_CHAT_EVENT, chat_id, encode_frame(message))
 
+    async def send_to_user(self, user_id: str, message: Any):
+        """Отправляет сообщение на все устройства пользователя, на каком бы узле они ни были."""
+        self._fan_out(TARGET_USER, user_id, encode_frame(message))
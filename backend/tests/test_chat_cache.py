@@ -0,0 +1,70 @@
+# backend/tests/test_chat_cache.py
+import asyncio
+import uuid
+
+import pytest
+
+from app import models
+from app.chat_cache import ChatDirectory, TTLCache
+from app.database import Base, engine, SessionLocal
+
+
+@pytest.fixture(scope="module")
+def chat_with_members():
+    """Чат с двумя участниками, у одного есть FCM токен."""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    alice = models.User(username=f"cache_{uuid.uuid4().hex[:8]}", hashed_password="x", fcm_token="token-a")
+    bob = models.User(username=f"cache_{uuid.uuid4().hex[:8]}", hashed_password="x")
+    chat = models.Chat(title="Cache Test Chat")
+    chat.participants.extend([alice, bob])
+    db.add(chat)
+    db.commit()
+    ids = (str(chat.id), str(alice.id), str(bob.id))
+    db.close()
+    return ids
+
+
+def test_members_and_profiles_are_cached_until_invalidated(chat_with_members):
+    """Тест: повторные обращения не ходят в БД, а сброс записи подхватывает новый токен."""
+    chat_id, alice_id, bob_id = chat_with_members
+
+    async def scenario():
+        directory = ChatDirectory()
+        members = await directory.chat_members(chat_id)
+        profiles = await directory.push_profiles(members)
+        assert members == {alice_id, bob_id}
+        assert profiles[alice_id].fcm_token == "token-a"
+        assert profiles[bob_id].fcm_token is None
+        assert await directory.chat_members(str(uuid.uuid4())) is None
+
+        loads = directory.db_loads
+        await directory.chat_members(chat_id)
+        await directory.push_profiles([alice_id, bob_id])
+        assert directory.db_loads == loads
+
+        db = SessionLocal()
+        db.get(models.User, uuid.UUID(bob_id)).fcm_token = "token-b"
+        db.commit()
+        db.close()
+
+        assert (await directory.push_profiles([bob_id]))[bob_id].fcm_token is None
+        directory.invalidate_user(bob_id)
+        assert (await directory.push_profiles([bob_id]))[bob_id].fcm_token == "token-b"
+
+    asyncio.run(scenario())
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    """Тест: при переполнении вытесняется давно не читанная запись, просроченные не возвращаются."""
+    cache = TTLCache(max_size=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+    expired = TTLCache(max_size=2, ttl_seconds=-1)
+    expired.set("a", 1)
+    assert expired.get("a") is None
@@ -0,0 +1,58 @@
+# backend/tests/test_chat_export.py
+import gzip
+import json
+import uuid
+
+import pytest
+
+from tests.test_main import client
+from tests.test_ws import _register_and_login
+from app.export import export_chat_lines
+
+
+@pytest.fixture(scope="module")
+def exported_chat(client):
+    """Личный чат Ивана и Джуди с пятью сообщениями."""
+    ivan_id, ivan_token = _register_and_login(client, "export_ivan")
+    judy_id, _ = _register_and_login(client, "export_judy")
+    headers = {"Authorization": f"Bearer {ivan_token}"}
+    chat_id = client.post(f"/api/chats/get-or-create/private?partner_id={judy_id}", headers=headers).json()["id"]
+    for i in range(5):
+        response = client.post("/api/messages/", params={
+            "chat_id": chat_id, "sender_id": judy_id if i % 2 else ivan_id, "content": f"export {i}"})
+        assert response.status_code == 200
+    return chat_id, headers
+
+
+def _lines(body: bytes) -> list:
+    return [json.loads(line) for line in body.decode().splitlines()]
+
+
+def test_export_streams_ndjson(client, exported_chat):
+    """Тест: выгрузка отдаёт всю историю по порядку, в том числе сжатой."""
+    chat_id, headers = exported_chat
+    response = client.get(f"/api/chats/{chat_id}/export", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    messages = _lines(response.content)
+    assert [m["content"] for m in messages] == [f"export {i}" for i in range(5)]
+    assert [m["seq"] for m in messages] == [1, 2, 3, 4, 5]
+    assert all(m["chat_id"] == chat_id for m in messages)
+
+    compressed = client.get(f"/api/chats/{chat_id}/export?compress=true", headers=headers)
+    assert compressed.headers["content-disposition"].endswith('.ndjson.gz"')
+    assert _lines(gzip.decompress(compressed.content)) == messages
+
+
+def test_export_reads_in_batches(exported_chat):
+    """Тест: строки читаются пачками по batch_size."""
+    chat_id, _ = exported_chat
+    chunks = list(export_chat_lines(uuid.UUID(chat_id), batch_size=2))
+    assert [len(chunk.splitlines()) for chunk in chunks] == [2, 2, 1]
+
+
+def test_export_requires_participant(client, exported_chat):
+    chat_id, _ = exported_chat
+    _, outsider_token = _register_and_login(client, "export_mallory")
+    response = client.get(f"/api/chats/{chat_id}/export", headers={"Authorization": f"Bearer {outsider_token}"})
+    assert response.status_code == 404
@@ -0,0 +1,78 @@
+# backend/tests/test_chat_list.py
+import pytest
+
+from tests.test_main import client
+from tests.test_ws import _register_and_login
+
+
+@pytest.fixture(scope="module")
+def inbox(client):
+    """Алиса с двумя личными чатами: с Бобом и с Кэрол."""
+    alice_id, alice_token = _register_and_login(client, "inbox_alice")
+    chats = {}
+    for name in ("inbox_bob", "inbox_carol"):
+        partner_id, partner_token = _register_and_login(client, name)
+        response = client.post(
+            f"/api/chats/get-or-create/private?partner_id={partner_id}",
+            headers={"Authorization": f"Bearer {alice_token}"},
+        )
+        chats[name] = (response.json()["id"], partner_id, partner_token)
+    return {"alice": (alice_id, alice_token), "chats": chats}
+
+
+def _send(client, chat_id, sender_id, content):
+    response = client.post("/api/messages/", params={"chat_id": chat_id, "sender_id": sender_id, "content": content})
+    assert response.status_code == 200
+
+
+def test_inbox_uses_summary_and_unread_counters(client, inbox):
+    """Тест: список чатов упорядочен по активности, последнее сообщение и непрочитанное берутся из сводки."""
+    alice_id, alice_token = inbox["alice"]
+    headers = {"Authorization": f"Bearer {alice_token}"}
+    bob_chat, bob_id, _ = inbox["chats"]["inbox_bob"]
+    carol_chat, carol_id, _ = inbox["chats"]["inbox_carol"]
+
+    _send(client, bob_chat, bob_id, "hi from bob")
+    _send(client, bob_chat, bob_id, "are you there?")
+    _send(client, carol_chat, carol_id, "hi from carol")
+    _send(client, carol_chat, alice_id, "hi carol")
+
+    chats = client.get("/api/chats/", headers=headers).json()
+    assert [c["id"] for c in chats] == [carol_chat, bob_chat]
+    assert chats[0]["last_message"]["content"] == "hi carol"
+    assert chats[0]["last_message"]["type"] == "text"
+    # Ответ собирается из проекции столбцов, но формат тот же, что у ChatResponse
+    assert {p["id"] for p in chats[0]["participants"]} == {alice_id, carol_id}
+    assert set(chats[0]["participants"][0]) == {"id", "username", "avatar_url"}
+    # Своё сообщение сдвигает водяной знак: чат с Кэрол прочитан до "hi carol"
+    assert [c["unread_count"] for c in chats] == [0, 2]
+
+    first_page = client.get("/api/chats/?limit=1", headers=headers)
+    assert [c["id"] for c in first_page.json()] == [carol_chat]
+    second_page = client.get(f"/api/chats/?limit=1&cursor={first_page.headers['X-Next-Cursor']}", headers=headers)
+    assert [c["id"] for c in second_page.json()] == [bob_chat]
+    assert "X-Next-Cursor" not in second_page.headers
+
+    assert client.post(f"/api/chats/{bob_chat}/read", headers=headers).status_code == 204
+    chats = client.get("/api/chats/", headers=headers).json()
+    assert {c["id"]: c["unread_count"] for c in chats} == {carol_chat: 0, bob_chat: 0}
+
+    _send(client, bob_chat, bob_id, "one more")
+    chats = client.get("/api/chats/", headers=headers).json()
+    assert chats[0]["id"] == bob_chat
+    assert chats[0]["unread_count"] == 1
+
+
+def test_private_chat_is_shared_by_both_sides(client, inbox):
+    """Тест: личный чат находится по паре участников, с какой стороны его ни открывай."""
+    alice_id, alice_token = inbox["alice"]
+    bob_chat, bob_id, bob_token = inbox["chats"]["inbox_bob"]
+
+    for token, partner_id in ((alice_token, bob_id), (bob_token, alice_id)):
+        response = client.post(
+            f"/api/chats/get-or-create/private?partner_id={partner_id}",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 200
+        assert response.json()["id"] == bob_chat
+        assert {p["id"] for p in response.json()["participants"]} == {alice_id, bob_id}
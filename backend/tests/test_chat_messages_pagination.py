@@ -0,0 +1,67 @@
+# backend/tests/test_chat_messages_pagination.py
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from tests.test_main import client
+from app import models
+from app.database import SessionLocal
+
+
+@pytest.fixture(scope="module")
+def long_chat():
+    """Чат из 25 сообщений с возрастающими временами (два — с одинаковым временем)."""
+    db = SessionLocal()
+    user = models.User(username=f"pager_{uuid.uuid4().hex[:8]}", hashed_password="x")
+    chat = models.Chat(title="Pagination Chat")
+    chat.participants.append(user)
+    db.add(chat)
+    db.flush()
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    for i in range(25):
+        # Сообщения 10 и 11 приходятся на одно время — порядок решает id
+        offset = i if i != 11 else 10
+        db.add(models.Message(chat_id=chat.id, sender_id=user.id, content=f"m{i}",
+                              timestamp=start + timedelta(seconds=offset)))
+    db.commit()
+    chat_id = str(chat.id)
+    db.close()
+    return chat_id
+
+
+def test_without_params_returns_full_history(client, long_chat):
+    response = client.get(f"/api/chats/{long_chat}/messages")
+    assert response.status_code == 200
+    assert len(response.json()) == 25
+    assert "X-Prev-Cursor" not in response.headers
+
+
+def test_pages_walk_back_and_forward_without_gaps(client, long_chat):
+    """Тест: страницы назад и вперёд покрывают историю ровно один раз."""
+    full = [m["id"] for m in client.get(f"/api/chats/{long_chat}/messages").json()]
+
+    latest = client.get(f"/api/chats/{long_chat}/messages?limit=10")
+    assert [m["id"] for m in latest.json()] == full[-10:]
+    assert "X-Next-Cursor" not in latest.headers
+
+    collected = latest.json()
+    cursor = latest.headers["X-Prev-Cursor"]
+    while cursor:
+        page = client.get(f"/api/chats/{long_chat}/messages", params={"limit": 10, "before": cursor})
+        assert page.status_code == 200
+        collected = page.json() + collected
+        cursor = page.headers.get("X-Prev-Cursor")
+    assert [m["id"] for m in collected] == full
+
+    oldest = client.get(f"/api/chats/{long_chat}/messages",
+                        params={"limit": 10, "before": latest.headers["X-Prev-Cursor"]})
+    newer = client.get(f"/api/chats/{long_chat}/messages",
+                       params={"limit": 10, "after": oldest.headers["X-Next-Cursor"]})
+    assert [m["id"] for m in newer.json()] == full[-10:]
+    assert "X-Next-Cursor" not in newer.headers
+
+
+def test_invalid_cursor_is_rejected(client, long_chat):
+    response = client.get(f"/api/chats/{long_chat}/messages", params={"limit": 5, "before": "not-a-cursor"})
+    assert response.status_code == 400
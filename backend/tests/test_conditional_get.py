@@ -0,0 +1,70 @@
+# backend/tests/test_conditional_get.py
+import json
+
+import pytest
+
+from tests.test_main import client
+from tests.test_ws import _register_and_login
+
+
+@pytest.fixture(scope="module")
+def chat(client):
+    """Личный чат Дэйва и Евы."""
+    dave_id, dave_token = _register_and_login(client, "etag_dave")
+    eve_id, _ = _register_and_login(client, "etag_eve")
+    headers = {"Authorization": f"Bearer {dave_token}"}
+    response = client.post(f"/api/chats/get-or-create/private?partner_id={eve_id}", headers=headers)
+    return response.json()["id"], dave_id, eve_id, headers
+
+
+def _send(client, chat_id, sender_id, content, type="text"):
+    response = client.post("/api/messages/",
+                           params={"chat_id": chat_id, "sender_id": sender_id, "content": content, "type": type})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_message_history_not_modified(client, chat):
+    """Тест: история чата отдаёт 304, пока не пришло новое сообщение или правка."""
+    chat_id, dave_id, eve_id, _ = chat
+    audio_id = _send(client, chat_id, eve_id, json.dumps({"url": "/media/a.m4a"}), type="audio")
+
+    first = client.get(f"/api/chats/{chat_id}/messages")
+    etag = first.headers["ETag"]
+    repeat = client.get(f"/api/chats/{chat_id}/messages", headers={"If-None-Match": etag})
+    assert repeat.status_code == 304
+    assert repeat.headers["ETag"] == etag
+
+    # У другой страницы свой тег
+    page = client.get(f"/api/chats/{chat_id}/messages?limit=1", headers={"If-None-Match": etag})
+    assert page.status_code == 200
+
+    # Правка расшифровки меняет версию чата
+    response = client.put(f"/api/media/transcribe/{audio_id}", json={"full_text": "hello", "words": []})
+    assert response.status_code == 200
+    edited = client.get(f"/api/chats/{chat_id}/messages", headers={"If-None-Match": etag})
+    assert edited.status_code == 200
+    assert json.loads(edited.json()[-1]["content"])["transcription"]["full_text"] == "hello"
+
+    etag = edited.headers["ETag"]
+    _send(client, chat_id, dave_id, "new message")
+    assert client.get(f"/api/chats/{chat_id}/messages", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_chat_list_not_modified(client, chat):
+    """Тест: список чатов отдаёт 304, пока не изменились сообщения или прочтение."""
+    chat_id, dave_id, eve_id, headers = chat
+
+    etag = client.get("/api/chats/", headers=headers).headers["ETag"]
+    conditional = {**headers, "If-None-Match": etag}
+    assert client.get("/api/chats/", headers=conditional).status_code == 304
+
+    _send(client, chat_id, eve_id, "ping")
+    response = client.get("/api/chats/", headers=conditional)
+    assert response.status_code == 200
+    assert response.json()[0]["unread_count"] > 0
+
+    conditional["If-None-Match"] = response.headers["ETag"]
+    assert client.get("/api/chats/", headers=conditional).status_code == 304
+    assert client.post(f"/api/chats/{chat_id}/read", headers=headers).status_code == 204
+    assert client.get("/api/chats/", headers=conditional).status_code == 200
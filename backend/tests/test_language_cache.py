@@ -0,0 +1,76 @@
+# backend/tests/test_language_cache.py
+import asyncio
+import uuid
+
+from tests.test_main import client
+from app import models
+from app.database import SessionLocal
+from app.language_cache import LanguageCache, language_cache
+
+
+def test_languages_served_from_memory_with_etag(client, monkeypatch):
+    """Тест: справочник отдаётся из памяти с ETag, новый язык подхватывается при промахе."""
+    language_cache.refresh()
+    response = client.get("/api/users/languages/all")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    loads = language_cache.db_loads
+    assert client.get("/api/users/languages/all", headers={"If-None-Match": etag}).status_code == 304
+    assert language_cache.db_loads == loads
+
+    code = f"c{uuid.uuid4().hex[:6]}"
+    db = SessionLocal()
+    db.add(models.Language(name=f"Cached {code}", code=code))
+    db.commit()
+    db.close()
+
+    # Интервал между перечитываниями при промахе уже прошёл
+    monkeypatch.setattr(language_cache, "miss_refresh_seconds", 0)
+    version = language_cache.snapshot().version
+    assert language_cache.by_code(code).name == f"Cached {code}"
+    assert language_cache.snapshot().version == version + 1
+    response = client.get("/api/users/languages/all", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert code in {language["code"] for language in response.json()}
+
+
+def test_translate_rejects_codes_outside_reference_data(client):
+    response = client.post("/api/translate/", json={"text": "hello", "target_lang": "xx-unknown"})
+    assert response.status_code == 400
+
+
+def test_unknown_codes_do_not_reload_table_on_every_miss():
+    """Тест: повторные промахи в пределах интервала не перечитывают таблицу, в том числе из event loop."""
+    cache = LanguageCache(miss_refresh_seconds=60)
+    cache.refresh()
+    loads = cache.db_loads
+    for _ in range(50):
+        assert cache.by_code("xx-unknown") is None
+        assert cache.get(-1) is None
+
+    async def lookups():
+        return await asyncio.gather(*(cache.by_code_async("xx-unknown") for _ in range(50)))
+
+    assert asyncio.run(lookups()) == [None] * 50
+    assert cache.db_loads == loads
+
+    cache.miss_refresh_seconds = 0
+    assert asyncio.run(cache.by_code_async("xx-unknown")) is None
+    assert cache.db_loads == loads + 1
+
+
+def test_language_refresh_requires_admin(client, monkeypatch):
+    """Тест: принудительная перезагрузка справочника доступна только администраторам."""
+    from app import security
+    from tests.test_ws import _register_and_login
+
+    _, token = _register_and_login(client, "lang_refresher")
+    headers = {"Authorization": f"Bearer {token}"}
+    loads = language_cache.db_loads
+    assert client.post("/api/users/languages/refresh", headers=headers).status_code == 403
+    assert language_cache.db_loads == loads
+
+    monkeypatch.setattr(security, "ADMIN_USERNAMES", frozenset({"lang_refresher"}))
+    response = client.post("/api/users/languages/refresh", headers=headers)
+    assert response.status_code == 200
+    assert language_cache.db_loads == loads + 1
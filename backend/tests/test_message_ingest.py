@@ -0,0 +1,169 @@
+# backend/tests/test_message_ingest.py
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from tests.test_main import client
+from tests.test_ws import _register_and_login
+from app.ingest import MessageIngest
+
+
+@pytest.fixture(scope="module")
+def ingest_chat(client):
+    """Личный чат Кена и Лоры."""
+    ken_id, ken_token = _register_and_login(client, "ingest_ken")
+    laura_id, _ = _register_and_login(client, "ingest_laura")
+    outsider_id, _ = _register_and_login(client, "ingest_oscar")
+    headers = {"Authorization": f"Bearer {ken_token}"}
+    chat_id = client.post(f"/api/chats/get-or-create/private?partner_id={laura_id}", headers=headers).json()["id"]
+    return {"chat_id": chat_id, "ken": ken_id, "laura": laura_id, "outsider": outsider_id,
+            "token": ken_token, "headers": headers}
+
+
+def _ndjson(items) -> bytes:
+    return b"".join((item if isinstance(item, bytes) else json.dumps(item).encode()) + b"\n" for item in items)
+
+
+def test_bulk_ingest_validates_and_orders_history(client, ingest_chat):
+    """Тест: годные строки загружаются по времени, негодные попадают в отчёт, событие — одно на чат."""
+    chat_id, ken, laura = ingest_chat["chat_id"], ingest_chat["ken"], ingest_chat["laura"]
+    body = _ndjson([
+        {"chat_id": chat_id, "sender_id": ken, "content": "second", "timestamp": "2023-05-01T10:01:00"},
+        {"chat_id": chat_id, "sender_id": ken, "content": "first", "timestamp": "2023-05-01T10:00:00"},
+        b"{not json",
+        {"chat_id": chat_id, "sender_id": ingest_chat["outsider"], "content": "intruder"},
+        {"chat_id": chat_id, "sender_id": ken},
+        {"chat_id": chat_id, "sender_id": ken, "content": "third", "timestamp": "2023-05-01T10:02:00"},
+        {"chat_id": chat_id, "sender_id": laura, "content": "impersonated", "timestamp": "2023-05-01T09:00:00"},
+    ])
+
+    with client.websocket_connect(f"/ws/user?token={ingest_chat['token']}") as ws:
+        ws.send_json({"action": "subscribe", "chat_ids": [chat_id]})
+        ws.receive_json()
+        response = client.post("/api/messages/bulk?notify=true", content=body,
+                               headers={**ingest_chat["headers"], "Content-Type": "application/x-ndjson"})
+        assert response.status_code == 200
+        event = ws.receive_json()
+
+    report = response.json()
+    assert (report["accepted"], report["rejected"]) == (3, 4)
+    assert [error["line"] for error in report["errors"]] == [3, 4, 5, 7]
+    assert report["errors"][2]["detail"].startswith("content")
+    # Чужие сообщения загружать нельзя — ни постороннего, ни собеседника
+    assert report["errors"][1]["detail"] == report["errors"][3]["detail"] == "Sender must be the uploading user"
+    assert event == {"type": "messages_ingested", "chat_id": chat_id, "count": 3, "last_seq": 3}
+
+    history = client.get(f"/api/chats/{chat_id}/messages").json()
+    assert [(m["content"], m["seq"]) for m in history] == [("first", 1), ("second", 2), ("third", 3)]
+    inbox = client.get("/api/chats/", headers=ingest_chat["headers"]).json()
+    assert inbox[0]["last_message"]["content"] == "third"
+
+
+def test_ingest_writes_in_batches_without_rewinding_summary(client, ingest_chat):
+    """Тест: пакеты пишутся по batch_size, более старая история не меняет последнее сообщение чата."""
+    chat_id, ken = ingest_chat["chat_id"], ingest_chat["ken"]
+
+    async def lines():
+        for i in range(7):
+            item = {"chat_id": chat_id, "sender_id": ken, "content": f"old {i}", "timestamp": f"2020-01-01T00:00:0{i}"}
+            yield i + 1, json.dumps(item).encode()
+
+    ingest = MessageIngest(uuid.UUID(ken), batch_size=3)
+    report = asyncio.run(ingest.run(lines()))
+    assert (report.accepted, report.rejected) == (7, 0)
+    assert ingest.chats[uuid.UUID(chat_id)][0] == 7
+
+    inbox = client.get("/api/chats/", headers=ingest_chat["headers"]).json()
+    assert inbox[0]["last_message"]["content"] == "third"
+
+
+def test_ingest_reports_failed_batch_and_continues(client, ingest_chat, monkeypatch):
+    """Тест: ошибка записи пакета попадает в отчёт, уже записанные и следующие пакеты сохраняются."""
+    from sqlalchemy.exc import OperationalError
+    from app import ingest as ingest_module
+
+    chat_id, ken = ingest_chat["chat_id"], ingest_chat["ken"]
+    real_insert = ingest_module.insert_messages
+    calls = []
+
+    async def flaky_insert(db, rows, **kwargs):
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return await real_insert(db, rows, **kwargs)
+
+    monkeypatch.setattr(ingest_module, "insert_messages", flaky_insert)
+
+    async def lines():
+        for i in range(6):
+            item = {"chat_id": chat_id, "sender_id": ken, "content": f"batch {i}", "timestamp": f"2019-01-01T00:00:0{i}"}
+            yield i + 1, json.dumps(item).encode()
+
+    ingest = MessageIngest(uuid.UUID(ken), batch_size=2)
+    report = asyncio.run(ingest.run(lines()))
+    assert calls == [2, 2, 2]
+    assert (report.accepted, report.rejected) == (4, 2)
+    assert [(error.line, error.detail) for error in report.errors] == [
+        (3, "Batch could not be written"), (4, "Batch could not be written"),
+    ]
+    assert ingest.chats[uuid.UUID(chat_id)][0] == 4
+
+
+def test_admin_can_import_whole_conversation(client, ingest_chat, monkeypatch):
+    """Тест: сообщения собеседника загружаются только с any_sender и только администратором."""
+    from app import security
+
+    chat_id, ken, laura = ingest_chat["chat_id"], ingest_chat["ken"], ingest_chat["laura"]
+    body = _ndjson([
+        {"chat_id": chat_id, "sender_id": ken, "content": "question", "timestamp": "2018-01-01T10:00:00"},
+        {"chat_id": chat_id, "sender_id": laura, "content": "answer", "timestamp": "2018-01-01T10:01:00"},
+        {"chat_id": chat_id, "sender_id": ingest_chat["outsider"], "content": "intruder"},
+    ])
+    headers = {**ingest_chat["headers"], "Content-Type": "application/x-ndjson"}
+    assert client.post("/api/messages/bulk?any_sender=true", content=body, headers=headers).status_code == 403
+
+    monkeypatch.setattr(security, "ADMIN_USERNAMES", frozenset({"ingest_ken"}))
+    report = client.post("/api/messages/bulk?any_sender=true", content=body, headers=headers).json()
+    assert (report["accepted"], report["rejected"]) == (2, 1)
+    assert report["errors"] == [{"line": 3, "detail": "Sender is not a participant of the chat"}]
+
+
+def test_imported_history_is_not_unread_and_not_replayed(client, ingest_chat):
+    """Тест: загрузка не добавляет непрочитанных и не досылается по since_seq, живые сообщения — да."""
+    from app import models
+    from app.database import AsyncSessionLocal, SessionLocal
+    from app.message_writer import fetch_messages_since
+
+    chat_id, ken, laura = ingest_chat["chat_id"], ingest_chat["ken"], ingest_chat["laura"]
+
+    def laura_unread():
+        db = SessionLocal()
+        try:
+            participants = models.chat_participants.c
+            return db.query(models.Chat.last_seq - participants.last_read_seq).join(
+                models.chat_participants, participants.chat_id == models.Chat.id
+            ).filter(models.Chat.id == uuid.UUID(chat_id), participants.user_id == uuid.UUID(laura)).scalar()
+        finally:
+            db.close()
+
+    with client.websocket_connect(f"/ws/user?token={ingest_chat['token']}") as ws:
+        ws.send_json({"action": "subscribe", "chat_ids": [chat_id]})
+        ws.receive_json()
+        ws.send_json({"chat_id": chat_id, "type": "text", "content": "live"})
+        live = ws.receive_json()
+    unread = laura_unread()
+
+    body = _ndjson([{"chat_id": chat_id, "sender_id": ken, "content": f"archive {i}",
+                     "timestamp": f"2017-01-01T00:00:0{i}"} for i in range(3)])
+    report = client.post("/api/messages/bulk", content=body,
+                         headers={**ingest_chat["headers"], "Content-Type": "application/x-ndjson"}).json()
+    assert report["accepted"] == 3
+    assert laura_unread() == unread
+
+    async def replay():
+        async with AsyncSessionLocal() as db:
+            return await fetch_messages_since(db, uuid.UUID(chat_id), live["seq"] - 1, 100)
+
+    assert [str(message.id) for message in asyncio.run(replay())] == [live["id"]]
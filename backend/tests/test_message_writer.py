@@ -0,0 +1,93 @@
+# backend/tests/test_message_writer.py
+import asyncio
+import uuid
+
+import pytest
+
+from app import models
+from app.database import Base, engine, SessionLocal
+from app.message_writer import MessageBatchWriter, new_message_values
+
+
+@pytest.fixture(scope="module")
+def chat_and_user():
+    """Создаёт чат и пользователя напрямую в тестовой БД."""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = models.User(username=f"writer_{uuid.uuid4().hex[:8]}", hashed_password="x")
+    chat = models.Chat(title="Writer Test Chat")
+    chat.participants.append(user)
+    db.add(chat)
+    db.commit()
+    ids = (chat.id, user.id)
+    db.close()
+    return ids
+
+
+def test_concurrent_messages_are_committed_in_batches(chat_and_user):
+    """Тест: параллельные сообщения пишутся несколькими пакетами, каждый получает свой ответ."""
+    chat_id, user_id = chat_and_user
+
+    async def scenario():
+        writer = MessageBatchWriter(window_ms=20, max_batch_size=10)
+        results = await asyncio.gather(*[
+            writer.submit(new_message_values(chat_id, user_id, f"msg {i}"))
+            for i in range(25)
+        ])
+        await writer.stop()
+        return writer, results
+
+    writer, results = asyncio.run(scenario())
+
+    assert [r.content for r in results] == [f"msg {i}" for i in range(25)]
+    assert len({r.id for r in results}) == 25
+    assert writer.batches_committed == 3
+    # Номера в чате идут подряд в порядке отправки
+    first_seq = results[0].seq
+    assert [r.seq for r in results] == list(range(first_seq, first_seq + 25))
+
+    db = SessionLocal()
+    stored = db.query(models.Message).filter(models.Message.chat_id == chat_id).count()
+    db.close()
+    assert stored == 25
+
+
+def test_reply_is_resolved_within_batch(chat_and_user):
+    """Тест: цитируемое сообщение подгружается в ответ писателя."""
+    chat_id, user_id = chat_and_user
+
+    async def scenario():
+        writer = MessageBatchWriter(window_ms=0)
+        original = await writer.submit(new_message_values(chat_id, user_id, "original"))
+        reply = await writer.submit(new_message_values(chat_id, user_id, "reply", reply_to_message_id=original.id))
+        await writer.stop()
+        return original, reply
+
+    original, reply = asyncio.run(scenario())
+    assert reply.reply_to_message.id == original.id
+    assert reply.reply_to_message.content == "original"
+
+
+def test_stop_waits_for_batch_in_progress(chat_and_user):
+    """Тест: остановка во время записи пакета дожидается его commit и ответов отправителям."""
+    chat_id, user_id = chat_and_user
+
+    class SlowWriter(MessageBatchWriter):
+        async def _write(self, rows):
+            await asyncio.sleep(0.2)
+            return await super()._write(rows)
+
+    async def scenario():
+        writer = SlowWriter(window_ms=0)
+        first = asyncio.create_task(writer.submit(new_message_values(chat_id, user_id, "in flight")))
+        await asyncio.sleep(0.05)
+        # Первый пакет уже пишется, второй ещё в очереди
+        second = asyncio.create_task(writer.submit(new_message_values(chat_id, user_id, "queued")))
+        await asyncio.sleep(0)
+        await writer.stop()
+        return writer, first, second
+
+    writer, first, second = asyncio.run(scenario())
+    assert first.done() and second.done()
+    assert [first.result().content, second.result().content] == ["in flight", "queued"]
+    assert writer.batches_committed == 2
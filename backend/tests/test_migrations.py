@@ -0,0 +1,135 @@
+# backend/tests/test_migrations.py
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, text
+
+from app.database import Base
+from app.migrate import alembic_config, include_object
+
+
+@pytest.fixture
+def migration_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    yield engine
+    engine.dispose()
+
+
+def _upgrade(engine, revision):
+    with engine.begin() as connection:
+        command.upgrade(alembic_config(connection), revision)
+
+
+def test_migrations_match_models(migration_engine):
+    """Тест: цепочка миграций даёт ту же схему, что и модели."""
+    _upgrade(migration_engine, "head")
+    with migration_engine.connect() as connection:
+        diff = compare_metadata(MigrationContext.configure(connection, opts={"include_object": include_object}), Base.metadata)
+    assert diff == []
+
+
+def test_existing_data_is_backfilled(migration_engine):
+    """Тест: номера, сводка чата и водяные знаки заполняются для старых данных."""
+    _upgrade(migration_engine, "0001")
+    chat, alice, bob = (uuid.uuid4().hex for _ in range(3))
+    start = datetime(2024, 1, 1)
+    with migration_engine.begin() as connection:
+        for user in (alice, bob):
+            connection.execute(text("INSERT INTO users (id, username, hashed_password) VALUES (:id, :id, 'x')"), {"id": user})
+            connection.execute(text("INSERT INTO chat_participants (user_id, chat_id) VALUES (:u, :c)"), {"u": user, "c": chat})
+        connection.execute(text("INSERT INTO chats (id) VALUES (:id)"), {"id": chat})
+        for i, (sender, is_read) in enumerate([(alice, True), (bob, True), (alice, False), (alice, False)]):
+            connection.execute(
+                text("INSERT INTO messages (id, chat_id, sender_id, content, type, timestamp, is_read) "
+                     "VALUES (:id, :c, :s, :content, 'text', :ts, :r)"),
+                {"id": uuid.uuid4().hex, "c": chat, "s": sender, "content": f"m{i}",
+                 "ts": start + timedelta(minutes=i), "r": is_read},
+            )
+
+    _upgrade(migration_engine, "head")
+
+    with migration_engine.connect() as connection:
+        seqs = connection.execute(text("SELECT content, seq FROM messages ORDER BY seq")).all()
+        summary = connection.execute(text("SELECT last_seq, last_message_preview FROM chats")).one()
+        watermarks = dict(connection.execute(text("SELECT user_id, last_read_seq FROM chat_participants")).all())
+    assert seqs == [("m0", 1), ("m1", 2), ("m2", 3), ("m3", 4)]
+    assert tuple(summary) == (4, "m3")
+    # У Боба непрочитаны два последних сообщения Алисы, у Алисы — ничего
+    assert watermarks == {alice: 4, bob: 2}
+
+
+def test_private_chat_pair_key_backfill_skips_duplicates(migration_engine):
+    """Тест: при дубликатах личного чата ключ пары получает самый старый."""
+    _upgrade(migration_engine, "0003")
+    alice, bob = uuid.UUID(int=1), uuid.UUID(int=2)
+    older, newer = uuid.uuid4(), uuid.uuid4()
+    with migration_engine.begin() as connection:
+        for chat_id, created in ((newer, datetime(2024, 2, 1)), (older, datetime(2024, 1, 1))):
+            connection.execute(text("INSERT INTO chats (id, timestamp) VALUES (:id, :ts)"), {"id": chat_id.hex, "ts": created})
+            for user in (alice, bob):
+                connection.execute(text("INSERT INTO chat_participants (user_id, chat_id) VALUES (:u, :c)"),
+                                   {"u": user.hex, "c": chat_id.hex})
+
+    _upgrade(migration_engine, "head")
+
+    with migration_engine.connect() as connection:
+        keys = dict(connection.execute(text("SELECT id, pair_key FROM chats")).all())
+    assert keys == {older.hex: f"{alice}:{bob}", newer.hex: None}
+
+
+def test_language_matches_backfilled_for_existing_users(migration_engine):
+    """Тест: у каждого пользователя строки на все пары его языков, включая "любой" (0)."""
+    _upgrade(migration_engine, "0006")
+    speaker, lurker = uuid.uuid4().hex, uuid.uuid4().hex
+    with migration_engine.begin() as connection:
+        for user in (speaker, lurker):
+            connection.execute(text("INSERT INTO users (id, username, hashed_password) VALUES (:id, :id, 'x')"), {"id": user})
+        for language_id, type_ in ((1, "native"), (2, "learning"), (3, "learning")):
+            connection.execute(text("INSERT INTO user_languages (user_id, language_id, type) VALUES (:u, :l, :t)"),
+                               {"u": speaker, "l": language_id, "t": type_})
+
+    _upgrade(migration_engine, "head")
+
+    with migration_engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT user_id, native_language_id, learning_language_id FROM language_matches"
+        )).all()
+    assert sorted((n, l) for user, n, l in rows if user == speaker) == [(0, 0), (0, 2), (0, 3), (1, 0), (1, 2), (1, 3)]
+    assert [(n, l) for user, n, l in rows if user == lurker] == [(0, 0)]
+
+
+def test_search_index_covers_existing_messages(migration_engine):
+    """Тест: текст и расшифровки старых сообщений попадают в полнотекстовый индекс."""
+    _upgrade(migration_engine, "0005")
+    chat, user = uuid.uuid4().hex, uuid.uuid4().hex
+    media = json.dumps({"url": "/media/a.m4a", "transcription": {"full_text": "old harbour recording", "words": []}})
+    with migration_engine.begin() as connection:
+        connection.execute(text("INSERT INTO chats (id) VALUES (:id)"), {"id": chat})
+        for content, type_ in (("harbour text", "text"), (media, "audio"), (json.dumps({"url": "/b.m4a"}), "audio")):
+            connection.execute(
+                text("INSERT INTO messages (id, chat_id, sender_id, content, type, is_read) "
+                     "VALUES (:id, :c, :s, :content, :type, 0)"),
+                {"id": uuid.uuid4().hex, "c": chat, "s": user, "content": content, "type": type_},
+            )
+
+    _upgrade(migration_engine, "head")
+
+    with migration_engine.begin() as connection:
+        found = connection.execute(text(
+            "SELECT m.search_text FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid "
+            "WHERE messages_fts MATCH 'harbour' ORDER BY m.search_text"
+        )).scalars().all()
+        assert found == ["harbour text", "old harbour recording"]
+        # Новые строки индексируются триггером
+        connection.execute(
+            text("INSERT INTO messages (id, chat_id, sender_id, content, type, is_read, search_text) "
+                 "VALUES (:id, :c, :s, 'harbour again', 'text', 0, 'harbour again')"),
+            {"id": uuid.uuid4().hex, "c": chat, "s": user},
+        )
+        count = connection.execute(text("SELECT count(*) FROM messages_fts WHERE messages_fts MATCH 'harbour'")).scalar()
+    assert count == 3
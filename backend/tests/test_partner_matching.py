@@ -0,0 +1,113 @@
+# backend/tests/test_partner_matching.py
+import uuid
+
+import pytest
+
+from tests.test_main import client
+from tests.test_ws import _register_and_login
+from app import models
+from app.database import SessionLocal
+from app.language_cache import language_cache
+from app.matching import Searcher, find_partners, match_rows
+
+
+def _language(code):
+    db = SessionLocal()
+    language = db.query(models.Language).filter(models.Language.code == code).first()
+    if language is None:
+        language = models.Language(name=f"Matching {code}", code=code)
+        db.add(language)
+        db.commit()
+        language_cache.refresh()
+    language_id = language.id
+    db.close()
+    return language_id
+
+
+def _set_languages(client, user, native, learning):
+    user_id, token = user
+    response = client.put(f"/api/users/{user_id}/languages", headers={"Authorization": f"Bearer {token}"}, json=[
+        {"language_id": native, "type": "native", "level": "Native"},
+        {"language_id": learning, "type": "learning", "level": "B1"},
+    ])
+    assert response.status_code == 204
+
+
+@pytest.fixture(scope="module")
+def learners(client):
+    """Ищущий (родной pm_a, учит pm_b) и три носителя pm_b: двое учат pm_a, один — pm_c."""
+    a, b, c = _language("pm_a"), _language("pm_b"), _language("pm_c")
+    users = {name: _register_and_login(client, f"match_{name}") for name in ("me", "olga", "pavel", "quinn")}
+    _set_languages(client, users["me"], a, b)
+    _set_languages(client, users["olga"], b, a)
+    _set_languages(client, users["pavel"], b, c)
+    _set_languages(client, users["quinn"], b, a)
+    return {name: user_id for name, (user_id, _) in users.items()}, users["me"][1]
+
+
+def _walk(client, url, headers=None, limit=1):
+    """Все страницы выдачи: [(user_id, reciprocal)]."""
+    found, cursor = [], None
+    while True:
+        response = client.get(url, params={"limit": limit, **({"cursor": cursor} if cursor else {})}, headers=headers)
+        assert response.status_code == 200
+        found.extend((user["id"], user.get("reciprocal")) for user in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return found
+
+
+def test_partners_rank_reciprocal_then_recent(client, learners):
+    """Тест: взаимные совпадения первыми, внутри группы — недавно активные; страницы без повторов."""
+    ids, token = learners
+    headers = {"Authorization": f"Bearer {token}"}
+    url = "/api/users/partners?native_lang_code=pm_b"
+    assert _walk(client, url, headers) == [(ids["quinn"], True), (ids["olga"], True), (ids["pavel"], False)]
+
+    # Вход поднимает Ольгу среди взаимных
+    client.post("/api/users/token", data={"username": "match_olga", "password": "pass"},
+                headers={"Content-Type": "application/x-www-form-urlencoded"})
+    assert [user_id for user_id, _ in _walk(client, url, headers, limit=2)] == [ids["olga"], ids["quinn"], ids["pavel"]]
+
+
+def test_find_users_uses_matching_index(client, learners):
+    """Тест: поиск по паре языков и по одному языку, смена языков сразу отражается в выдаче."""
+    ids, _ = learners
+    by_pair = {user_id for user_id, _ in _walk(client, "/api/users/?native_lang_code=pm_b&learning_lang_code=pm_a")}
+    assert by_pair == {ids["olga"], ids["quinn"]}
+    learners_of_a = {user_id for user_id, _ in _walk(client, "/api/users/?learning_lang_code=pm_a", limit=10)}
+    assert learners_of_a == {ids["olga"], ids["quinn"]}
+    assert client.get("/api/users/?native_lang_code=no_such_code").json() == []
+
+
+def test_reciprocal_tier_respects_filter_and_multiple_languages(client, learners):
+    """Тест: взаимные совпадения из нескольких пар языков — без повторов, фильтр вне этих пар сужает выдачу."""
+    ids, token = learners
+    headers = {"Authorization": f"Bearer {token}"}
+    assert _walk(client, "/api/users/partners?learning_lang_code=pm_c", headers) == [(ids["pavel"], False)]
+    reciprocal = _walk(client, "/api/users/partners?native_lang_code=pm_b&learning_lang_code=pm_a", headers, limit=5)
+    assert {user for user, _ in reciprocal} == {ids["olga"], ids["quinn"]} and all(flag for _, flag in reciprocal)
+
+    a, b, c = _language("pm_a"), _language("pm_b"), _language("pm_c")
+    searcher = Searcher(uuid.UUID(ids["me"]), [(a, "native"), (c, "native"), (b, "learning")])
+    db = SessionLocal()
+    try:
+        found, cursor = [], None
+        while True:
+            page, cursor = find_partners(db, b, None, 1, cursor, searcher=searcher)
+            found.extend(page)
+            if not cursor:
+                break
+    finally:
+        db.close()
+    assert sorted(found) == sorted([(uuid.UUID(ids[name]), True) for name in ("olga", "pavel", "quinn")])
+
+
+def test_searcher_ignores_language_types_outside_index():
+    """Тест: ищущий учитывает те же типы языков, что и строки индекса."""
+    languages = [(1, "native"), (2, "learning"), (3, "fluent")]
+    searcher = Searcher(uuid.uuid4(), languages)
+    assert (searcher.natives, searcher.learning) == ({1}, {2})
+    rows = match_rows(searcher.user_id, languages, None)
+    assert {row["native_language_id"] for row in rows} == {0, 1}
+    assert {row["learning_language_id"] for row in rows} == {0, 2}
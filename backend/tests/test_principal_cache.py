@@ -0,0 +1,35 @@
+# backend/tests/test_principal_cache.py
+from tests.test_main import client
+from tests.test_ws import _register_and_login
+from tests.test_query_plans import captured_statements
+from app import security
+from app.database import engine
+from app.principal_cache import principal_cache
+
+
+def test_authenticated_requests_skip_user_lookup(client):
+    """Тест: повторные запросы с токеном не читают users, изменения профиля сбрасывают кэш."""
+    user_id, token = _register_and_login(client, "principal_nina")
+    headers = {"Authorization": f"Bearer {token}"}
+    principal_cache.clear()
+
+    assert client.get("/api/chats/", headers=headers).status_code == 200
+    loads = principal_cache.db_loads
+    with captured_statements(engine) as statements:
+        assert client.get("/api/chats/", headers=headers).status_code == 200
+    assert principal_cache.db_loads == loads
+    assert not [s for s, _ in statements if "FROM users" in s]
+
+    # Изменение через кэшированный объект доходит до базы
+    response = client.put(f"/api/users/{user_id}", json={"bio": "cached"}, headers=headers)
+    assert response.status_code == 200
+    assert client.get(f"/api/users/{user_id}").json()["bio"] == "cached"
+
+    assert client.post("/api/users/update-fcm-token", json={"fcm_token": "t1"}, headers=headers).status_code == 204
+    assert client.get("/api/chats/", headers=headers).status_code == 200
+    assert principal_cache.db_loads > loads
+
+
+def test_invalid_user_id_claim_is_rejected(client):
+    token = security.create_access_token(data={"sub": "principal_nobody", "user_id": "not-a-uuid"})
+    assert client.get("/api/chats/", headers={"Authorization": f"Bearer {token}"}).status_code == 401
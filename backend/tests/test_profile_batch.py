@@ -0,0 +1,38 @@
+# backend/tests/test_profile_batch.py
+import uuid
+
+from tests.test_main import client
+from tests.test_ws import _register_and_login
+from app.profile_cache import profile_cache
+
+
+def test_batch_profiles_are_cached_and_invalidated(client):
+    """Тест: профили отдаются пачкой в порядке запроса, из кэша, и обновляются после правки."""
+    users = [_register_and_login(client, f"batch_{name}") for name in ("rita", "sam", "tara")]
+    ids = [user_id for user_id, _ in users]
+    profile_cache.clear()
+    loads = profile_cache.db_loads
+
+    response = client.get("/api/users/batch", params={"ids": [f"{ids[2]},{ids[0]}", ids[1], str(uuid.uuid4())]})
+    assert response.status_code == 200
+    profiles = response.json()
+    assert [p["id"] for p in profiles] == [ids[2], ids[0], ids[1]]
+    assert profiles[0]["languages"][0]["code"] == "ws"
+    assert profile_cache.db_loads == loads + 1
+
+    # Одиночный профиль берётся из того же кэша
+    assert client.get(f"/api/users/{ids[1]}").json()["username"] == "batch_sam"
+    assert profile_cache.db_loads == loads + 1
+
+    user_id, token = users[0]
+    assert client.put(f"/api/users/{user_id}", json={"bio": "updated"},
+                      headers={"Authorization": f"Bearer {token}"}).status_code == 200
+    profiles = client.get("/api/users/batch", params={"ids": ids}).json()
+    assert {p["id"]: p["bio"] for p in profiles}[user_id] == "updated"
+    assert profile_cache.db_loads == loads + 2
+
+
+def test_batch_profiles_validate_ids(client):
+    assert client.get("/api/users/batch", params={"ids": "not-a-uuid"}).status_code == 400
+    too_many = ",".join(str(uuid.uuid4()) for _ in range(101))
+    assert client.get("/api/users/batch", params={"ids": too_many}).status_code == 400
@@ -0,0 +1,124 @@
+# backend/tests/test_push_dispatcher.py
+import asyncio
+import threading
+import time
+
+from app.fcm_service import PushDispatcher, PushJob, PushSender, coalesce_jobs, FCM_MULTICAST_LIMIT
+
+
+class RecordingPushSender(PushSender):
+    """Локальная замена FCM: записывает вызовы и имитирует медленный HTTP-запрос."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.threads = set()
+
+    def send_multicast(self, tokens, notification_data, message_data):
+        self.threads.add(threading.current_thread().name)
+        time.sleep(self.delay)
+        self.calls.append((list(tokens), notification_data, message_data))
+        return len(tokens), 0
+
+
+def _message_job(tokens, chat_id, body):
+    return PushJob(
+        tokens,
+        {"title": "alice", "body": body},
+        {"type": "new_message", "chat_id": chat_id, "message_content": body},
+        coalesce_key=f"new_message:{chat_id}",
+    )
+
+
+def test_coalesce_same_chat_per_recipient():
+    """Тест: несколько сообщений одного чата одному получателю склеиваются в одно уведомление."""
+    jobs = [_message_job(["t1", "t2"], "chat-a", f"m{i}") for i in range(3)]
+    jobs.append(_message_job(["t1"], "chat-b", "other chat"))
+    jobs.append(PushJob(["t1"], {"title": "call"}, {"type": "incoming_call"}))
+    jobs.append(PushJob(["t1"], {"title": "call"}, {"type": "incoming_call"}))
+
+    batches = coalesce_jobs(jobs)
+    by_body = {(n.get("body"), d.get("coalesced_count")): sorted(t) for t, n, d in batches}
+
+    assert by_body[("m2", "3")] == ["t1", "t2"]
+    assert by_body[("other chat", None)] == ["t1"]
+    # Звонки не склеиваются, но одинаковые уведомления объединяются в один multicast
+    call_batches = [t for t, n, d in batches if d["type"] == "incoming_call"]
+    assert call_batches == [["t1", "t1"]]
+
+
+def test_batches_respect_multicast_limit():
+    """Тест: токены режутся на пакеты не больше лимита FCM."""
+    tokens = [f"token-{i}" for i in range(FCM_MULTICAST_LIMIT * 2 + 1)]
+    batches = coalesce_jobs([_message_job(tokens, "chat", "hello")])
+    assert [len(t) for t, _, _ in batches] == [FCM_MULTICAST_LIMIT, FCM_MULTICAST_LIMIT, 1]
+
+
+def test_dispatcher_does_not_block_event_loop():
+    """Тест: медленный отправитель работает в пуле потоков, event loop свободен."""
+    sender = RecordingPushSender(delay=0.3)
+
+    async def scenario():
+        dispatcher = PushDispatcher(sender=sender, window_ms=10)
+        started = time.monotonic()
+        for i in range(3):
+            dispatcher.submit(_message_job(["t1"], "chat", f"m{i}"))
+        await asyncio.sleep(0.05)
+        loop_latency = time.monotonic() - started
+        await dispatcher.stop()
+        return loop_latency
+
+    loop_latency = asyncio.run(scenario())
+
+    assert loop_latency < 0.2
+    assert len(sender.calls) == 1
+    assert sender.calls[0][2]["coalesced_count"] == "3"
+    assert all(name.startswith("push") for name in sender.threads)
+
+
+def test_deferred_push_is_dropped_when_condition_fails():
+    """Тест: отложенное уведомление уходит, только если получатель так и не вернулся в чат."""
+    sender = RecordingPushSender()
+
+    async def scenario():
+        dispatcher = PushDispatcher(sender=sender, window_ms=0)
+        dispatcher.submit_later(_message_job(["returned"], "chat", "m1"), 0.02, condition=lambda: False)
+        dispatcher.submit_later(_message_job(["offline"], "chat", "m1"), 0.02, condition=lambda: True)
+        await asyncio.sleep(0.01)
+        assert sender.calls == []
+        await asyncio.sleep(0.05)
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+
+    assert [tokens for tokens, _, _ in sender.calls] == [["offline"]]
+
+
+def test_stop_sends_jobs_waiting_for_coalesce_window():
+    """Тест: остановка во время окна склейки отправляет уже принятые уведомления."""
+    sender = RecordingPushSender()
+
+    async def scenario():
+        dispatcher = PushDispatcher(sender=sender, window_ms=100)
+        dispatcher.submit(_message_job(["t1"], "chat", "before stop"))
+        await asyncio.sleep(0.01)
+        # Задание уже забрано из очереди и ждёт окна
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+    assert [n["body"] for _, n, _ in sender.calls] == ["before stop"]
+
+
+def test_stop_cancels_delayed_pushes():
+    """Тест: отложенное уведомление не срабатывает после остановки и не перезапускает диспетчер."""
+    sender = RecordingPushSender()
+
+    async def scenario():
+        dispatcher = PushDispatcher(sender=sender, window_ms=0)
+        dispatcher.submit_later(_message_job(["late"], "chat", "m1"), 0.02)
+        await dispatcher.stop()
+        await asyncio.sleep(0.05)
+        assert dispatcher._task.done()
+
+    asyncio.run(scenario())
+    assert sender.calls == []
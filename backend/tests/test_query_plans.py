@@ -0,0 +1,176 @@
+# backend/tests/test_query_plans.py
+"""
+Регрессионные тесты планов запросов.
+
+Горячие эндпоинты вызываются на заполненной базе, все их SELECT/UPDATE
+перехватываются и прогоняются через EXPLAIN. Тест падает, если по одной из
+больших таблиц идёт полный проход. По умолчанию проверяется SQLite; чтобы
+проверить Postgres, запустите тесты с DATABASE_URL=postgresql://...
+(там перед EXPLAIN отключается enable_seqscan, так что на маленьких
+тестовых таблицах проверяется именно наличие подходящего индекса).
+"""
+import asyncio
+import json
+import re
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from tests.test_main import client
+from tests.test_ws import _register_and_login
+from app import models
+from app.chat_cache import ChatDirectory
+from app.database import SessionLocal, engine, async_engine, AsyncSessionLocal
+from app.language_cache import language_cache
+from app.matching import sync_user_matches
+from app.message_writer import fetch_messages_since
+
+# Таблицы, которые растут вместе с нагрузкой
+LARGE_TABLES = {"messages", "chat_participants", "user_languages", "language_matches"}
+
+_SQL_PREFIXES = ("SELECT", "UPDATE", "DELETE", "WITH")
+
+
+@contextmanager
+def captured_statements(target_engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(_SQL_PREFIXES):
+            statements.append((statement, parameters))
+
+    event.listen(target_engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(target_engine, "before_cursor_execute", record)
+
+
+def _table_of(name: str) -> str:
+    # Псевдонимы SQLAlchemy: messages_1, chat_participants_2
+    return re.sub(r"_\d+$", "", name)
+
+
+def full_scans(statement, parameters) -> list:
+    """Большие таблицы, которые запрос читает целиком."""
+    with engine.connect() as connection:
+        if engine.dialect.name == "postgresql":
+            connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            scans, nodes = [], [plan[0]["Plan"]]
+            while nodes:
+                node = nodes.pop()
+                if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in LARGE_TABLES:
+                    scans.append(node["Relation Name"])
+                nodes.extend(node.get("Plans", []))
+            return scans
+
+        rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+        scans = []
+        for row in rows:
+            match = re.match(r"SCAN (\w+)", row[-1])
+            if match and _table_of(match.group(1)) in LARGE_TABLES:
+                scans.append(row[-1])
+        return scans
+
+
+def assert_no_full_scans(statements):
+    problems = []
+    for statement, parameters in statements:
+        scans = full_scans(statement, parameters)
+        if scans:
+            problems.append(f"{scans}\n{statement}")
+    assert not problems, "Full table scans in hot queries:\n\n" + "\n\n".join(problems)
+
+
+@pytest.fixture(scope="module")
+def seeded(client):
+    """Пользователь с языками и несколькими чатами, в каждом по сотне сообщений, плюс фоновые пользователи."""
+    user_id, token = _register_and_login(client, "plan_owner")
+    db = SessionLocal()
+    owner = db.get(models.User, uuid.UUID(user_id))
+    english = db.query(models.Language).filter(models.Language.code == "plan_en").first()
+    if english is None:
+        english = models.Language(name="Plan English", code="plan_en")
+        db.add(english)
+        db.flush()
+
+    start = datetime(2024, 1, 1)
+    chat_ids = []
+    for c in range(5):
+        partner = models.User(username=f"plan_partner_{c}", hashed_password="x")
+        partner.language_associations.append(
+            models.UserLanguageAssociation(language_id=english.id, type="native", level="native"))
+        chat = models.Chat(title=f"Plan chat {c}")
+        chat.participants.extend([owner, partner])
+        db.add(chat)
+        db.flush()
+        sync_user_matches(db, partner.id, [(english.id, "native")])
+        for i in range(100):
+            db.add(models.Message(chat_id=chat.id, sender_id=partner.id if i % 2 else owner.id,
+                                  content=f"m{i}", search_text=f"m{i}", seq=i + 1, timestamp=start + timedelta(minutes=i)))
+        chat.last_seq = 100
+        chat_ids.append(str(chat.id))
+    db.commit()
+    db.close()
+    language_cache.refresh()
+    return {"token": token, "chat_ids": chat_ids}
+
+
+def test_chat_endpoints_use_indexes(client, seeded):
+    headers = {"Authorization": f"Bearer {seeded['token']}"}
+    chat_id = seeded["chat_ids"][0]
+    with captured_statements(engine) as statements:
+        assert client.get("/api/chats/?limit=20", headers=headers).status_code == 200
+        page = client.get(f"/api/chats/{chat_id}/messages?limit=20")
+        assert page.status_code == 200
+        client.get(f"/api/chats/{chat_id}/messages",
+                   params={"limit": 20, "before": page.headers["X-Prev-Cursor"]})
+        assert client.post(f"/api/chats/{chat_id}/read", headers=headers).status_code == 204
+    assert statements
+    assert_no_full_scans(statements)
+
+
+def test_user_search_uses_indexes(client, seeded):
+    with captured_statements(engine) as statements:
+        response = client.get("/api/users/?native_lang_code=plan_en")
+        assert response.status_code == 200
+        assert len(response.json()) == 5
+        page = client.get("/api/users/?native_lang_code=plan_en&limit=2")
+        client.get(f"/api/users/?native_lang_code=plan_en&limit=2&cursor={page.headers['X-Next-Cursor']}")
+        response = client.get("/api/users/partners?native_lang_code=plan_en&limit=2",
+                              headers={"Authorization": f"Bearer {seeded['token']}"})
+        assert response.status_code == 200
+    assert_no_full_scans(statements)
+
+
+def test_message_search_uses_indexes(client, seeded):
+    headers = {"Authorization": f"Bearer {seeded['token']}"}
+    with captured_statements(engine) as statements:
+        response = client.get("/api/search/messages", params={"q": "m42", "limit": 2}, headers=headers)
+        assert response.status_code == 200
+        assert len(response.json()) == 2
+        client.get("/api/search/messages", headers=headers,
+                   params={"q": "m42", "limit": 2, "cursor": response.headers["X-Next-Cursor"]})
+    assert_no_full_scans(statements)
+
+
+@pytest.mark.skipif(engine.dialect.name != "sqlite", reason="asyncpg и psycopg2 используют разные плейсхолдеры")
+def test_websocket_path_queries_use_indexes(seeded):
+    chat_id = seeded["chat_ids"][1]
+
+    async def scenario():
+        directory = ChatDirectory()
+        members = await directory.chat_members(chat_id)
+        await directory.push_profiles(members)
+        async with AsyncSessionLocal() as db:
+            assert len(await fetch_messages_since(db, uuid.UUID(chat_id), 90, 50)) == 10
+
+    with captured_statements(async_engine.sync_engine) as statements:
+        asyncio.run(scenario())
+    assert_no_full_scans(statements)
@@ -0,0 +1,105 @@
+# backend/tests/test_search.py
+import json
+
+import pytest
+
+from tests.test_main import client
+from tests.test_ws import _register_and_login
+from app import models
+from app.search import matched_words
+
+
+@pytest.fixture(scope="module")
+def search_chats(client):
+    """Фрэнк переписывается с Грейс; у Грейс есть ещё чат с Хайди, куда Фрэнк не входит."""
+    frank_id, frank_token = _register_and_login(client, "search_frank")
+    grace_id, grace_token = _register_and_login(client, "search_grace")
+    heidi_id, _ = _register_and_login(client, "search_heidi")
+
+    def private_chat(token, partner_id):
+        response = client.post(f"/api/chats/get-or-create/private?partner_id={partner_id}",
+                               headers={"Authorization": f"Bearer {token}"})
+        return response.json()["id"]
+
+    shared = private_chat(frank_token, grace_id)
+    foreign = private_chat(grace_token, heidi_id)
+    return {"frank": (frank_id, {"Authorization": f"Bearer {frank_token}"}),
+            "grace": grace_id, "heidi": heidi_id, "shared": shared, "foreign": foreign}
+
+
+def _send(client, chat_id, sender_id, content, type="text"):
+    response = client.post("/api/messages/",
+                           params={"chat_id": chat_id, "sender_id": sender_id, "content": content, "type": type})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_search_text_and_transcriptions(client, search_chats):
+    """Тест: поиск находит текст и расшифровку медиа только в чатах пользователя."""
+    frank_id, headers = search_chats["frank"]
+    shared, foreign = search_chats["shared"], search_chats["foreign"]
+
+    text_id = _send(client, shared, search_chats["grace"], "Let's meet at the harbour tomorrow")
+    _send(client, shared, frank_id, "See you tomorrow")
+    _send(client, foreign, search_chats["heidi"], "The harbour is closed")
+    audio_id = _send(client, shared, search_chats["grace"], json.dumps({"url": "/media/v.m4a"}), type="audio")
+    transcription = {
+        "full_text": "Meet me near the harbour gate",
+        "words": [{"word": " Meet", "start": 0.0, "end": 0.3}, {"word": " me", "start": 0.3, "end": 0.4},
+                  {"word": " near", "start": 0.4, "end": 0.6}, {"word": " the", "start": 0.6, "end": 0.7},
+                  {"word": " harbour", "start": 0.7, "end": 1.1}, {"word": " gate.", "start": 1.1, "end": 1.4}],
+    }
+    assert client.put(f"/api/media/transcribe/{audio_id}", json=transcription).status_code == 200
+
+    response = client.get("/api/search/messages", params={"q": "harbour"}, headers=headers)
+    assert response.status_code == 200
+    hits = {hit["message"]["id"]: hit for hit in response.json()}
+    assert set(hits) == {text_id, audio_id}
+    assert hits[text_id]["words"] == []
+    assert hits[audio_id]["words"] == [{"word": "harbour", "start": 0.7, "end": 1.1}]
+
+    # Все слова запроса должны совпасть; синтаксис FTS в запросе — просто текст
+    response = client.get("/api/search/messages", params={"q": 'harbour "gate" OR'}, headers=headers)
+    assert [hit["message"]["id"] for hit in response.json()] == []
+    response = client.get("/api/search/messages", params={"q": "harbour gate"}, headers=headers)
+    assert [hit["message"]["id"] for hit in response.json()] == [audio_id]
+
+    response = client.get("/api/search/messages", params={"q": "tomorrow", "chat_id": foreign}, headers=headers)
+    assert response.json() == []
+
+    assert client.get("/api/search/messages", params={"q": "..."}, headers=headers).status_code == 400
+
+
+def test_search_pagination(client, search_chats):
+    """Тест: выдача листается курсором без повторов и пропусков."""
+    frank_id, headers = search_chats["frank"]
+    sent = {_send(client, search_chats["shared"], frank_id, f"paging marker {i}") for i in range(5)}
+
+    seen, cursor = [], None
+    while True:
+        params = {"q": "marker", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/api/search/messages", params=params, headers=headers)
+        page = response.json()
+        assert len(page) <= 2
+        seen.extend(hit["message"]["id"] for hit in page)
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert sorted(seen) == sorted(sent)
+
+    ranks = [hit["rank"] for hit in client.get("/api/search/messages", params={"q": "marker"}, headers=headers).json()]
+    assert ranks == sorted(ranks, reverse=True)
+
+
+def test_matched_words_skips_malformed_entries():
+    """Тест: слово расшифровки без времени или текста пропускается, а не ломает выдачу."""
+    content = json.dumps({"transcription": {"full_text": "harbour harbour harbour", "words": [
+        {"word": " harbour"},
+        "harbour",
+        {"word": None, "start": 0.1, "end": 0.2},
+        {"word": " harbour", "start": 0.7, "end": 1.1},
+    ]}})
+    message = models.Message(type="audio", content=content)
+    assert matched_words(message, "harbour") == [{"word": "harbour", "start": 0.7, "end": 1.1}]
@@ -0,0 +1,59 @@
+# backend/tests/test_security.py
+import asyncio
+import threading
+
+import pytest
+
+from app import security
+from app.security import PasswordHasher, PasswordHasherBusy
+
+
+def test_password_helpers_run_in_pool():
+    """Тест: асинхронные хэширование и проверка пароля совместимы с синхронными."""
+    async def scenario():
+        hashed = await security.hash_password("s3cret")
+        return hashed, await security.check_password("s3cret", hashed), await security.check_password("nope", hashed)
+
+    hashed, ok, wrong = asyncio.run(scenario())
+    assert security.verify_password("s3cret", hashed)
+    assert ok is True and wrong is False
+
+
+def test_hasher_rejects_when_queue_is_full():
+    """Тест: сверх max_pending вызовов пул сразу отказывает, а после разгрузки снова принимает."""
+    hasher = PasswordHasher(workers=1, max_pending=2)
+    release = threading.Event()
+
+    async def scenario():
+        running = [asyncio.create_task(hasher.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.run(release.wait)
+        release.set()
+        await asyncio.gather(*running)
+        return await hasher.run(lambda: "ok")
+
+    assert asyncio.run(scenario()) == "ok"
+    assert hasher.rejected == 1
+    assert hasher.pending == 0
+
+
+def test_cancelled_request_keeps_slot_until_hash_finishes():
+    """Тест: отмена ожидающего запроса не освобождает слот, пока bcrypt ещё работает в пуле."""
+    hasher = PasswordHasher(workers=1, max_pending=1)
+    release = threading.Event()
+
+    async def scenario():
+        request = asyncio.create_task(hasher.run(release.wait))
+        await asyncio.sleep(0.01)
+        request.cancel()
+        await asyncio.sleep(0.01)
+        assert hasher.pending == 1
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.run(lambda: "ok")
+        release.set()
+        await asyncio.sleep(0.01)
+        return await hasher.run(lambda: "ok")
+
+    assert asyncio.run(scenario()) == "ok"
+    assert hasher.pending == 0
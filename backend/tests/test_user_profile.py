@@ -7,6 +7,7 @@ from .test_main import app, override_get_db
 
 # Импортируем сессию и модели напрямую для подготовки данных
 from app.database import SessionLocal
+from app.language_cache import language_cache
 from app.models import Language
 
 # Используем тот же клиент, что и в других тестах
@@ -21,6 +22,7 @@ def setup_and_seed_languages():
     db = SessionLocal()
     seed_languages(db)
     db.close()
+    language_cache.refresh()
 
 def seed_languages(db_session):
     """Наполняет базу данных начальным списком языков, если их там нет."""
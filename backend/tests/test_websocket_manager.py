@@ -0,0 +1,224 @@
+# backend/tests/test_websocket_manager.py
+import asyncio
+import json
+
+from app.pubsub import LocalBroker, ChunkAssembler, split_notify_payload
+from app.websocket_manager import ConnectionManager, SLOW_CONSUMER_CLOSE_CODE
+
+
+class FakeWebSocket:
+    """Имитация WebSocket: записывает отправленное, при stall=True «зависает» на отправке."""
+
+    def __init__(self, stall=False, broken=False):
+        self.stall = stall
+        self.broken = broken
+        self.sent = []
+        self.frames = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        if self.stall:
+            await asyncio.sleep(3600)
+        if self.broken:
+            raise RuntimeError("connection reset")
+        self.frames.append(data)
+        self.sent.append(json.loads(data))
+
+    async def send_bytes(self, data):
+        self.frames.append(data)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def test_broadcast_is_not_blocked_by_stalled_client():
+    """Тест: зависший клиент не задерживает доставку остальным."""
+    async def scenario():
+        manager = ConnectionManager(max_queue_size=8, send_timeout=0.2)
+        fast, slow = FakeWebSocket(), FakeWebSocket(stall=True)
+        await manager.connect("chat", "fast", fast)
+        await manager.connect("chat", "slow", slow)
+
+        await asyncio.wait_for(manager.broadcast("chat", {"n": 1}), timeout=0.05)
+        await asyncio.sleep(0.01)
+        assert fast.sent == [{"n": 1}]
+
+        # После таймаута отправки медленный клиент вытесняется
+        await asyncio.sleep(0.3)
+        assert slow.close_code == SLOW_CONSUMER_CLOSE_CODE
+        assert {c.user_id for c in manager.chat_connections("chat")} == {"fast"}
+        assert "slow" not in manager.user_connections
+
+    asyncio.run(scenario())
+
+
+def test_queue_overflow_evicts_client():
+    """Тест: переполнение очереди вытесняет клиента сразу, не дожидаясь таймаута."""
+    async def scenario():
+        manager = ConnectionManager(max_queue_size=2, send_timeout=60)
+        slow = FakeWebSocket(stall=True)
+        await manager.connect("chat", "slow", slow)
+        for i in range(5):
+            await manager.broadcast("chat", {"n": i})
+        await asyncio.sleep(0.01)
+        assert slow.close_code == SLOW_CONSUMER_CLOSE_CODE
+        assert "chat" not in manager.chat_subscribers
+
+    asyncio.run(scenario())
+
+
+def test_send_error_evicts_client():
+    """Тест: ошибка отправки убирает соединение из реестра, как и таймаут."""
+    async def scenario():
+        manager = ConnectionManager(send_timeout=60)
+        healthy, broken = FakeWebSocket(), FakeWebSocket(broken=True)
+        await manager.connect("chat", "healthy", healthy)
+        await manager.connect("chat", "broken", broken)
+        await manager.broadcast("chat", {"n": 1})
+        await asyncio.sleep(0.01)
+        assert healthy.sent == [{"n": 1}]
+        assert {c.user_id for c in manager.chat_connections("chat")} == {"healthy"}
+        assert "broken" not in manager.user_connections
+
+    asyncio.run(scenario())
+
+
+def test_broadcast_to_others_skips_sender():
+    """Тест: сигнальное сообщение не возвращается отправителю."""
+    async def scenario():
+        manager = ConnectionManager()
+        alice, bob = FakeWebSocket(), FakeWebSocket()
+        alice_conn = await manager.connect("chat", "alice", alice)
+        bob_conn = await manager.connect("chat", "bob", bob)
+        await manager.broadcast_to_others("chat", "alice", {"type": "call_offer"})
+        await asyncio.sleep(0.01)
+        assert alice.sent == []
+        assert bob.sent == [{"type": "call_offer"}]
+        manager.disconnect(alice_conn)
+        manager.disconnect(bob_conn)
+        assert manager.chat_subscribers == {}
+        assert manager.user_connections == {}
+
+    asyncio.run(scenario())
+
+
+def test_broadcast_encodes_payload_once():
+    """Тест: все получатели получают один и тот же заранее закодированный кадр."""
+    async def scenario():
+        manager = ConnectionManager()
+        sockets = [FakeWebSocket() for _ in range(3)]
+        for i, ws in enumerate(sockets):
+            await manager.connect("chat", f"user{i}", ws)
+
+        await manager.broadcast("chat", {"content": "привет"})
+        await manager.broadcast("chat", b"\x00binary")
+        await asyncio.sleep(0.01)
+
+        first_frames = [ws.frames[0] for ws in sockets]
+        assert all(frame is first_frames[0] for frame in first_frames)
+        assert json.loads(first_frames[0]) == {"content": "привет"}
+        assert all(ws.frames[1] == b"\x00binary" for ws in sockets)
+
+    asyncio.run(scenario())
+
+
+def test_broadcast_reaches_clients_on_other_nodes():
+    """Тест: сообщение, отправленное на узле A, доходит до клиента на узле B."""
+    async def scenario():
+        broker = LocalBroker()
+        node_a = ConnectionManager(pubsub=broker.backend())
+        node_b = ConnectionManager(pubsub=broker.backend())
+        await node_a.start()
+        await node_b.start()
+
+        on_a, on_b = FakeWebSocket(), FakeWebSocket()
+        await node_a.connect("chat", "alice", on_a)
+        await node_b.connect("chat", "bob", on_b)
+
+        await node_a.broadcast("chat", {"content": "hi"})
+        await node_b.broadcast_to_others("chat", "bob", {"type": "call_end"})
+        await asyncio.sleep(0.01)
+
+        # Каждый узел доставляет сообщение своим клиентам ровно один раз
+        assert on_a.sent == [{"content": "hi"}, {"type": "call_end"}]
+        assert on_b.sent == [{"content": "hi"}]
+
+        await node_a.stop()
+        await node_b.stop()
+
+    asyncio.run(scenario())
+
+
+def test_multiplexed_connections_and_multiple_devices():
+    """Тест: одно соединение на несколько чатов и несколько устройств одного пользователя."""
+    async def scenario():
+        manager = ConnectionManager()
+        phone, tablet, legacy = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        phone_conn = await manager.connect_user("alice", phone)
+        tablet_conn = await manager.connect_user("alice", tablet)
+        await manager.connect("chat-1", "alice", legacy)
+        for chat_id in ("chat-1", "chat-2"):
+            manager.subscribe(phone_conn, chat_id)
+        manager.subscribe(tablet_conn, "chat-2")
+
+        await manager.broadcast("chat-1", {"chat_id": "chat-1"})
+        await manager.broadcast("chat-2", {"chat_id": "chat-2"})
+        await manager.send_to_user("alice", {"type": "personal"})
+        await asyncio.sleep(0.01)
+
+        assert phone.sent == [{"chat_id": "chat-1"}, {"chat_id": "chat-2"}, {"type": "personal"}]
+        assert tablet.sent == [{"chat_id": "chat-2"}, {"type": "personal"}]
+        assert legacy.sent == [{"chat_id": "chat-1"}, {"type": "personal"}]
+
+        manager.unsubscribe(phone_conn, "chat-1")
+        manager.disconnect(tablet_conn)
+        assert manager.chat_subscribers["chat-2"] == {phone_conn}
+        assert len(manager.user_connections["alice"]) == 2
+
+    asyncio.run(scenario())
+
+
+def test_presence_is_shared_between_nodes():
+    """Тест: узел B знает, что пользователь открыл чат на узле A, и когда он оттуда ушёл."""
+    async def scenario():
+        broker = LocalBroker()
+        node_a = ConnectionManager(pubsub=broker.backend())
+        node_b = ConnectionManager(pubsub=broker.backend())
+        await node_a.start()
+        await node_b.start()
+
+        connection = await node_a.connect_user("alice", FakeWebSocket())
+        node_a.subscribe(connection, "chat")
+        await asyncio.sleep(0.01)
+        assert node_a.is_present("alice", "chat")
+        assert node_b.is_present("alice", "chat")
+        assert not node_b.is_present("alice", "other-chat")
+        assert node_b.seconds_since_seen("alice", "chat") is None
+
+        node_a.disconnect(connection)
+        await asyncio.sleep(0.01)
+        assert not node_b.is_present("alice", "chat")
+        assert node_b.seconds_since_seen("alice", "chat") < 1
+        assert node_a.seconds_since_seen("alice", "chat") < 1
+
+        await node_a.stop()
+        await node_b.stop()
+
+    asyncio.run(scenario())
+
+
+def test_notify_payload_chunking_roundtrip():
+    """Тест: большие сообщения режутся под лимит NOTIFY и собираются обратно."""
+    payload = "сообщение " * 3000
+    chunks = split_notify_payload(payload)
+    assert len(chunks) > 1
+    assert all(len(chunk.encode("utf-8")) < 8000 for chunk in chunks)
+
+    assembler = ChunkAssembler()
+    results = [assembler.feed(chunk) for chunk in reversed(chunks)]
+    assert results[:-1] == [None] * (len(chunks) - 1)
+    assert results[-1] == payload
+    assert assembler.feed(split_notify_payload("short")[0]) == "short"
@@ -0,0 +1,215 @@
+# backend/tests/test_ws.py
+import pytest
+
+from tests.test_main import client
+from app.database import SessionLocal
+from app.language_cache import language_cache
+from app.models import Language
+
+
+def _register_and_login(client, username):
+    """Регистрирует пользователя и возвращает (user_id, token)."""
+    db = SessionLocal()
+    language = db.query(Language).filter(Language.code == "ws").first()
+    if language is None:
+        language = Language(name="WebSocketese", code="ws")
+        db.add(language)
+        db.commit()
+        # Язык добавлен в обход API — справочник перечитываем явно
+        language_cache.refresh()
+    language_id = language.id
+    db.close()
+
+    response = client.post(
+        "/api/users/register",
+        json={"username": username, "password": "pass", "native_language_id": language_id},
+    )
+    assert response.status_code == 201
+    token_response = client.post(
+        "/api/users/token",
+        data={"username": username, "password": "pass"},
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    assert token_response.status_code == 200
+    return response.json()["id"], token_response.json()["access_token"]
+
+
+@pytest.fixture(scope="module")
+def private_chat(client):
+    """Два пользователя и личный чат между ними."""
+    alice_id, alice_token = _register_and_login(client, "ws_alice")
+    bob_id, bob_token = _register_and_login(client, "ws_bob")
+    response = client.post(
+        f"/api/chats/get-or-create/private?partner_id={bob_id}",
+        headers={"Authorization": f"Bearer {alice_token}"},
+    )
+    assert response.status_code == 200
+    return {
+        "chat_id": response.json()["id"],
+        "alice": (alice_id, alice_token),
+        "bob": (bob_id, bob_token),
+    }
+
+
+def test_multiplexed_socket_requires_token(client):
+    """Тест: без действительного токена соединение отклоняется."""
+    from starlette.websockets import WebSocketDisconnect
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/ws/user?token=garbage") as ws:
+            ws.receive_text()
+
+
+def test_multiplexed_socket_subscribe_and_receive(client, private_chat):
+    """Тест: сообщение из мультиплексного сокета доходит до всех устройств получателя."""
+    chat_id = private_chat["chat_id"]
+    alice_id, alice_token = private_chat["alice"]
+    _, bob_token = private_chat["bob"]
+    foreign_chat_id = "00000000-0000-0000-0000-000000000000"
+
+    with client.websocket_connect(f"/ws/user?token={alice_token}") as alice_ws, \
+            client.websocket_connect(f"/ws/user?token={bob_token}") as bob_phone, \
+            client.websocket_connect(f"/ws/{chat_id}?user_id=bob-tablet") as bob_tablet:
+        alice_ws.send_json({"action": "subscribe", "chat_ids": [chat_id, foreign_chat_id]})
+        ack = alice_ws.receive_json()
+        assert ack == {"type": "subscribed", "chat_ids": [chat_id], "denied": [foreign_chat_id]}
+
+        bob_phone.send_json({"action": "subscribe", "chat_id": chat_id})
+        assert bob_phone.receive_json()["chat_ids"] == [chat_id]
+
+        alice_ws.send_json({"chat_id": chat_id, "type": "text", "content": "Привет!", "client_message_id": "tmp-1"})
+
+        own_copy = alice_ws.receive_json()
+        assert own_copy["client_message_id"] == "tmp-1"
+        assert own_copy["sender_id"] == alice_id
+        for socket in (bob_phone, bob_tablet):
+            message = socket.receive_json()
+            assert message["content"] == "Привет!"
+            assert message["chat_id"] == chat_id
+
+        bob_phone.send_json({"chat_id": chat_id, "type": "text", "content": "Ответ", "reply_to_message_id": own_copy["id"]})
+        reply = alice_ws.receive_json()
+        assert reply["reply_to_message"]["id"] == own_copy["id"]
+        assert reply["reply_to_message"]["content"] == "Привет!"
+        for socket in (bob_phone, bob_tablet):
+            assert socket.receive_json()["id"] == reply["id"]
+
+        alice_ws.send_json({"chat_id": foreign_chat_id, "type": "text", "content": "x"})
+        assert alice_ws.receive_json()["error"] == "Not subscribed to chat"
+
+
+def test_reconnect_replays_only_missed_messages(client, private_chat):
+    """Тест: при переподключении с since_seq приходят только пропущенные сообщения, по порядку."""
+    chat_id = private_chat["chat_id"]
+    _, alice_token = private_chat["alice"]
+
+    with client.websocket_connect(f"/ws/user?token={alice_token}") as alice_ws:
+        alice_ws.send_json({"action": "subscribe", "chat_ids": [chat_id]})
+        alice_ws.receive_json()
+        sent = []
+        for i in range(3):
+            alice_ws.send_json({"chat_id": chat_id, "type": "text", "content": f"gap {i}"})
+            sent.append(alice_ws.receive_json())
+
+    seqs = [m["seq"] for m in sent]
+    assert seqs == sorted(seqs) and len(set(seqs)) == 3
+
+    with client.websocket_connect(f"/ws/{chat_id}?user_id=bob-tablet&since_seq={seqs[0]}") as legacy:
+        assert [legacy.receive_json()["id"] for _ in range(2)] == [m["id"] for m in sent[1:]]
+
+    _, bob_token = private_chat["bob"]
+    with client.websocket_connect(f"/ws/user?token={bob_token}") as bob_ws:
+        bob_ws.send_json({"action": "subscribe", "chat_ids": [chat_id], "since_seq": {chat_id: seqs[1]}})
+        assert bob_ws.receive_json()["type"] == "subscribed"
+        assert bob_ws.receive_json()["id"] == sent[2]["id"]
+        bob_ws.send_json({"chat_id": chat_id, "type": "text", "content": "live"})
+        live = bob_ws.receive_json()
+        assert live["content"] == "live"
+        assert live["seq"] == seqs[2] + 1
+
+
+def test_legacy_reconnect_closes_when_gap_exceeds_replay_limit(client, private_chat, monkeypatch):
+    """Тест: если пропущено больше WS_REPLAY_LIMIT, /ws/{chat_id} закрывается кодом REPLAY_GAP_CLOSE_CODE."""
+    from starlette.websockets import WebSocketDisconnect
+    from app.routers import ws
+
+    chat_id = private_chat["chat_id"]
+    _, alice_token = private_chat["alice"]
+    with client.websocket_connect(f"/ws/user?token={alice_token}") as alice_ws:
+        alice_ws.send_json({"action": "subscribe", "chat_ids": [chat_id]})
+        alice_ws.receive_json()
+        sent = []
+        for i in range(3):
+            alice_ws.send_json({"chat_id": chat_id, "type": "text", "content": f"overflow {i}"})
+            sent.append(alice_ws.receive_json())
+
+    monkeypatch.setattr(ws, "WS_REPLAY_LIMIT", 2)
+    since = sent[0]["seq"] - 1
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect(f"/ws/{chat_id}?user_id=bob-tablet&since_seq={since}") as legacy:
+            legacy.receive_json()
+    assert closed.value.code == ws.REPLAY_GAP_CLOSE_CODE
+
+    # Пропуск в пределах лимита по-прежнему досылается
+    with client.websocket_connect(f"/ws/{chat_id}?user_id=bob-tablet&since_seq={since + 1}") as legacy:
+        assert [legacy.receive_json()["id"] for _ in range(2)] == [m["id"] for m in sent[1:]]
+
+
+def test_mark_read_broadcasts_coalesced_receipt(client, private_chat):
+    """Тест: отметки о прочтении склеиваются, событие получают только мультиплексные соединения."""
+    chat_id = private_chat["chat_id"]
+    alice_id, alice_token = private_chat["alice"]
+    bob_id, bob_token = private_chat["bob"]
+
+    with client.websocket_connect(f"/ws/user?token={alice_token}") as alice_ws, \
+            client.websocket_connect(f"/ws/user?token={bob_token}") as bob_ws, \
+            client.websocket_connect(f"/ws/{chat_id}?user_id=alice-legacy") as legacy:
+        alice_ws.send_json({"action": "subscribe", "chat_ids": [chat_id]})
+        alice_ws.receive_json()
+        bob_ws.send_json({"action": "subscribe", "chat_ids": [chat_id]})
+        bob_ws.receive_json()
+
+        alice_ws.send_json({"chat_id": chat_id, "type": "text", "content": "read me"})
+        message = alice_ws.receive_json()
+        bob_ws.receive_json()
+        legacy.receive_json()
+
+        bob_ws.send_json({"action": "mark_read", "chat_id": chat_id, "seq": message["seq"] - 1})
+        bob_ws.send_json({"action": "mark_read", "chat_id": chat_id})
+
+        receipt = alice_ws.receive_json()
+        assert receipt == {"type": "read_receipt", "chat_id": chat_id, "user_id": bob_id, "last_read_seq": message["seq"]}
+
+        alice_ws.send_json({"chat_id": chat_id, "type": "text", "content": "after receipt"})
+        assert legacy.receive_json()["content"] == "after receipt"
+
+
+def test_legacy_socket_cannot_mark_read(client, private_chat):
+    """Тест: /ws/{chat_id} с чужим user_id в query не двигает водяной знак прочтения."""
+    import uuid
+    from app import models
+
+    chat_id = private_chat["chat_id"]
+    _, alice_token = private_chat["alice"]
+    bob_id, _ = private_chat["bob"]
+
+    def bob_last_read():
+        db = SessionLocal()
+        try:
+            participants = models.chat_participants.c
+            return db.query(participants.last_read_seq).filter(
+                participants.chat_id == uuid.UUID(chat_id), participants.user_id == uuid.UUID(bob_id)).scalar()
+        finally:
+            db.close()
+
+    with client.websocket_connect(f"/ws/user?token={alice_token}") as alice_ws:
+        alice_ws.send_json({"action": "subscribe", "chat_ids": [chat_id]})
+        alice_ws.receive_json()
+        alice_ws.send_json({"chat_id": chat_id, "type": "text", "content": "unread for bob"})
+        alice_ws.receive_json()
+
+    before = bob_last_read()
+    with client.websocket_connect(f"/ws/{chat_id}?user_id={bob_id}") as forged:
+        forged.send_json({"action": "mark_read", "chat_id": chat_id})
+        assert forged.receive_json()["error"] == "mark_read is only supported on /ws/user"
+    assert bob_last_read() == before